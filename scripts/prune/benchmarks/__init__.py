@@ -0,0 +1,9 @@
+"""
+Benchmarks for the container image pruning tool.
+
+Each module can be run as a script from the prune script root, e.g.:
+
+    python -m benchmarks.memory --versions 100000
+    python -m benchmarks.throughput --versions 2000
+    python -m benchmarks.strategies --versions 1000000
+"""
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Memory held per listed version, before and after slotting ImageVersion.
+
+Synthetic GHCR version payloads are decoded a page at a time, the way the
+registry listing does, and turned into versions. The "payload" layout is
+the previous representation: a __dict__ object keeping a datetime, a list
+of tags and the whole decoded payload. The "slotted" layout is the current
+ImageVersion without payloads. Memory still allocated once the listing is
+done is measured with tracemalloc.
+
+Usage: python -m benchmarks.memory [--versions N]
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from registries.base import ImageVersion  # noqa: E402
+
+PAGE_SIZE = 100
+
+
+class PayloadImageVersion:
+    """The previous ImageVersion: a plain object that keeps the API payload."""
+
+    def __init__(self, id, name, created_at, tags, metadata=None):
+        self.id = id
+        self.name = name
+        self.created_at = created_at
+        self.tags = tags
+        self.metadata = metadata or {}
+
+
+def _payload_page(start: int, count: int) -> str:
+    """JSON for one page of GHCR package versions, every fifth one tagged."""
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    versions = []
+    for i in range(start, start + count):
+        digest = f'sha256:{i:064x}'
+        created = (base + timedelta(minutes=i)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        versions.append({
+            'id': 100000000 + i,
+            'name': digest,
+            'url': f'https://api.github.com/users/octocat/packages/container/app/versions/{100000000 + i}',
+            'package_html_url': 'https://github.com/users/octocat/packages/container/package/app',
+            'created_at': created,
+            'updated_at': created,
+            'html_url': f'https://github.com/users/octocat/packages/container/app/{100000000 + i}',
+            'metadata': {'package_type': 'container', 'container': {'tags': [f'v{i}'] if i % 5 == 0 else []}},
+        })
+    return json.dumps(versions)
+
+
+def _with_payload(data: Dict) -> PayloadImageVersion:
+    created = datetime.fromisoformat(data['created_at'].replace('Z', '+00:00'))
+    return PayloadImageVersion(str(data['id']), data['name'], created, data['metadata']['container']['tags'], data)
+
+
+def _slotted(data: Dict) -> ImageVersion:
+    created = datetime.fromisoformat(data['created_at'].replace('Z', '+00:00'))
+    return ImageVersion(str(data['id']), data['name'], created, data['metadata']['container']['tags'],
+                        digest=data['name'])
+
+
+LAYOUTS: Dict[str, Callable[[Dict], object]] = {
+    'payload': _with_payload,
+    'slotted': _slotted,
+}
+
+
+def measure(layout: str, count: int) -> float:
+    """Return the bytes still allocated per version after listing ``count`` versions."""
+    build = LAYOUTS[layout]
+    pages = [_payload_page(start, min(PAGE_SIZE, count - start)) for start in range(0, count, PAGE_SIZE)]
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        versions: List[object] = []
+        for page in pages:
+            versions.extend(build(data) for data in json.loads(page))
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0] - baseline
+    finally:
+        tracemalloc.stop()
+
+    del versions
+    return retained / count
+
+
+def run(count: int) -> Dict[str, float]:
+    """Measure every layout; returns bytes per version keyed by layout."""
+    return {layout: measure(layout, count) for layout in LAYOUTS}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--versions', type=int, default=100000, metavar='N',
+                        help='number of versions to list (default: 100000)')
+    args = parser.parse_args()
+
+    results = run(args.versions)
+    for layout, per_version in results.items():
+        print(f"{layout:>8}: {per_version:8.0f} bytes/version, {per_version * args.versions / 2**20:7.1f} MiB total")
+    print(f"   ratio: {results['payload'] / results['slotted']:.1f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Time to plan deletions from a large inventory, per version and columnar.
+
+A synthetic inventory is evaluated by every strategy twice: through
+select(), which looks at one ImageVersion at a time, and through
+select_table() on a VersionTable, with NumPy when it is installed and with
+the array module fallback. Every table run builds a fresh VersionTable,
+so its timing includes the columns (and the lazily built tag and group
+columns) that planning pays for, as prune_registry does.
+
+Usage: python -m benchmarks.strategies [--versions N]
+"""
+
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from registries.base import ImageVersion  # noqa: E402
+from policy import compile_policy  # noqa: E402
+from strategies import KeepLatestCount, KeepLatestPerGroup, PruneAllUntagged, PruneUntaggedByAge  # noqa: E402
+from table import VersionTable, np  # noqa: E402
+
+STRATEGIES = {
+    'untagged-age': lambda: PruneUntaggedByAge(30),
+    'all-untagged': PruneAllUntagged,
+    'keep-latest': lambda: KeepLatestCount(25),
+    'per-group': lambda: KeepLatestPerGroup(3),
+    'policy': lambda: compile_policy('latest 25 or tag "v*" or (untagged and age < 3d)', protect=['stable']),
+}
+
+
+def inventory(count: int, seed: int = 0) -> List[ImageVersion]:
+    """Versions spread over 90 days; a quarter are tagged, two tags to a digest."""
+    rng = random.Random(seed)
+    now = int(time.time())
+    tags = ['latest', 'stable', 'dev']
+    return [
+        ImageVersion(str(i), f'sha256:{i // 2:064x}', now - rng.randrange(90 * 86400),
+                     [f'v1.{i}' if i % 8 == 0 else rng.choice(tags)] if i % 4 == 0 else [],
+                     digest=f'sha256:{i // 2:064x}')
+        for i in range(count)
+    ]
+
+
+def _best(run: Callable[[], object], repeat: int = 3) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(count: int) -> Dict[str, Dict[str, float]]:
+    """Seconds taken per strategy and evaluation path (building the table included), plus table build times."""
+    versions = inventory(count)
+    # The inventory lives for the whole run; keep the collector from rescanning it
+    gc.freeze()
+
+    backends = {'array': False, **({'numpy': True} if np is not None else {})}
+    results = {'build table': {name: _best(lambda: VersionTable(versions, use_numpy=use_numpy))
+                               for name, use_numpy in backends.items()}}
+
+    for name, create in STRATEGIES.items():
+        strategy = create()
+        timings = {'select': _best(lambda: strategy.select(versions))}
+        for backend, use_numpy in backends.items():
+            timings[backend] = _best(lambda: strategy.select_table(VersionTable(versions, use_numpy=use_numpy)))
+        results[name] = timings
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--versions', type=int, default=1000000, metavar='N',
+                        help='number of versions in the inventory (default: 1000000)')
+    args = parser.parse_args()
+
+    results = run(args.versions)
+    print(f"{'':>14} {'select':>10} {'array':>10} {'numpy':>10}")
+    for name, timings in results.items():
+        cells = [f"{timings[path] * 1000:8.1f}ms" if path in timings else f"{'-':>10}"
+                 for path in ('select', 'array', 'numpy')]
+        print(f"{name:>14} {' '.join(cells)}")
+    if np is None:
+        print("NumPy is not installed; only the array module fallback was timed")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+End-to-end listing and delete throughput of main.py against the local stand-in server.
+
+For each registry and --concurrency level, a fresh tests.fake_registry
+server is seeded with synthetic versions and main.py is run against it
+twice in a subprocess: a dry run (listing only) and a real prune keeping
+the latest KEEP versions. Each run reports wall time, versions listed or
+deleted per second, the requests the server received per method and the
+number of connections opened.
+
+Results are written as JSON so runs on different commits can be compared
+with --compare.
+
+Usage: python -m benchmarks.throughput [--versions N] [--latency SECONDS] [--compare PATH]
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+SCRIPT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SCRIPT_DIR)
+
+from tests.fake_registry import FakeRegistry  # noqa: E402
+
+REGISTRIES = ('ghcr', 'dockerhub')
+CONTAINER = 'bench'
+NAMESPACE = 'benchuser'
+
+# Versions kept by the delete run
+KEEP = 10
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPT_DIR,
+                                capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip() or None
+
+
+def _seed(server: FakeRegistry, registry: str, versions: int) -> None:
+    if registry == 'ghcr':
+        server.seed_ghcr(CONTAINER, versions)
+    else:
+        server.seed_dockerhub_synthetic(CONTAINER, versions)
+
+
+def _remaining(server: FakeRegistry, registry: str) -> int:
+    with server._lock:
+        if registry == 'ghcr':
+            return len(server.ghcr_versions[CONTAINER])
+        return len(server.dockerhub_tags[CONTAINER])
+
+
+def run_scenario(registry: str, scenario: str, versions: int, concurrency: int, latency: float,
+                 error_rate: float, cache_dir: str) -> Dict:
+    """Run main.py once against a freshly seeded server and return its measurements."""
+    server = FakeRegistry(NAMESPACE, latency=latency, error_rate=error_rate)
+    _seed(server, registry, versions)
+
+    with server:
+        env = dict(os.environ, GHCR_TOKEN='bench-token', DOCKER_USERNAME=NAMESPACE, DOCKER_PASSWORD='bench',
+                   GITHUB_API_URL=server.url, DOCKER_HUB_API_URL=f'{server.url}/v2', PRUNE_CACHE_DIR=cache_dir)
+        cmd = [sys.executable, 'main.py', '--container', CONTAINER, '--registry', registry,
+               '--keep-latest', str(KEEP), '--concurrency', str(concurrency), '--no-cache']
+        if scenario == 'list':
+            cmd.append('--dry-run')
+
+        start = time.perf_counter()
+        result = subprocess.run(cmd, cwd=SCRIPT_DIR, env=env, capture_output=True, text=True)
+        wall_time = time.perf_counter() - start
+
+        deleted = versions - _remaining(server, registry)
+        measured = {
+            'registry': registry,
+            'scenario': scenario,
+            'concurrency': concurrency,
+            'exit_code': result.returncode,
+            'wall_time': round(wall_time, 4),
+            'versions': versions,
+            'deleted': deleted,
+            'versions_per_sec': round(versions / wall_time, 1),
+            'deletes_per_sec': round(deleted / wall_time, 1) if scenario == 'delete' else None,
+            'requests': server.request_counts(),
+            'connections': server.connections,
+        }
+
+    if result.returncode != 0:
+        measured['stderr'] = result.stderr[-2000:]
+    return measured
+
+
+def run(versions: int, concurrency_levels: List[int], latency: float, error_rate: float) -> Dict:
+    """Run every scenario and return the results document."""
+    results = []
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for registry in REGISTRIES:
+            for concurrency in concurrency_levels:
+                for scenario in ('list', 'delete'):
+                    results.append(run_scenario(registry, scenario, versions, concurrency, latency, error_rate,
+                                                cache_dir))
+
+    return {
+        'commit': _git_commit(),
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'settings': {'versions': versions, 'latency': latency, 'error_rate': error_rate, 'keep': KEEP},
+        'results': results,
+    }
+
+
+def _print(document: Dict, baseline: Optional[Dict] = None) -> None:
+    previous = {}
+    if baseline is not None:
+        previous = {(r['registry'], r['scenario'], r['concurrency']): r for r in baseline['results']}
+
+    print(f"{'registry':<10} {'scenario':<8} {'-j':>3} {'wall':>8} {'rate/s':>9} {'requests':>9} {'conns':>6}  change")
+    for r in document['results']:
+        rate = r['deletes_per_sec'] if r['scenario'] == 'delete' else r['versions_per_sec']
+        requests = sum(r['requests'].values())
+        change = ''
+        old = previous.get((r['registry'], r['scenario'], r['concurrency']))
+        if old is not None:
+            old_rate = old['deletes_per_sec'] if old['scenario'] == 'delete' else old['versions_per_sec']
+            if old_rate:
+                change = f"{(rate / old_rate - 1) * 100:+.0f}% rate, {requests - sum(old['requests'].values()):+d} req"
+        status = '' if r['exit_code'] == 0 else f" (exit {r['exit_code']})"
+        print(f"{r['registry']:<10} {r['scenario']:<8} {r['concurrency']:>3} {r['wall_time']:>7.2f}s {rate:>9.1f} "
+              f"{requests:>9} {r['connections']:>6}  {change}{status}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--versions', type=int, default=2000, metavar='N',
+                        help='versions seeded per run (default: 2000)')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8], metavar='N',
+                        help='--concurrency levels to run (default: 1 8)')
+    parser.add_argument('--latency', type=float, default=0.005, metavar='SECONDS',
+                        help='delay added to every response (default: 0.005)')
+    parser.add_argument('--error-rate', type=float, default=0.0, metavar='FRACTION',
+                        help='fraction of requests answered with 503 (default: 0)')
+    parser.add_argument('--output', metavar='PATH',
+                        help='where to write the JSON results (default: benchmarks/results/<commit>.json)')
+    parser.add_argument('--compare', metavar='PATH',
+                        help='JSON results of an earlier run to compare against')
+    args = parser.parse_args()
+
+    document = run(args.versions, args.concurrency, args.latency, args.error_rate)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+    _print(document, baseline)
+
+    output = args.output or os.path.join(SCRIPT_DIR, 'benchmarks', 'results',
+                                         f"{document['commit'] or 'working-tree'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(document, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    return 0 if all(r['exit_code'] == 0 for r in document['results']) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,239 @@
+"""Digest reference graph of a container's manifests, so pruning never breaks a kept image.
+
+A multi-platform build pushes one untagged manifest per platform and,
+with provenance or SBOM attestations, one untagged attestation manifest
+per platform, then a tagged image index that lists them all by digest.
+Deleting any of those untagged versions breaks pulls of the tag, so
+ReferenceAwareStrategy builds the graph of which listed versions each
+manifest references and lets the wrapped strategy decide only for the
+versions nothing references (image indexes and single-platform images)
+and for tagged versions. Everything else follows the versions that
+reference it.
+"""
+
+import json
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from registries.base import BaseRegistry, ImageVersion, RegistryError
+from registries.cache import cache_root
+from strategies import PruningStrategy
+
+if TYPE_CHECKING:
+    from table import VersionTable
+
+# Media types of manifests that only reference blobs (config and layers)
+IMAGE_MEDIA_TYPES = frozenset({
+    'application/vnd.oci.image.manifest.v1+json',
+    'application/vnd.docker.distribution.manifest.v2+json',
+})
+
+# Digests whose references are kept on disk; the oldest are dropped beyond this
+MAX_CACHED_MANIFESTS = 50_000
+
+# (digest, media type) of a manifest another manifest lists
+Reference = Tuple[str, str]
+
+
+def default_reference_cache_path() -> str:
+    """Return the manifest reference cache file, next to the HTTP cache."""
+    return os.path.join(cache_root(), 'manifests.json')
+
+
+def manifest_references(manifest: Dict[str, Any]) -> List[Reference]:
+    """Return the manifests an image index lists; image manifests reference none."""
+    return [(entry['digest'], entry.get('mediaType', '')) for entry in manifest.get('manifests') or []]
+
+
+class ReferenceCache:
+    """Keeps the references of each manifest digest on disk between runs.
+
+    A digest names immutable content, so an entry never needs revalidating:
+    after the first run only versions pushed since are fetched. The file is
+    readable only by the current user and holds at most
+    MAX_CACHED_MANIFESTS digests.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or default_reference_cache_path()
+        self._lock = threading.Lock()
+
+    def load(self) -> Dict[str, List[Reference]]:
+        with self._lock:
+            return {digest: [tuple(ref) for ref in refs] for digest, refs in self._load().items()}
+
+    def update(self, references: Dict[str, List[Reference]]) -> None:
+        """Add newly fetched references, keeping any another container added meanwhile."""
+        if not references:
+            return
+        with self._lock:
+            entries = self._load()
+            entries.update(references)
+            entries = dict(list(entries.items())[-MAX_CACHED_MANIFESTS:])
+            try:
+                self._save(entries)
+            except OSError:
+                # A cache that can't be written only costs fetching the manifests again
+                pass
+
+    def _load(self) -> Dict[str, list]:
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    def _save(self, entries: Dict[str, list]) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+
+        tmp_path = f'{self.path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.path)
+
+
+class ManifestFetcher:
+    """Fetches the references of many manifests concurrently, each digest at most once.
+
+    ``fetch`` returns the decoded manifest a digest names, or None if there
+    is none (registry.fetch_manifest). A listed version without a manifest
+    raises RegistryError, since what it references can't be known and
+    treating it as referencing nothing could orphan kept images. References
+    are remembered for the fetcher's lifetime and, with a ``cache``, across
+    runs.
+    """
+
+    def __init__(self, fetch: Callable[[str], Optional[Dict[str, Any]]], concurrency: int = 8,
+                 cache: Optional[ReferenceCache] = None):
+        self._fetch = fetch
+        self.concurrency = concurrency
+        self.cache = cache
+        self._known: Dict[str, List[Reference]] = cache.load() if cache is not None else {}
+        # Number of manifests requested from the registry
+        self.fetched = 0
+
+    def references(self, digests: Iterable[str]) -> Dict[str, List[Reference]]:
+        """Return the references of each digest's manifest, fetching those not yet known."""
+        digests = list(dict.fromkeys(digests))
+        missing = [digest for digest in digests if digest not in self._known]
+
+        if missing:
+            fetched: Dict[str, List[Reference]] = {}
+            not_found: List[str] = []
+            with ThreadPoolExecutor(max_workers=min(self.concurrency, len(missing))) as executor:
+                for digest, manifest in zip(missing, executor.map(self._fetch, missing)):
+                    if manifest is None:
+                        not_found.append(digest)
+                    else:
+                        fetched[digest] = self._known[digest] = manifest_references(manifest)
+            self.fetched += len(missing)
+            if self.cache is not None:
+                self.cache.update(fetched)
+            if not_found:
+                raise RegistryError(f'Manifest {not_found[0]} not found ({len(not_found)} missing); '
+                                    f'cannot tell what it references')
+
+        return {digest: self._known[digest] for digest in digests}
+
+
+class ReferenceGraph:
+    """Which listed versions each listed version's manifest references, by row."""
+
+    def __init__(self, versions: List[ImageVersion], references: Dict[str, List[Reference]]):
+        rows = {_digest(version): row for row, version in enumerate(versions)}
+        self.children: List[List[int]] = [
+            [rows[digest] for digest, _ in references.get(_digest(version), ()) if digest in rows]
+            for version in versions
+        ]
+        # Rows some listed manifest references
+        self.referenced: Set[int] = {child for children in self.children for child in children}
+
+    @classmethod
+    def build(cls, versions: List[ImageVersion], fetcher: ManifestFetcher) -> 'ReferenceGraph':
+        """Fetch the manifests needed to find every reference between listed versions.
+
+        Tagged versions are fetched first. The media types their indexes give
+        for each listed manifest tell which children are image manifests,
+        which reference no other manifest and so are not fetched; every other
+        version is fetched in a second round.
+        """
+        references = fetcher.references(_digest(v) for v in versions if v.tags)
+        images = {digest for refs in references.values() for digest, media_type in refs
+                  if media_type in IMAGE_MEDIA_TYPES}
+        references.update(fetcher.references(
+            digest for digest in map(_digest, versions) if digest not in references and digest not in images))
+        return cls(versions, references)
+
+    def reachable(self, rows: Iterable[int]) -> Set[int]:
+        """Return the given rows and every row they reference, directly or not."""
+        seen = set(rows)
+        queue = deque(seen)
+        while queue:
+            for child in self.children[queue.popleft()]:
+                if child not in seen:
+                    seen.add(child)
+                    queue.append(child)
+        return seen
+
+
+def _digest(version: ImageVersion) -> str:
+    return version.digest or version.id
+
+
+class ReferenceAwareStrategy(PruningStrategy):
+    """Runs a strategy on the versions a tag can point at and keeps everything they reference.
+
+    The wrapped strategy only sees top-level versions, which no listed
+    manifest references or which have a tag of their own, so "latest N"
+    counts images rather than their platform and attestation manifests. A referenced version is kept if any
+    kept version reaches it, and deleted with the versions that reference it
+    otherwise, so the children of deleted indexes aren't left orphaned. The
+    kept versions are found in one traversal of the graph.
+    """
+
+    def __init__(self, strategy: PruningStrategy, registry: BaseRegistry,
+                 cache: Optional[ReferenceCache] = None):
+        if not registry.supports_manifests:
+            raise ValueError(f'{registry.registry_name} does not support fetching manifests')
+        self.strategy = strategy
+        self.registry = registry
+        self.fetcher = ManifestFetcher(registry.fetch_manifest, registry.pool_size, cache)
+
+    @property
+    def prefers_table(self) -> bool:
+        return self.strategy.prefers_table
+
+    def select(self, versions: List[ImageVersion]) -> List[ImageVersion]:
+        return self._select(versions, self.strategy.select)
+
+    def select_table(self, table: 'VersionTable') -> List[ImageVersion]:
+        from table import VersionTable
+        return self._select(list(table.versions),
+                            lambda top: self.strategy.select_table(VersionTable(top, use_numpy=table.numpy)))
+
+    def _select(self, versions: List[ImageVersion],
+                select_top: Callable[[List[ImageVersion]], List[ImageVersion]]) -> List[ImageVersion]:
+        graph = ReferenceGraph.build(versions, self.fetcher)
+
+        # A referenced manifest that has its own tag is an image too, so the strategy decides it
+        top_rows = [row for row, version in enumerate(versions) if row not in graph.referenced or version.tags]
+        deleted = {id(version) for version in select_top([versions[row] for row in top_rows])}
+        kept = graph.reachable(row for row in top_rows if id(versions[row]) not in deleted)
+
+        if self.registry.verbose:
+            referenced_kept = len(kept & graph.referenced)
+            self.registry._log(f'Followed manifest references ({self.fetcher.fetched} manifests fetched): '
+                               f'{len(top_rows)} top-level images, {referenced_kept} referenced versions kept, '
+                               f'{len(graph.referenced) - referenced_kept} orphaned')
+
+        return [version for row, version in enumerate(versions) if row not in kept]
+
+    def get_description(self) -> str:
+        return f"{self.strategy.get_description()}, keeping every manifest a kept image references"
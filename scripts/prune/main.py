@@ -21,6 +21,11 @@
 #   - dockerhub.py: Docker Hub (username/password auth)
 #   - factory.py: Registry creation and management
 # - strategies.py: Pruning strategy implementations
+# - policy.py: Retention policy expressions compiled into a strategy
+# - table.py: Columnar inventory that strategies are evaluated on
+# - graph.py: Manifest reference graph that keeps what kept images reference
+# - output.py: Text and JSON Lines output formats
+# - plan.py: Deletion plans saved by --plan-out and run by --apply
 # - main.py: CLI interface and orchestration
 #
 # AUTHENTICATION:
@@ -53,6 +58,12 @@
 # 6. Preview what would be deleted without making changes:
 #    $ python3 main.py --container network-tools --registry all --keep-latest 5 --dry-run --verbose
 #
+# 7. Keep the latest 3 sha-xxxx build images (other tags are left alone):
+#    $ python3 main.py --container network-tools --registry all --keep-latest-per-group 3 --group-by '^(sha)-'
+#
+# 8. Keep the latest 25 multi-platform images with their platform and attestation manifests:
+#    $ python3 main.py --container network-tools --registry ghcr --keep-latest 25 --follow-references
+#
 # INTEGRATION WITH CI/CD:
 # This tool is integrated into GitHub Actions workflows and automatically runs after
 # successful image builds to maintain clean registries and manage storage usage.
@@ -63,52 +74,590 @@
 # - Docker Hub API docs: https://docs.docker.com/docker-hub/api/latest/
 # -------------------------------------------------------------------------------------------------------
 
+import io
+import os
 import sys
+import json
+import time
+import queue
 import argparse
-from typing import List
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from typing import Dict, List, Optional, Set, TextIO, Tuple
 
-from registries.factory import create_registry, create_all_registries
-from registries.base import BaseRegistry
-from strategies import PruneUntaggedByAge, PruneAllUntagged, KeepLatestCount
+from registries.factory import create_registry, create_all_registries, DEFAULT_MAX_RETRIES
+from registries.base import BaseRegistry, RegistryError
+from registries.http import DEFAULT_POOL_SIZE
+from registries.cache import HttpCache
+from registries.metrics import Metrics
+from registries.retry import RetryBudget
+from registries.tokens import TokenCache
+from strategies import (PruningStrategy, PruneUntaggedByAge, PruneAllUntagged, KeepLatestCount, KeepLatestPerGroup,
+                        SEMVER_GROUP)
+from output import OUTPUT_FORMATS, BufferedLines, OutputFormat, TextOutput
+from plan import PlanEntry, load_plan, write_plan
 
 __author__ = "Jon LaBelle"
 __version__ = "2.0"
 __copyright__ = "Copyright (C) 2025 Jon LaBelle"
 __license__ = "MIT"
 
+# Versions buffered between the listing and planning stages of --stream
+STREAM_QUEUE_SIZE = 1000
+
+# Largest batch of planned versions handed to the delete stage of --stream
+STREAM_BATCH_SIZE = 100
+
+_END_OF_STREAM = object()
+
+# Registry/container pairs pruned at the same time by default
+DEFAULT_MAX_PARALLEL = 8
+
+# Strategy options accepted in a --containers-file entry, named after the CLI flags, and the
+# JSON type of their values
+STRATEGY_OPTIONS = {'prune_untagged_age': 'number', 'prune_all_untagged': 'boolean', 'keep_latest': 'integer',
+                    'keep_latest_per_group': 'integer', 'policy': 'string', 'policy_file': 'string'}
+
+# Python types of the JSON values a containers file option can take
+_JSON_TYPES = {'number': (int, float), 'integer': (int,), 'boolean': (bool,), 'string': (str,)}
+
+# Environment saved in a --record cassette so --replay reaches the same URLs
+REPLAY_ENVIRONMENT = ('DOCKER_USERNAME', 'GITHUB_API_URL', 'DOCKER_HUB_API_URL', 'GHCR_REGISTRY_URL')
+
+# Credentials whose presence (never their value) is saved in a --record cassette
+REPLAY_CREDENTIALS = ('GHCR_TOKEN', 'DOCKER_PASSWORD')
+
+
+class PruneReport:
+    """Per-registry outcome of a prune run, used for the summary."""
+
+    def __init__(self, registry_name: str, container_name: Optional[str] = None):
+        self.registry_name = registry_name
+        # Only set when several containers are pruned in one run
+        self.container_name = container_name
+        # The container pruned, whether or not it is named in the text output
+        self.container = container_name
+        self.listed = 0
+        self.planned = 0
+        self.deleted = 0
+        self.failed = 0
+        self.retries = 0
+        self.elapsed = 0.0
+        # Seconds spent in the list, plan and delete phases (these overlap with --stream)
+        self.phases: Dict[str, float] = {}
+        # Versions selected for deletion (left empty with --stream)
+        self.plan: List = []
+        # Inventory fingerprint taken before listing, for --plan-out
+        self.fingerprint: Optional[Dict] = None
+        self.error: Optional[str] = None
+
+    @property
+    def label(self) -> str:
+        if self.container_name:
+            return f"{self.registry_name} ({self.container_name})"
+        return self.registry_name
+
+
+def _delete_batch(registry: BaseRegistry, batch: List, concurrency: int, out: Optional[TextIO],
+                  report: PruneReport, output_format: OutputFormat) -> None:
+    """Delete a batch of planned versions, reporting each result in plan order."""
+    results = registry.delete_versions([version.id for version in batch], concurrency,
+                                       names=[version.name for version in batch])
+
+    with BufferedLines(out) as lines:
+        for version, result in zip(batch, results):
+            if result.success:
+                report.deleted += 1
+            else:
+                report.failed += 1
+            lines.add(output_format.version(report, version, 'deleted' if result.success else 'failed',
+                                            result.elapsed))
+
 
-def prune_registry(registry: BaseRegistry, strategy, dry_run: bool) -> int:
-    """Prune a single registry using the given strategy."""
-    print(f"\n=== {registry.registry_name} ===")
-    print(strategy.get_description())
+def _print_planned(plan: List, out: Optional[TextIO], report: PruneReport, output_format: OutputFormat) -> None:
+    """Report the versions a dry run would delete."""
+    with BufferedLines(out) as lines:
+        for version in plan:
+            lines.add(output_format.version(report, version, 'planned'))
 
+
+def _write(out: Optional[TextIO], text: str) -> None:
+    if text:
+        (out if out is not None else sys.stdout).write(text)
+
+
+def prune_registry(registry: BaseRegistry, strategy, dry_run: bool, concurrency: int = 1,
+                   out: Optional[TextIO] = None, report: Optional[PruneReport] = None,
+                   stream: bool = False, output_format: Optional[OutputFormat] = None,
+                   fingerprint: bool = False, saved_plan: Optional[PlanEntry] = None) -> int:
+    """Prune a single registry using the given strategy.
+
+    Deletions go through the registry's delete_versions(), which batches them
+    where the registry supports it and otherwise uses a pool of up to
+    ``concurrency`` worker threads. Results are reported in plan order, so output is the same for any
+    concurrency level. Output goes to ``out`` (default: stdout) in ``output_format``
+    (default: text), written a batch of lines at a time, and counts are
+    recorded on ``report`` when one is given.
+
+    With ``stream``, strategies that don't need the whole inventory are run
+    as a pipeline (see _prune_streaming); other strategies ignore it.
+    With ``fingerprint``, the registry's inventory fingerprint is recorded on
+    the report before listing, for a plan file. A ``saved_plan`` is deleted
+    in place of listing and running ``strategy`` (see _apply_plan).
+    """
+    report = report or PruneReport(registry.registry_name)
+    report.container = registry.container_name
+    output_format = output_format or TextOutput()
+
+    if saved_plan is not None:
+        _write(out, output_format.header(report, f"Applying saved plan: {saved_plan.description}"))
+        return _apply_plan(registry, saved_plan, dry_run, concurrency, out, report, output_format)
+
+    _write(out, output_format.header(report, strategy.get_description()))
+
+    if stream and not strategy.needs_inventory:
+        return _prune_streaming(registry, strategy, dry_run, concurrency, out, report, output_format)
+
+    started = time.perf_counter()
     try:
+        # Taken first, so a push during the listing makes the plan stale
+        if fingerprint:
+            report.fingerprint = registry.inventory_fingerprint()
         versions = registry.list_versions()
     except Exception as e:
-        print(f"Error listing versions from {registry.registry_name}: {e}")
+        _write(out, output_format.error(report, f"Error listing versions from {registry.registry_name}: {e}"))
+        report.error = str(e)
         return 0
+    finally:
+        report.phases['list'] = time.perf_counter() - started
 
+    report.listed = len(versions)
     if not versions:
-        print("No images found")
+        _write(out, output_format.message(report, "No images found"))
         return 0
 
-    deleted_count = 0
+    # Build the whole deletion plan before touching the registry, as
+    # whole-array operations on a columnar copy of the inventory for
+    # strategies that gain more from it than building the columns costs
+    started = time.perf_counter()
+    from table import VersionTable
+    try:
+        plan = strategy.select_table(VersionTable(versions)) if strategy.prefers_table else strategy.select(versions)
+    except RegistryError as e:
+        # Raised by strategies that fetch more from the registry, such as manifests
+        _write(out, output_format.error(report, f"Error planning deletions in {registry.registry_name}: {e}"))
+        report.error = str(e)
+        return 0
+    finally:
+        report.phases['plan'] = time.perf_counter() - started
+    report.plan = plan
+    report.planned = len(plan)
 
-    for version in versions:
-        if strategy.should_delete(version, versions):
-            tag_info = f" (tags: {', '.join(version.tags)})" if version.tags else " (untagged)"
+    if dry_run:
+        _print_planned(plan, out, report, output_format)
+        return 0
 
-            if dry_run:
-                print(f"Would delete image: {version.id}{tag_info}")
-            else:
-                success = registry.delete_version(version.id)
-                if success:
-                    print(f"Deleted image: {version.id}{tag_info}")
-                    deleted_count += 1
+    return _delete_planned(registry, plan, concurrency, out, report, output_format)
+
+
+def _delete_planned(registry: BaseRegistry, plan: List, concurrency: int, out: Optional[TextIO],
+                    report: PruneReport, output_format: OutputFormat) -> int:
+    """Delete every planned version, recording any error on the report."""
+    started = time.perf_counter()
+    try:
+        _delete_batch(registry, plan, concurrency, out, report, output_format)
+    except Exception as e:
+        _write(out, output_format.error(report, f"Error deleting versions from {registry.registry_name}: {e}"))
+        report.error = str(e)
+    report.phases['delete'] = time.perf_counter() - started
+
+    if report.failed:
+        _write(out, output_format.message(report, f"{report.deleted} deleted, {report.failed} failed"))
+
+    return report.deleted
+
+
+def _apply_plan(registry: BaseRegistry, saved_plan: PlanEntry, dry_run: bool, concurrency: int,
+                out: Optional[TextIO], report: PruneReport, output_format: OutputFormat) -> int:
+    """Delete the versions of a saved plan without listing the registry.
+
+    The registry's inventory fingerprint is compared with the one saved in
+    the plan first; if versions were pushed or deleted since the plan was
+    made, nothing is deleted and the report records an error.
+    """
+    started = time.perf_counter()
+    try:
+        current = registry.inventory_fingerprint()
+    except Exception as e:
+        _write(out, output_format.error(report, f"Error checking the inventory of {registry.registry_name}: {e}"))
+        report.error = str(e)
+        return 0
+    finally:
+        report.phases['list'] = time.perf_counter() - started
+
+    if current != saved_plan.fingerprint:
+        report.error = "plan is stale"
+        _write(out, output_format.error(report, f"The plan is stale: {registry.container_name} changed in "
+                                                f"{registry.registry_name} since it was planned "
+                                                f"(was {saved_plan.fingerprint}, now {current}); "
+                                                f"make a new plan"))
+        return 0
+
+    registry.restore_plan_state(saved_plan.state)
+    report.plan = saved_plan.versions
+    report.planned = len(saved_plan.versions)
+    if not saved_plan.versions:
+        _write(out, output_format.message(report, "Nothing to delete"))
+        return 0
+
+    if dry_run:
+        _print_planned(saved_plan.versions, out, report, output_format)
+        return 0
+
+    return _delete_planned(registry, saved_plan.versions, concurrency, out, report, output_format)
+
+
+def _prune_streaming(registry: BaseRegistry, strategy, dry_run: bool, concurrency: int,
+                     out: Optional[TextIO], report: PruneReport, output_format: OutputFormat) -> int:
+    """Prune a registry as a list -> plan -> delete pipeline.
+
+    A listing thread pushes versions into a bounded queue as each page
+    arrives, this thread evaluates them, and a delete thread works through
+    batches of planned versions while later pages are still downloading.
+    The bounded queues apply backpressure, so memory use doesn't grow with
+    the size of the repository. Batches are flushed whenever the planner
+    runs out of listed versions, so deletes start after the first page.
+
+    Registries list by page number, so each deletion moves a later version
+    onto a page already fetched, where this pass never sees it. The
+    registry is listed again until a pass deletes nothing; versions
+    planned by an earlier pass (deleted, or failed) are not planned again.
+    """
+    planned: Set[Tuple[str, str]] = set()
+    first_pass = True
+    while True:
+        deleted = report.deleted
+        listed, failed = _stream_pass(registry, strategy, dry_run, concurrency, out, report, output_format, planned)
+        # A pass misses the versions its own deletes moved, but sees every version left by earlier passes
+        report.listed = max(report.listed, deleted + listed)
+        if first_pass and not listed and not failed:
+            _write(out, output_format.message(report, "No images found"))
+        first_pass = False
+        if dry_run or failed or report.deleted == deleted:
+            break
+        if registry.verbose:
+            registry._log(f"Deleted {report.deleted - deleted} images while listing; listing again for images "
+                          f"moved onto pages already fetched")
+
+    if report.failed:
+        _write(out, output_format.message(report, f"{report.deleted} deleted, {report.failed} failed"))
+
+    return report.deleted
+
+
+def _stream_pass(registry: BaseRegistry, strategy, dry_run: bool, concurrency: int, out: Optional[TextIO],
+                 report: PruneReport, output_format: OutputFormat, planned: Set[Tuple[str, str]]) -> Tuple[int, bool]:
+    """List, plan and delete once, skipping and adding to the (ID, name) pairs already ``planned``.
+
+    Returns the number of versions listed and whether a stage failed.
+    """
+    versions_queue: queue.Queue = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+    batches_queue: queue.Queue = queue.Queue(maxsize=4)
+    list_errors: List[Exception] = []
+    delete_errors: List[Exception] = []
+
+    def list_stage() -> None:
+        started = time.perf_counter()
+        try:
+            for version in registry.iter_versions():
+                versions_queue.put(version)
+        except Exception as e:
+            list_errors.append(e)
+        finally:
+            report.phases['list'] = report.phases.get('list', 0.0) + time.perf_counter() - started
+            versions_queue.put(_END_OF_STREAM)
+
+    def delete_stage() -> None:
+        while True:
+            batch = batches_queue.get()
+            if batch is _END_OF_STREAM:
+                return
+            if delete_errors:
+                # Keep draining so the planner never blocks on a dead stage
+                continue
+            started = time.perf_counter()
+            try:
+                if dry_run:
+                    _print_planned(batch, out, report, output_format)
                 else:
-                    print(f"Failed to delete image: {version.id}{tag_info}")
+                    _delete_batch(registry, batch, concurrency, out, report, output_format)
+            except Exception as e:
+                delete_errors.append(e)
+            finally:
+                report.phases['delete'] = report.phases.get('delete', 0.0) + time.perf_counter() - started
+
+    lister = threading.Thread(target=list_stage, daemon=True)
+    deleter = threading.Thread(target=delete_stage, daemon=True)
+    lister.start()
+    deleter.start()
+
+    listed = 0
+    batch: List = []
+    while True:
+        try:
+            version = versions_queue.get_nowait()
+        except queue.Empty:
+            if batch:
+                batches_queue.put(batch)
+                batch = []
+            version = versions_queue.get()
+
+        if version is _END_OF_STREAM:
+            break
+
+        listed += 1
+        if (version.id, version.name) not in planned and strategy.should_delete(version, ()):
+            planned.add((version.id, version.name))
+            report.planned += 1
+            batch.append(version)
+            if len(batch) >= STREAM_BATCH_SIZE:
+                batches_queue.put(batch)
+                batch = []
+
+    if batch:
+        batches_queue.put(batch)
+    batches_queue.put(_END_OF_STREAM)
+    lister.join()
+    deleter.join()
+
+    if list_errors:
+        _write(out, output_format.error(report, f"Error listing versions from {registry.registry_name}: "
+                                                f"{list_errors[0]}"))
+        report.error = str(list_errors[0])
+    if delete_errors:
+        _write(out, output_format.error(report, f"Error deleting versions from {registry.registry_name}: "
+                                                f"{delete_errors[0]}"))
+        report.error = report.error or str(delete_errors[0])
+
+    return listed, bool(list_errors or delete_errors)
+
+
+def prune_all(registries: List[BaseRegistry], strategy, dry_run: bool, concurrency: int = 1,
+              stream: bool = False, strategies: Optional[List[PruningStrategy]] = None,
+              max_parallel: int = DEFAULT_MAX_PARALLEL,
+              output_format: Optional[OutputFormat] = None, fingerprint: bool = False,
+              plans: Optional[List[PlanEntry]] = None) -> List[PruneReport]:
+    """Prune several registries concurrently.
 
-    return deleted_count
+    Each registry is listed, planned and pruned on its own thread, at most
+    ``max_parallel`` at a time. ``strategies``, if given, holds a strategy per
+    registry in place of ``strategy``; ``plans``, if given, holds a saved plan
+    per registry to apply instead. Each registry's output is buffered and
+    printed as one block, in registry order, once it finishes.
+    """
+    strategies = strategies or [strategy] * len(registries)
+    plans = plans or [None] * len(registries)
+    output_format = output_format or TextOutput()
+
+    def run(registry: BaseRegistry, strategy, saved_plan: Optional[PlanEntry], buffer: Optional[TextIO],
+            report: PruneReport) -> None:
+        registry.output = sys.stderr if output_format.logs_to_stderr else buffer
+        start = time.perf_counter()
+        try:
+            report.deleted = prune_registry(registry, strategy, dry_run, concurrency, out=buffer, report=report,
+                                            stream=stream, output_format=output_format,
+                                            fingerprint=fingerprint, saved_plan=saved_plan)
+        finally:
+            report.elapsed = time.perf_counter() - start
+            report.retries = registry.retry.retries
+            registry.output = None
+
+    if len(registries) == 1:
+        # Nothing to overlap with; stream output directly
+        report = PruneReport(registries[0].registry_name)
+        run(registries[0], strategies[0], plans[0], None, report)
+        return [report]
+
+    # Name the container in headers and the summary when there are several
+    several = len({registry.container_name for registry in registries}) > 1
+    reports = [PruneReport(registry.registry_name, registry.container_name if several else None)
+               for registry in registries]
+    buffers = [io.StringIO() for _ in registries]
+
+    with ThreadPoolExecutor(max_workers=min(len(registries), max_parallel)) as executor:
+        futures = [executor.submit(run, *job) for job in zip(registries, strategies, plans, buffers, reports)]
+        for future, buffer in zip(futures, buffers):
+            try:
+                future.result()
+            finally:
+                sys.stdout.write(buffer.getvalue())
+                sys.stdout.flush()
+
+    return reports
+
+
+def _create_strategy(prune_untagged_age: Optional[float] = None, prune_all_untagged: bool = False,
+                     keep_latest: Optional[int] = None, policy: Optional[str] = None,
+                     policy_file: Optional[str] = None, keep_latest_per_group: Optional[int] = None,
+                     group_by: Optional[str] = None) -> Optional[PruningStrategy]:
+    """Build the strategy chosen by the CLI strategy options, or None if none was chosen.
+
+    Raises ValueError if a policy (a PolicyError) or a --group-by expression is invalid.
+    """
+    if policy is not None:
+        from policy import compile_policy
+        return compile_policy(policy)
+    if policy_file is not None:
+        from policy import load_policy_file
+        return load_policy_file(policy_file)
+    if prune_untagged_age is not None:
+        return PruneUntaggedByAge(prune_untagged_age)
+    if prune_all_untagged:
+        return PruneAllUntagged()
+    if keep_latest is not None:
+        return KeepLatestCount(keep_latest)
+    if keep_latest_per_group is not None:
+        return KeepLatestPerGroup(keep_latest_per_group, group_by or SEMVER_GROUP)
+    return None
+
+
+def _follow_references(registry: BaseRegistry, strategy: PruningStrategy, use_cache: bool,
+                       notes: Optional[TextIO] = None) -> PruningStrategy:
+    """Wrap a strategy so it keeps every manifest a kept image references, if the registry can fetch manifests."""
+    if not registry.supports_manifests:
+        if registry.verbose:
+            print(f"{registry.registry_name} can't fetch manifests; pruning {registry.container_name} without "
+                  f"following references", file=notes)
+        return strategy
+
+    from graph import ReferenceAwareStrategy, ReferenceCache
+    return ReferenceAwareStrategy(strategy, registry, ReferenceCache() if use_cache else None)
+
+
+def load_containers_file(path: str, default: Optional[PruningStrategy]) -> List[Tuple[str, PruningStrategy]]:
+    """Read the containers to prune, and their strategies, from a JSON file.
+
+    The file holds a list whose entries are either a container name, pruned
+    with the ``default`` strategy, or an object with a "name" and at most one
+    strategy option named after its CLI flag (and "group_by" with
+    "keep_latest_per_group"):
+
+        ["network-tools", {"name": "web", "keep_latest": 5}, {"name": "ci", "prune_untagged_age": 7}]
+
+    Raises ValueError if the file is malformed, an option's value has the
+    wrong JSON type, or a container has no strategy.
+    """
+    try:
+        with open(path, encoding='utf-8') as f:
+            entries = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ValueError(f"Cannot read containers file {path}: {e}")
+
+    if not isinstance(entries, list) or not entries:
+        raise ValueError(f"Containers file {path} must contain a non-empty JSON list")
+
+    targets = []
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {'name': entry}
+        if not isinstance(entry, dict) or not isinstance(entry.get('name'), str):
+            raise ValueError(f"Invalid containers file entry: {entry!r}")
+
+        unknown = set(entry) - {'name', 'group_by', *STRATEGY_OPTIONS}
+        if unknown:
+            raise ValueError(f"Unknown option(s) for container {entry['name']}: {', '.join(sorted(unknown))}")
+        options = {key: entry[key] for key in STRATEGY_OPTIONS if key in entry}
+        if len(options) > 1:
+            raise ValueError(f"Container {entry['name']} has more than one strategy")
+        if 'group_by' in entry:
+            if 'keep_latest_per_group' not in options:
+                raise ValueError(f"Container {entry['name']}: group_by only applies to keep_latest_per_group")
+            options['group_by'] = entry['group_by']
+        for key, value in options.items():
+            kind = STRATEGY_OPTIONS.get(key, 'string')
+            # JSON true and false are Python bools, which are also ints
+            if isinstance(value, bool) != (kind == 'boolean') or not isinstance(value, _JSON_TYPES[kind]):
+                article = 'an' if kind[0] in 'aeiou' else 'a'
+                raise ValueError(f"Container {entry['name']}: {key} must be {article} {kind}, not {value!r}")
+
+        strategy = _create_strategy(**options) if options else default
+        if strategy is None:
+            raise ValueError(f"Container {entry['name']} has no strategy and none was given on the command line")
+        targets.append((entry['name'], strategy))
+
+    return targets
+
+
+def _open_cache(verbose: bool, notes: Optional[TextIO] = None) -> Optional[HttpCache]:
+    """Open the on-disk HTTP cache, carrying on without one if it can't be created."""
+    try:
+        return HttpCache()
+    except OSError as e:
+        if verbose:
+            print(f"HTTP cache disabled: {e}", file=notes)
+        return None
+
+
+def _write_metrics(metrics: Metrics, paths: List[str], registries: List[BaseRegistry],
+                   reports: List[PruneReport]) -> None:
+    """Add each registry/container's phase timings to ``metrics`` and write them to every path."""
+    for registry, report in zip(registries, reports):
+        handled = {'list': report.listed, 'plan': report.planned, 'delete': report.deleted}
+        for phase, seconds in report.phases.items():
+            metrics.observe_phase(report.registry_name, registry.container_name, phase, seconds, handled[phase])
+
+    for path in paths:
+        try:
+            metrics.write(path)
+        except OSError as e:
+            print(f"Error writing metrics to {path}: {e}", file=sys.stderr)
+
+
+def _write_plan(path: str, jobs: List[Tuple[BaseRegistry, PruningStrategy]], reports: List[PruneReport],
+                notes: Optional[TextIO]) -> None:
+    """Save the deletions planned for every registry/container to a --plan-out file.
+
+    Nothing is written if any of them failed, since the plan would be incomplete.
+    """
+    if any(report.error for report in reports):
+        print(f"No plan written to {path}: some registries could not be planned", file=sys.stderr)
+        return
+
+    entries = [
+        PlanEntry(registry.registry_type, registry.container_name, report.plan, report.fingerprint,
+                  registry.plan_state(report.plan), getattr(registry, 'owner', None), strategy.get_description())
+        for (registry, strategy), report in zip(jobs, reports)
+    ]
+    try:
+        write_plan(path, entries)
+    except OSError as e:
+        print(f"Error writing plan to {path}: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    planned = sum(report.planned for report in reports)
+    print(f"Wrote a plan to delete {planned} image{'' if planned == 1 else 's'} to {path}; "
+          f"run with --apply {path} to delete them", file=notes)
+
+
+def _open_cassette(args, parser):
+    """Start recording to, or load for replay, the cassette named by --record or --replay."""
+    from registries.transport import Cassette
+
+    if args.record:
+        return Cassette(args.record)
+
+    try:
+        cassette = Cassette.load(args.replay, args.replay_speed)
+    except ValueError as e:
+        parser.error(str(e))
+
+    # Replays need no credentials: the registries that were recorded get placeholders
+    for name, value in cassette.meta.get('env', {}).items():
+        os.environ.setdefault(name, value)
+    for name in cassette.meta.get('credentials', []):
+        os.environ.setdefault(name, 'replay')
+    return cassette
 
 
 def main():
@@ -127,51 +676,229 @@ Examples:
   # Keep only the latest 3 images in both registries
   python3 main.py --container network-tools --registry all --keep-latest 3
 
+  # Keep the latest 25 images, deleting with 16 parallel requests
+  python3 main.py --container network-tools --registry all --keep-latest 25 --concurrency 16
+
+  # Prune several containers in one run, sharing connections and logins
+  python3 main.py --container network-tools web-tools --registry all --prune-all-untagged
+  python3 main.py --containers-file containers.json --registry all --prune-untagged-age 30
+
+  # Prune every container package of a GitHub organization whose name starts with "tools-"
+  python3 main.py --org my-org --package-glob 'tools-*' --registry ghcr --keep-latest 10
+
+  # Keep the latest 25 images, every release, and untagged images from the last 3 days
+  python3 main.py --container network-tools --registry all --policy 'latest 25 or tag "v*" or (untagged and age < 3d)'
+
+  # Plan the deletions now, review the plan, then delete exactly those images later
+  python3 main.py --container network-tools --registry all --keep-latest 10 --plan-out plan.json
+  python3 main.py --apply plan.json
+
+  # Record a run's HTTP exchanges, then replay them offline at twice the recorded speed
+  python3 main.py --container network-tools --registry ghcr --keep-latest 10 --record prune.cassette.json
+  python3 main.py --container network-tools --registry ghcr --keep-latest 10 --replay prune.cassette.json \\
+      --replay-speed 2
+
 Environment variables:
 
-  GHCR_TOKEN        - GitHub personal access token (for GHCR)
-  DOCKER_USERNAME   - Docker Hub username
-  DOCKER_PASSWORD   - Docker Hub password or access token
+  GHCR_TOKEN         - GitHub personal access token (for GHCR)
+  DOCKER_USERNAME    - Docker Hub username
+  DOCKER_PASSWORD    - Docker Hub password or access token
+  PRUNE_CACHE_DIR    - cache directory (default: ~/.cache/docker-network-tools-prune)
+  GITHUB_API_URL     - GitHub API endpoint (default: https://api.github.com)
+  DOCKER_HUB_API_URL - Docker Hub API endpoint (default: https://hub.docker.com/v2)
         """
     )
 
-    parser.add_argument('--container', required=True,
-                        help='name of the container image')
+    # One of these is required unless packages are discovered with --org
+    container_group = parser.add_mutually_exclusive_group()
+    container_group.add_argument('--container', nargs='+', metavar='NAME',
+                                 help='name of the container image (several may be given)')
+    container_group.add_argument('--containers-file', metavar='PATH',
+                                 help='JSON list of containers to prune, each a name or an object with a "name" and '
+                                      'its own strategy option (e.g. {"name": "web", "keep_latest": 5})')
+    parser.add_argument('--org', '--owner', dest='owner', metavar='ORG',
+                        help='GitHub organization that owns the GHCR packages; without --container or '
+                             '--containers-file, every container package it owns is pruned (requires --registry ghcr)')
+    parser.add_argument('--package-glob', metavar='GLOB',
+                        help='only prune discovered --org packages whose name matches GLOB (e.g. "tools-*")')
     parser.add_argument('--registry', choices=['ghcr', 'dockerhub', 'all'], default='all',
                         help='which registry to prune (default: all)')
     parser.add_argument('--verbose', '-v', action='store_true',
                         help='print extra debug info')
+    parser.add_argument('--output', '-o', choices=list(OUTPUT_FORMATS), default='text',
+                        help='format of the results on stdout: human-readable text, or JSON Lines with one record '
+                             'per image and a final summary record, logs going to stderr (default: text)')
     parser.add_argument('--dry-run', '-n', action='store_true',
                         help='do not actually prune images, just list which images would be pruned')
+    parser.add_argument('--concurrency', '-j', type=int, default=1, metavar='N',
+                        help='number of delete requests to send in parallel (default: 1)')
+    parser.add_argument('--max-parallel', type=int, default=DEFAULT_MAX_PARALLEL, metavar='N',
+                        help=f'number of registry/container pairs pruned at the same time '
+                             f'(default: {DEFAULT_MAX_PARALLEL})')
+    parser.add_argument('--stream', action='store_true',
+                        help='list, plan and delete as a pipeline so deletes start while later pages are '
+                             'still downloading (age/untagged strategies only); since deletes move later '
+                             'images onto pages already listed, the registry is listed again until a pass '
+                             'deletes nothing')
+    parser.add_argument('--follow-references', action='store_true',
+                        help='fetch the manifests of every listed version (GHCR only) and apply the strategy to '
+                             'image indexes and single-platform images only; platform and attestation manifests '
+                             'are kept while a kept image references them and deleted with it otherwise')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='do not use the on-disk caches of version listings, manifest references and Docker '
+                             'Hub logins')
+    parser.add_argument('--max-retries', type=int, default=DEFAULT_MAX_RETRIES, metavar='N',
+                        help=f'times to retry a failed request (default: {DEFAULT_MAX_RETRIES})')
+    parser.add_argument('--retry-budget', type=int, default=100, metavar='N',
+                        help='maximum number of retries across the whole run (default: 100)')
+    parser.add_argument('--metrics-out', action='append', default=[], metavar='PATH',
+                        help='write request counts, latency histograms, bytes, retries and phase timings to PATH: '
+                             'Prometheus textfile format for a .prom file, JSON otherwise (may be repeated)')
 
-    # Pruning strategy options (mutually exclusive)
-    strategy_group = parser.add_mutually_exclusive_group(required=True)
+    # Record/replay of the HTTP exchanges (both turn off the on-disk caches)
+    cassette_group = parser.add_mutually_exclusive_group()
+    cassette_group.add_argument('--record', metavar='PATH',
+                                help='save every HTTP exchange, without credentials, to a cassette file')
+    cassette_group.add_argument('--replay', metavar='PATH',
+                                help='answer every HTTP request from a cassette file instead of the network; '
+                                     'no credentials are needed, and the run fails if the requests sent differ '
+                                     'from the recorded ones')
+    parser.add_argument('--replay-speed', type=float, default=1.0, metavar='FACTOR',
+                        help='divide the recorded response times by FACTOR when replaying; 0 answers '
+                             'immediately (default: 1)')
+
+    # Plan now, delete later
+    plan_group = parser.add_mutually_exclusive_group()
+    plan_group.add_argument('--plan-out', metavar='PATH',
+                            help='list and plan as usual but delete nothing; write the planned deletions, with a '
+                                 'fingerprint of each inventory, to a plan file for --apply')
+    plan_group.add_argument('--apply', metavar='PATH',
+                            help='delete the images in a plan file written by --plan-out without listing them '
+                                 'again; a container whose inventory changed since is left alone and reported as '
+                                 'an error (containers and strategies come from the plan)')
+
+    # Pruning strategy options (mutually exclusive; optional if every
+    # --containers-file entry names its own strategy)
+    strategy_group = parser.add_mutually_exclusive_group()
     strategy_group.add_argument('--prune-untagged-age', type=float, metavar='DAYS',
                                 help='delete untagged images older than DAYS days')
     strategy_group.add_argument('--prune-all-untagged', action='store_true',
                                 help='delete ALL untagged images')
     strategy_group.add_argument('--keep-latest', type=int, metavar='COUNT',
                                 help='keep only the latest COUNT images (delete all others)')
+    strategy_group.add_argument('--keep-latest-per-group', type=int, metavar='COUNT',
+                                help='keep the latest COUNT images of each tag group (see --group-by) and delete '
+                                     'the older images of every group; images in no group are kept')
+    strategy_group.add_argument('--policy', metavar='EXPR',
+                                help='keep the images matching a retention policy expression and delete all '
+                                     'others, e.g. \'latest 25 or tag "v*" or (untagged and age < 3d)\'')
+    strategy_group.add_argument('--policy-file', metavar='PATH',
+                                help='read the retention policy from a JSON (or, with PyYAML, YAML) file with a '
+                                     '"keep" expression or list of expressions and a "protect" list of tag patterns')
+
+    parser.add_argument('--group-by', metavar='KEY',
+                        help=f'how --keep-latest-per-group groups tags: "{SEMVER_GROUP}" for the major.minor of '
+                             'semantic version tags (default), or a regular expression whose capture groups are '
+                             'the group, e.g. "^(sha)-"')
 
     args = parser.parse_args()
 
+    if args.concurrency < 1:
+        parser.error('--concurrency must be at least 1')
+    if args.max_parallel < 1:
+        parser.error('--max-parallel must be at least 1')
+    if args.max_retries < 0 or args.retry_budget < 0:
+        parser.error('--max-retries and --retry-budget must not be negative')
+    if args.replay_speed < 0:
+        parser.error('--replay-speed must not be negative')
+    if args.group_by is not None and args.keep_latest_per_group is None:
+        parser.error('--group-by only applies to --keep-latest-per-group')
+    if args.stream and (args.plan_out or args.apply or args.follow_references):
+        parser.error('--stream cannot be combined with --plan-out, --apply or --follow-references')
+    if args.apply:
+        if args.container or args.containers_file or args.owner:
+            parser.error('--apply takes its containers from the plan; do not give --container, --containers-file '
+                         'or --org')
+        if args.follow_references or any(getattr(args, option) not in (None, False) for option in STRATEGY_OPTIONS):
+            parser.error('--apply deletes the images in the plan; do not give a strategy option or '
+                         '--follow-references')
+    elif not (args.container or args.containers_file or args.owner):
+        parser.error('one of the arguments --container --containers-file --org --apply is required')
+    if args.owner and args.registry != 'ghcr':
+        parser.error('--org only applies to GHCR; use it with --registry ghcr')
+    discover = args.owner and not (args.container or args.containers_file)
+    if args.package_glob and not discover:
+        parser.error('--package-glob only applies when discovering packages with --org')
+
     # Create pruning strategy
-    if args.prune_untagged_age is not None:
-        strategy = PruneUntaggedByAge(args.prune_untagged_age)
-    elif args.prune_all_untagged:
-        strategy = PruneAllUntagged()
-    elif args.keep_latest is not None:
-        strategy = KeepLatestCount(args.keep_latest)
-
-    # Create registry instances
+    try:
+        strategy = _create_strategy(args.prune_untagged_age, args.prune_all_untagged, args.keep_latest,
+                                    args.policy, args.policy_file, args.keep_latest_per_group, args.group_by)
+    except ValueError as e:
+        parser.error(str(e))
+
+    output_format = OUTPUT_FORMATS[args.output]()
+    # Everything but the results goes to stderr when stdout is machine-readable
+    notes = sys.stderr if output_format.logs_to_stderr else sys.stdout
+
+    # Pair each container with its strategy, or with its entry of a saved plan
+    plans: Optional[List[PlanEntry]] = None
+    if args.apply:
+        try:
+            plans = load_plan(args.apply)
+        except ValueError as e:
+            parser.error(str(e))
+        if args.registry != 'all':
+            plans = [entry for entry in plans if entry.registry_type == args.registry]
+        if not plans:
+            print(f"Nothing to apply: {args.apply} has no entries for --registry {args.registry}", file=notes)
+            return
+        targets = [(entry.container, None) for entry in plans]
+    elif args.containers_file:
+        try:
+            targets = load_containers_file(args.containers_file, strategy)
+        except ValueError as e:
+            parser.error(str(e))
+    elif strategy is None:
+        parser.error('one of the arguments --prune-untagged-age --prune-all-untagged --keep-latest '
+                     '--keep-latest-per-group --policy --policy-file is required')
+    elif args.container:
+        targets = [(name, strategy) for name in dict.fromkeys(args.container)]
+    else:
+        # Discovered once the registry exists
+        targets = []
+
+    # Create registry instances, with enough pooled connections for the delete
+    # workers of every container pruned at once
     registries: List[BaseRegistry] = []
+    parallel = min(args.max_parallel, len(targets)) if targets else args.max_parallel
+    pool_size = max(args.concurrency * parallel, DEFAULT_POOL_SIZE)
+    first_container = targets[0][0] if targets else ''
+    retry_budget = RetryBudget(args.retry_budget)
+    # Cached listings and logins would change the requests a cassette holds
+    cassette = _open_cassette(args, parser) if args.record or args.replay else None
+    use_cache = not (args.no_cache or cassette)
+    cache = _open_cache(args.verbose, notes) if use_cache else None
+    tokens = TokenCache() if use_cache else None
+    metrics = Metrics() if args.metrics_out else None
 
     try:
-        if args.registry == 'all':
-            registries = create_all_registries(args.container, args.verbose)
+        if plans is not None:
+            # One registry per registry type and GHCR owner in the plan
+            kinds: Dict[Tuple[str, Optional[str]], str] = {}
+            for entry in plans:
+                kinds.setdefault((entry.registry_type, entry.owner), entry.container)
+            registries = [create_registry(registry_type, container, args.verbose, pool_size, args.max_retries,
+                                          retry_budget, cache, tokens, owner=owner, transport=cassette,
+                                          metrics=metrics)
+                          for (registry_type, owner), container in kinds.items()]
+        elif args.registry == 'all':
+            registries = create_all_registries(first_container, args.verbose, pool_size,
+                                               args.max_retries, retry_budget, cache, tokens, cassette, metrics)
         else:
             registries = [create_registry(
-                args.registry, args.container, args.verbose)]
+                args.registry, first_container, args.verbose, pool_size, args.max_retries, retry_budget, cache,
+                tokens, owner=args.owner, transport=cassette, metrics=metrics)]
     except ValueError as e:
         print(f"Error: {e}", file=sys.stderr)
         sys.exit(1)
@@ -180,19 +907,85 @@ Environment variables:
         print("No registries available. Please check your environment variables.", file=sys.stderr)
         sys.exit(1)
 
-    # Prune each registry
-    total_deleted = 0
-    for registry in registries:
-        deleted_count = prune_registry(registry, strategy, args.dry_run)
-        total_deleted += deleted_count
+    if output_format.logs_to_stderr:
+        for registry in registries:
+            registry.output = sys.stderr
+
+    if discover:
+        try:
+            names = registries[0].discover_packages(args.package_glob)
+        except RegistryError as e:
+            registries[0].close()
+            print(f"Error discovering packages for {args.owner}: {e}", file=sys.stderr)
+            sys.exit(1)
+        if not names:
+            registries[0].close()
+            print(f"No container packages found for {args.owner}", file=notes)
+            return
+        targets = [(name, strategy) for name in names]
 
-    # Summary
-    print(f"\n=== Summary ===")
-    if total_deleted == 0:
-        print('No images qualified for deletion')
+    # Every other container reuses the first one's sessions, logins and
+    # scheduler, so they all draw on one rate limit
+    if plans is not None:
+        owners = {(registry.registry_type, getattr(registry, 'owner', None)): registry for registry in registries}
+        jobs = []
+        for entry in plans:
+            registry = owners[entry.registry_type, entry.owner]
+            jobs.append((registry if registry.container_name == entry.container
+                         else registry.for_container(entry.container), None))
     else:
-        action = "would have been deleted" if args.dry_run else "were deleted"
-        print(f"{total_deleted} image{'' if total_deleted == 1 else 's'} {action}")
+        jobs = [(registry if registry.container_name == name else registry.for_container(name), container_strategy)
+                for name, container_strategy in targets for registry in registries]
+        if args.follow_references:
+            jobs = [(registry, _follow_references(registry, job_strategy, use_cache, notes))
+                    for registry, job_strategy in jobs]
+
+    # Prune every registry in parallel, closing pooled connections when done
+    # (--plan-out deletes nothing)
+    dry_run = args.dry_run or bool(args.plan_out)
+    start = time.perf_counter()
+    with ExitStack() as stack:
+        for registry in registries:
+            stack.enter_context(registry)
+        reports = prune_all([registry for registry, _ in jobs], strategy, dry_run, args.concurrency,
+                            args.stream, strategies=[job_strategy for _, job_strategy in jobs],
+                            max_parallel=args.max_parallel, output_format=output_format,
+                            fingerprint=bool(args.plan_out), plans=plans)
+    wall_time = time.perf_counter() - start
+
+    sys.stdout.write(output_format.summary(reports, dry_run, wall_time))
+    sys.stdout.flush()
+
+    if args.plan_out:
+        _write_plan(args.plan_out, jobs, reports, notes)
+
+    if cache is not None and cache.hits and args.verbose:
+        print(f"{cache.hits} listing page{'' if cache.hits == 1 else 's'} served from the HTTP cache", file=notes)
+
+    if retry_budget.exhausted:
+        print(f"Retry budget of {retry_budget.limit} was exhausted", file=notes)
+
+    if metrics is not None:
+        _write_metrics(metrics, args.metrics_out, [registry for registry, _ in jobs], reports)
+
+    if args.record:
+        cassette.save(argv=sys.argv[1:], wall_time=round(wall_time, 3),
+                      env={name: os.environ[name] for name in REPLAY_ENVIRONMENT if os.environ.get(name)},
+                      credentials=[name for name in REPLAY_CREDENTIALS if os.environ.get(name)])
+        print(f"Recorded {len(cassette.interactions)} HTTP requests to {args.record}", file=notes)
+
+    if args.replay:
+        played = len(cassette.interactions) - cassette.unplayed
+        print(f"Replayed {played} of {len(cassette.interactions)} recorded HTTP requests in {wall_time:.2f}s "
+              f"(recorded run: {cassette.meta.get('wall_time', 0):.2f}s)", file=notes)
+        if cassette.misses or cassette.unplayed:
+            print(f"Error: the run sent {cassette.misses} request{'' if cassette.misses == 1 else 's'} missing "
+                  f"from the cassette and left {cassette.unplayed} recorded request"
+                  f"{'' if cassette.unplayed == 1 else 's'} unsent", file=sys.stderr)
+            sys.exit(1)
+
+    if any(report.error for report in reports):
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,161 @@
+"""Output formats for prune results: human-readable text and JSON Lines."""
+
+import json
+import sys
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, TextIO
+
+# Lines collected before they are written to the output stream in one call
+WRITE_BUFFER_LINES = 500
+
+
+def _describe(version) -> str:
+    """Format a version's ID and tags for log output."""
+    tag_info = f" (tags: {', '.join(version.tags)})" if version.tags else " (untagged)"
+    return f"{version.id}{tag_info}"
+
+
+class BufferedLines:
+    """Collects output lines and writes them in batches instead of one write per line.
+
+    ``out`` is resolved when flushing, so None means whatever sys.stdout is at
+    that point.
+    """
+
+    def __init__(self, out: Optional[TextIO], limit: int = WRITE_BUFFER_LINES):
+        self.out = out
+        self.limit = limit
+        self._lines: List[str] = []
+
+    def add(self, text: str) -> None:
+        if not text:
+            return
+        self._lines.append(text)
+        if len(self._lines) >= self.limit:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._lines:
+            (self.out if self.out is not None else sys.stdout).write(''.join(self._lines))
+            self._lines = []
+
+    def __enter__(self) -> 'BufferedLines':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.flush()
+
+
+class OutputFormat(ABC):
+    """Renders prune progress and results.
+
+    Every method returns the text to write (ending in a newline), or an empty
+    string for events the format leaves out.
+    """
+
+    # Send the registries' verbose log messages to stderr so stdout stays parseable
+    logs_to_stderr = False
+
+    @abstractmethod
+    def header(self, report, description: str) -> str:
+        """Start of a registry/container's output."""
+
+    @abstractmethod
+    def version(self, report, version, result: str, latency: Optional[float] = None) -> str:
+        """A version planned for deletion ('planned') or the outcome of deleting it ('deleted' or 'failed')."""
+
+    @abstractmethod
+    def message(self, report, text: str) -> str:
+        """An informational note about a registry/container."""
+
+    @abstractmethod
+    def error(self, report, text: str) -> str:
+        """An error that stopped a registry/container's listing or deletes."""
+
+    @abstractmethod
+    def summary(self, reports: List, dry_run: bool, wall_time: float) -> str:
+        """Totals for the whole run."""
+
+
+class TextOutput(OutputFormat):
+    """Human-readable output, one line per image (the default)."""
+
+    def header(self, report, description: str) -> str:
+        return f"\n=== {report.label} ===\n{description}\n"
+
+    def version(self, report, version, result: str, latency: Optional[float] = None) -> str:
+        if result == 'planned':
+            return f"Would delete image: {_describe(version)}\n"
+        if result == 'deleted':
+            return f"Deleted image: {_describe(version)}\n"
+        return f"Failed to delete image: {_describe(version)}\n"
+
+    def message(self, report, text: str) -> str:
+        return f"{text}\n"
+
+    def error(self, report, text: str) -> str:
+        return f"{text}\n"
+
+    def summary(self, reports: List, dry_run: bool, wall_time: float) -> str:
+        lines = ["", "=== Summary ==="]
+        for report in reports:
+            counts = f"{report.planned} planned" if dry_run else f"{report.deleted} deleted, {report.failed} failed"
+            retries = f" ({report.retries} retr{'y' if report.retries == 1 else 'ies'})" if report.retries else ""
+            status = f" - error: {report.error}" if report.error else ""
+            lines.append(f"{report.label}: {counts} in {report.elapsed:.2f}s{retries}{status}")
+        if len(reports) > 1:
+            slowest = max(reports, key=lambda r: r.elapsed)
+            lines.append(f"Critical path: {slowest.label} ({slowest.elapsed:.2f}s of {wall_time:.2f}s wall time)")
+
+        total_deleted = sum(report.deleted for report in reports)
+        if total_deleted == 0:
+            lines.append('No images qualified for deletion')
+        else:
+            action = "would have been deleted" if dry_run else "were deleted"
+            lines.append(f"{total_deleted} image{'' if total_deleted == 1 else 's'} {action}")
+        return '\n'.join(lines) + '\n'
+
+
+class JsonLinesOutput(OutputFormat):
+    """One JSON object per line: a record per deletion decision and a final summary record."""
+
+    logs_to_stderr = True
+
+    @staticmethod
+    def _record(**fields: Any) -> str:
+        return json.dumps(fields, separators=(',', ':')) + '\n'
+
+    def header(self, report, description: str) -> str:
+        return ''
+
+    def version(self, report, version, result: str, latency: Optional[float] = None) -> str:
+        return self._record(
+            type='version', registry=report.registry_name, container=report.container, id=version.id,
+            tags=list(version.tags), created_at=version.created_at.isoformat(), action='delete', result=result,
+            latency=None if latency is None else round(latency, 6),
+        )
+
+    def message(self, report, text: str) -> str:
+        return ''
+
+    def error(self, report, text: str) -> str:
+        return self._record(type='error', registry=report.registry_name, container=report.container, message=text)
+
+    def summary(self, reports: List, dry_run: bool, wall_time: float) -> str:
+        registries: List[Dict[str, Any]] = [
+            {'registry': report.registry_name, 'container': report.container, 'listed': report.listed,
+             'planned': report.planned, 'deleted': report.deleted, 'failed': report.failed,
+             'retries': report.retries, 'elapsed': round(report.elapsed, 6), 'error': report.error}
+            for report in reports
+        ]
+        return self._record(
+            type='summary', dry_run=dry_run, wall_time=round(wall_time, 6),
+            planned=sum(report.planned for report in reports), deleted=sum(report.deleted for report in reports),
+            failed=sum(report.failed for report in reports), registries=registries,
+        )
+
+
+OUTPUT_FORMATS = {
+    'text': TextOutput,
+    'jsonl': JsonLinesOutput,
+}
@@ -0,0 +1,87 @@
+"""Deletion plans written by --plan-out and executed later by --apply."""
+
+import json
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from registries.base import ImageVersion
+
+PLAN_VERSION = 1
+
+
+class PlanEntry:
+    """The versions planned for deletion from one registry/container.
+
+    ``fingerprint`` is the registry's inventory_fingerprint() taken just
+    before the versions were listed; --apply compares it with a fresh one and
+    refuses to delete if the inventory changed. ``state`` is whatever the
+    registry needs to delete the versions without listing them again (see
+    BaseRegistry.plan_state()).
+    """
+
+    def __init__(self, registry_type: str, container: str, versions: List[ImageVersion],
+                 fingerprint: Optional[Dict[str, Any]] = None, state: Optional[Dict[str, Any]] = None,
+                 owner: Optional[str] = None, description: str = ''):
+        self.registry_type = registry_type
+        self.container = container
+        self.versions = versions
+        self.fingerprint = fingerprint
+        self.state = state or {}
+        self.owner = owner
+        self.description = description
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'registry': self.registry_type,
+            'container': self.container,
+            'owner': self.owner,
+            'strategy': self.description,
+            'fingerprint': self.fingerprint,
+            'state': self.state,
+            'versions': [
+                {'id': v.id, 'name': v.name, 'created_ts': v.created_ts, 'tags': list(v.tags),
+                 'digest': v.digest, 'size': v.size}
+                for v in self.versions
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'PlanEntry':
+        versions = [
+            ImageVersion(id=v['id'], name=v['name'], created_at=v['created_ts'], tags=v['tags'],
+                         digest=v.get('digest'), size=v.get('size'))
+            for v in data['versions']
+        ]
+        return cls(data['registry'], data['container'], versions, data.get('fingerprint'), data.get('state'),
+                   data.get('owner'), data.get('strategy', ''))
+
+
+def write_plan(path: str, entries: List[PlanEntry]) -> None:
+    """Write a plan file, replacing any existing one atomically."""
+    data = {
+        'version': PLAN_VERSION,
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'entries': [entry.to_dict() for entry in entries],
+    }
+
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def load_plan(path: str) -> List[PlanEntry]:
+    """Read the entries of a plan file. Raises ValueError if it can't be read."""
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ValueError(f'Cannot read plan {path}: {e}')
+    if not isinstance(data, dict) or data.get('version') != PLAN_VERSION:
+        raise ValueError(f'{path} is not a version {PLAN_VERSION} deletion plan')
+
+    try:
+        return [PlanEntry.from_dict(entry) for entry in data['entries']]
+    except (KeyError, TypeError) as e:
+        raise ValueError(f'Invalid entry in plan {path}: {e}')
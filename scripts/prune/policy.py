@@ -0,0 +1,416 @@
+"""Retention policies: a small expression language compiled into a single-pass pruning strategy.
+
+A policy is an expression saying which versions to keep; every other
+version is deleted. Terms can be combined with ``and``, ``or``, ``not`` and
+parentheses:
+
+    tagged, untagged        whether the version has any tag
+    tag "GLOB"              any tag matches a shell-style pattern
+    tag ~ "REGEX"           any tag contains a match for a regular expression
+    age < 3d                age compared with a duration (<, <=, > or >=);
+                            units are m, h, d and w, and days by default
+    rank <= 25              position by creation time, 1 being the newest
+    latest 25               the newest 25 versions (the same as rank <= 25)
+
+For example, "keep the latest 25, anything tagged v*, and untagged images
+newer than 3 days":
+
+    latest 25 or tag "v*" or (untagged and age < 3d)
+
+Versions with a protected tag are always kept, whatever the expression says.
+Rows that share a version ID (the tags of one Docker Hub digest) are one
+image: ranks count distinct IDs, and an ID is kept with all of its rows if
+the expression keeps any of them.
+
+The expression is parsed and compiled once: every tag pattern goes into one
+precompiled alternation that most tags fail in a single search, the tags'
+matches are memoized, and the parsed terms become nested closures that
+decide each version in one walk of the inventory. For a VersionTable (see
+table.py), the terms become closures over whole-array masks of the table's
+columns instead, with each distinct tag matched once.
+"""
+
+import json
+import operator
+import re
+import time
+from fnmatch import translate
+from functools import reduce
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from registries.base import ImageVersion
+from strategies import PruningStrategy
+
+if TYPE_CHECKING:
+    from table import VersionTable
+
+# Seconds per unit of an age duration
+DURATION_UNITS = {'m': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+_TOKEN = re.compile(r'''
+    \s*(?:
+        (?P<number>\d+(?:\.\d+)?)(?P<unit>[a-z]\b)?
+      | (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+      | (?P<op><=|>=|<|>|~|\(|\))
+      | (?P<word>[A-Za-z_]+)
+    )''', re.VERBOSE)
+
+# Comparison operators of age terms, flipped to compare creation times with the cutoff
+_AGE_OPS = {'<': '>', '<=': '>=', '>': '<', '>=': '<='}
+
+_COMPARE = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+
+# Decides whether to keep a version from the version, its tag bits and its rank
+Predicate = Callable[[ImageVersion, int, int], Any]
+
+
+class PolicyError(ValueError):
+    """Raised when a policy expression or file is invalid."""
+
+
+def _tokenize(source: str) -> List[Tuple[str, Any]]:
+    tokens = []
+    source = source.rstrip()
+    pos = 0
+    while pos < len(source):
+        match = _TOKEN.match(source, pos)
+        if match is None:
+            raise PolicyError(f'Unexpected {source[pos:].strip()[:20]!r} in policy: {source}')
+        pos = match.end()
+        if match.group('number') is not None:
+            tokens.append(('number', (float(match.group('number')), match.group('unit'))))
+        elif match.group('string') is not None:
+            # Backslashes escape the quote character; anything else is kept for regexes
+            quote = match.group('string')[0]
+            tokens.append(('string', match.group('string')[1:-1].replace('\\' + quote, quote)))
+        elif match.group('op') is not None:
+            tokens.append(('op', match.group('op')))
+        else:
+            tokens.append(('word', match.group('word').lower()))
+    return tokens
+
+
+class _Parser:
+    """Recursive descent parser producing nested tuples, with the tag patterns collected separately."""
+
+    def __init__(self, source: str):
+        self.source = source
+        self.tokens = _tokenize(source)
+        self.pos = 0
+        # (kind, pattern) of every tag matcher, in first-use order
+        self.patterns: List[Tuple[str, str]] = []
+
+    def parse(self) -> tuple:
+        if not self.tokens:
+            raise PolicyError('Empty policy')
+        node = self._or()
+        if self.pos < len(self.tokens):
+            raise PolicyError(f'Unexpected {self._describe(self.tokens[self.pos])} in policy: {self.source}')
+        return node
+
+    def _describe(self, token: Optional[Tuple[str, Any]]) -> str:
+        if token is None:
+            return 'end'
+        kind, value = token
+        if kind == 'number':
+            return repr(f'{value[0]:g}{value[1] or ""}')
+        return repr(value)
+
+    def _peek(self) -> Optional[Tuple[str, Any]]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def _take(self, kind: str, value: Any = None) -> Any:
+        token = self._peek()
+        if token is None or token[0] != kind or (value is not None and token[1] != value):
+            expected = repr(value) if value is not None else f'a {kind}'
+            raise PolicyError(f'Expected {expected} but found {self._describe(token)} in policy: {self.source}')
+        self.pos += 1
+        return token[1]
+
+    def _accept(self, kind: str, value: Any) -> bool:
+        if self._peek() == (kind, value):
+            self.pos += 1
+            return True
+        return False
+
+    def _or(self) -> tuple:
+        terms = [self._and()]
+        while self._accept('word', 'or'):
+            terms.append(self._and())
+        return terms[0] if len(terms) == 1 else ('or', terms)
+
+    def _and(self) -> tuple:
+        terms = [self._not()]
+        while self._accept('word', 'and'):
+            terms.append(self._not())
+        return terms[0] if len(terms) == 1 else ('and', terms)
+
+    def _not(self) -> tuple:
+        if self._accept('word', 'not'):
+            return ('not', self._not())
+        if self._accept('op', '('):
+            node = self._or()
+            self._take('op', ')')
+            return node
+        return self._term()
+
+    def _comparison(self) -> str:
+        op = self._take('op')
+        if op not in _AGE_OPS:
+            raise PolicyError(f'Expected a comparison but found {op!r} in policy: {self.source}')
+        return op
+
+    def _count(self) -> int:
+        value, unit = self._take('number')
+        if unit is not None or value != int(value):
+            raise PolicyError(f'Expected a whole number but found {value:g}{unit or ""} in policy: {self.source}')
+        return int(value)
+
+    def _term(self) -> tuple:
+        word = self._take('word')
+        if word in ('tagged', 'untagged'):
+            return (word,)
+        if word == 'tag':
+            kind = 'regex' if self._accept('op', '~') else 'glob'
+            return ('tag', self.add_pattern(kind, self._take('string')))
+        if word == 'age':
+            op = self._comparison()
+            value, unit = self._take('number')
+            if unit is not None and unit not in DURATION_UNITS:
+                raise PolicyError(f'Unknown duration unit {unit!r} in policy: {self.source}')
+            return ('age', op, value * DURATION_UNITS[unit or 'd'])
+        if word == 'rank':
+            return ('rank', self._comparison(), self._count())
+        if word == 'latest':
+            return ('rank', '<=', self._count())
+        raise PolicyError(f'Unknown policy term {word!r} in policy: {self.source}')
+
+    def add_pattern(self, kind: str, pattern: str) -> int:
+        """Return the index of a tag matcher, adding it if it is new."""
+        if (kind, pattern) not in self.patterns:
+            self.patterns.append((kind, pattern))
+        return self.patterns.index((kind, pattern))
+
+
+def _pattern_regex(kind: str, pattern: str) -> str:
+    if kind == 'glob':
+        return f'^{translate(pattern)}'
+    try:
+        re.compile(pattern)
+    except re.error as e:
+        raise PolicyError(f'Invalid tag regex {pattern!r}: {e}')
+    return pattern
+
+
+def _tag_matcher(patterns: Sequence[Tuple[str, str]]) -> Callable[[Iterable[str]], int]:
+    """Return a function giving the bitmask of patterns any of the given tags match.
+
+    Tags are first searched with one alternation of every pattern; only the
+    tags it matches are tried against each pattern. Results are memoized per
+    tag, so each distinct tag is matched once.
+    """
+    regexes = [_pattern_regex(kind, pattern) for kind, pattern in patterns]
+    compiled = [re.compile(regex) for regex in regexes]
+    try:
+        combined = re.compile('|'.join(f'(?:{regex})' for regex in regexes))
+    except re.error:
+        # Inline flags such as (?i) are only allowed at the start of a whole regex
+        combined = None
+    memo: Dict[str, int] = {}
+
+    def tag_bits(tag: str) -> int:
+        if combined is not None and combined.search(tag) is None:
+            bits = 0
+        else:
+            bits = sum(1 << k for k, regex in enumerate(compiled) if regex.search(tag))
+        memo[tag] = bits
+        return bits
+
+    def mask(tags: Iterable[str]) -> int:
+        bits = 0
+        for tag in tags:
+            tag_mask = memo.get(tag)
+            bits |= tag_bits(tag) if tag_mask is None else tag_mask
+        return bits
+
+    return mask
+
+
+def _ranks(versions: List[ImageVersion]) -> List[int]:
+    """Rank of every version's ID by creation time, 1 being the newest.
+
+    An ID is as new as its newest row, and of IDs created at the same time
+    the first listed rank first, as in VersionTable.ranks().
+    """
+    group_index: Dict[str, int] = {}
+    groups = [group_index.setdefault(v.id, len(group_index)) for v in versions]
+    created = [v.created_ts for v in versions]
+    if len(group_index) < len(versions):
+        row_created = created
+        created = [float('-inf')] * len(group_index)
+        for group, version_created in zip(groups, row_created):
+            if version_created > created[group]:
+                created[group] = version_created
+
+    # A reversed sort is still stable, so ties keep inventory order
+    group_ranks = [0] * len(created)
+    for rank, group in enumerate(sorted(range(len(created)), key=created.__getitem__, reverse=True), 1):
+        group_ranks[group] = rank
+    return list(map(group_ranks.__getitem__, groups))
+
+
+class RetentionPolicy(PruningStrategy):
+    """Keeps the versions a compiled policy expression matches and deletes the rest.
+
+    Use compile_policy() or load_policy_file() to build one.
+    """
+
+    prefers_table = True
+
+    def __init__(self, source: str, protect: Sequence[str] = (), now: Optional[float] = None):
+        self.source = source
+        self.protect = list(protect)
+
+        parser = _Parser(source)
+        node = parser.parse()
+        protect_bits = sum(1 << parser.add_pattern('glob', pattern) for pattern in self.protect)
+
+        self.uses_rank = False
+        self.uses_tags = bool(parser.patterns)
+        self._now = time.time() if now is None else now
+        self._mask = _tag_matcher(parser.patterns) if self.uses_tags else None
+
+        self._keep = self._predicate(node)
+        self._keep_rows = self._table_predicate(node)
+        if protect_bits:
+            keep, keep_rows = self._keep, self._keep_rows
+            self._keep = lambda v, m, r: m & protect_bits or keep(v, m, r)
+            self._keep_rows = lambda t, tag: tag(protect_bits) | keep_rows(t, tag)
+
+    def _predicate(self, node: tuple) -> Predicate:
+        """Build the closure deciding a parsed expression from the version ``v``, its tag bits ``m`` and rank ``r``."""
+        kind = node[0]
+        if kind == 'or':
+            return reduce(lambda left, right: lambda v, m, r: left(v, m, r) or right(v, m, r),
+                          map(self._predicate, node[1]))
+        if kind == 'and':
+            return reduce(lambda left, right: lambda v, m, r: left(v, m, r) and right(v, m, r),
+                          map(self._predicate, node[1]))
+        if kind == 'not':
+            term = self._predicate(node[1])
+            return lambda v, m, r: not term(v, m, r)
+        if kind == 'tagged':
+            return lambda v, m, r: v.tags
+        if kind == 'untagged':
+            return lambda v, m, r: not v.tags
+        if kind == 'tag':
+            bit = 1 << node[1]
+            return lambda v, m, r: m & bit
+        if kind == 'age':
+            # Younger than the duration means created after the cutoff
+            compare, cutoff = _COMPARE[_AGE_OPS[node[1]]], self._now - node[2]
+            return lambda v, m, r: compare(v.created_ts, cutoff)
+        self.uses_rank = True
+        compare, rank = _COMPARE[node[1]], node[2]
+        return lambda v, m, r: compare(r, rank)
+
+    def _table_predicate(self, node: tuple) -> Callable[['VersionTable', Callable[[int], Any]], Any]:
+        """Build the closure evaluating a parsed expression as a row mask of a VersionTable ``t``."""
+        kind = node[0]
+        if kind in ('or', 'and'):
+            combine = operator.or_ if kind == 'or' else operator.and_
+            terms = [self._table_predicate(term) for term in node[1]]
+            return lambda t, tag: reduce(combine, (term(t, tag) for term in terms))
+        if kind == 'not':
+            term = self._table_predicate(node[1])
+            return lambda t, tag: ~term(t, tag)
+        if kind == 'tagged':
+            return lambda t, tag: t.tagged
+        if kind == 'untagged':
+            return lambda t, tag: ~t.tagged
+        if kind == 'tag':
+            bit = 1 << node[1]
+            return lambda t, tag: tag(bit)
+        if kind == 'age':
+            op, cutoff = _AGE_OPS[node[1]], self._now - node[2]
+            return lambda t, tag: t.compare_created(op, cutoff)
+        op, rank = node[1], node[2]
+        return lambda t, tag: t.compare_rank(op, rank)
+
+    def select(self, versions: List[ImageVersion]) -> List[ImageVersion]:
+        keep, mask = self._keep, self._mask
+        ranks = _ranks(versions) if self.uses_rank else None
+        kept_ids = set()
+        for i, v in enumerate(versions):
+            if keep(v, mask(v.tags) if mask is not None and v.tags else 0, ranks[i] if ranks is not None else 0):
+                kept_ids.add(v.id)
+        return [v for v in versions if v.id not in kept_ids]
+
+    def select_table(self, table: 'VersionTable') -> List[ImageVersion]:
+        # Tags are matched once per distinct tag, then each tag term is spread to the rows
+        tag_bits = [self._mask((name,)) for name in table.tags] if self.uses_tags else []
+
+        def tag(bits: int):
+            return table.with_tags([tag_mask & bits for tag_mask in tag_bits])
+
+        return table.pick(~table.any_in_group(self._keep_rows(table, tag)))
+
+    def get_description(self) -> str:
+        protected = f"; protected tags: {', '.join(self.protect)}" if self.protect else ""
+        return f"Keeping images matching the policy: {self.source}{protected} (deleting all others)"
+
+
+def compile_policy(source: str, protect: Sequence[str] = ()) -> RetentionPolicy:
+    """Compile a policy expression. Raises PolicyError if it is invalid."""
+    return RetentionPolicy(source, protect)
+
+
+def load_policy_file(path: str) -> RetentionPolicy:
+    """Compile the policy in a JSON or YAML file. Raises PolicyError if it can't be read or is invalid.
+
+    The file holds an object with a "keep" expression, or a list of
+    expressions any of which keeps a version, and an optional "protect"
+    list of tag patterns:
+
+        {"keep": ["latest 25", "tag \\"v*\\"", "untagged and age < 3d"], "protect": ["latest", "stable"]}
+
+    YAML files (.yml or .yaml) need PyYAML.
+    """
+    try:
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+    except OSError as e:
+        raise PolicyError(f'Cannot read policy file {path}: {e}')
+
+    if path.endswith(('.yml', '.yaml')):
+        try:
+            import yaml
+        except ImportError:
+            raise PolicyError(f'Reading the YAML policy file {path} requires PyYAML (pip install pyyaml)')
+        try:
+            data = yaml.safe_load(text)
+        except yaml.YAMLError as e:
+            raise PolicyError(f'Cannot read policy file {path}: {e}')
+    else:
+        try:
+            data = json.loads(text)
+        except ValueError as e:
+            raise PolicyError(f'Cannot read policy file {path}: {e}')
+
+    if not isinstance(data, dict) or 'keep' not in data:
+        raise PolicyError(f'Policy file {path} must contain an object with a "keep" expression')
+    unknown = set(data) - {'keep', 'protect'}
+    if unknown:
+        raise PolicyError(f'Unknown key(s) in policy file {path}: {", ".join(sorted(unknown))}')
+
+    keep = data['keep']
+    if isinstance(keep, list) and keep and all(isinstance(term, str) for term in keep):
+        keep = ' or '.join(f'({term})' for term in keep)
+    elif not isinstance(keep, str):
+        raise PolicyError(f'"keep" in policy file {path} must be an expression or a list of expressions')
+
+    protect = data.get('protect', [])
+    if not isinstance(protect, list) or not all(isinstance(pattern, str) for pattern in protect):
+        raise PolicyError(f'"protect" in policy file {path} must be a list of tag patterns')
+
+    return RetentionPolicy(keep, protect)
@@ -1,19 +1,62 @@
 """Base registry interface for container image pruning."""
 
+import copy
+import time
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any, Optional
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, List, Dict, Any, Iterable, Iterator, Optional, TextIO, Tuple, Union
+from datetime import datetime, timezone
+
+from .cache import HttpCache
+from .http import HttpClient, DEFAULT_POOL_SIZE
+from .ratelimit import RateLimitScheduler
+from .retry import RetryPolicy
+
+if TYPE_CHECKING:
+    from .metrics import Metrics
+    from .transport import Cassette
+
+
+class RegistryError(Exception):
+    """Raised when a registry API call fails after all retries."""
+
+
+def parse_timestamp(value: str) -> int:
+    """Return the epoch seconds of an API timestamp such as 2024-01-01T00:00:00.123456Z.
+
+    Timestamps without an offset are taken to be UTC.
+    """
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
 
 
 class ImageVersion:
-    """Represents a container image version."""
+    """Represents a container image version.
+
+    Instances are kept for every version in a repository, so only the fields
+    strategies use are stored, in slots: the creation time as an epoch
+    integer (``created_ts``) and tags as a tuple. The raw API payload is only
+    kept in ``metadata`` when a registry is asked to keep it.
+    """
+
+    __slots__ = ('id', 'name', 'created_ts', 'tags', 'digest', 'size', 'metadata')
 
-    def __init__(self, id: str, name: str, created_at: datetime, tags: List[str], metadata: Optional[Dict[str, Any]] = None):
+    def __init__(self, id: str, name: str, created_at: Union[datetime, int], tags: Iterable[str],
+                 metadata: Optional[Dict[str, Any]] = None, digest: Optional[str] = None, size: Optional[int] = None):
         self.id = id
         self.name = name
-        self.created_at = created_at
-        self.tags = tags
-        self.metadata = metadata or {}
+        self.created_ts = int(created_at) if isinstance(created_at, (int, float)) else int(created_at.timestamp())
+        self.tags = tuple(tags)
+        self.digest = digest
+        self.size = size
+        self.metadata = metadata
+
+    @property
+    def created_at(self) -> datetime:
+        """Creation time as an aware UTC datetime."""
+        return datetime.fromtimestamp(self.created_ts, timezone.utc)
 
     @property
     def is_tagged(self) -> bool:
@@ -21,27 +64,175 @@ class ImageVersion:
         return len(self.tags) > 0
 
     def __repr__(self) -> str:
-        return f"ImageVersion(id={self.id}, name={self.name}, created_at={self.created_at}, tags={self.tags})"
+        return f"ImageVersion(id={self.id}, name={self.name}, created_at={self.created_at}, tags={list(self.tags)})"
+
+
+class DeleteResult:
+    """Outcome of deleting one version."""
+
+    def __init__(self, version_id: str, success: bool, elapsed: float = 0.0):
+        self.version_id = version_id
+        self.success = success
+        self.elapsed = elapsed
+
+    def __repr__(self) -> str:
+        return f"DeleteResult(version_id={self.version_id}, success={self.success}, elapsed={self.elapsed:.3f})"
 
 
 class BaseRegistry(ABC):
     """Abstract base class for registry implementations."""
 
-    def __init__(self, token: str, container_name: str, verbose: bool = False):
+    # Keep each version's decoded API response in ImageVersion.metadata.
+    # Off by default: the payloads are many times larger than the versions.
+    keep_payloads = False
+
+    # Name create_registry() knows this registry by, saved in deletion plans
+    registry_type = ''
+
+    # True when the registry defines fetch_manifest(digest), returning the
+    # decoded manifest or image index a digest names or None if there is
+    # none, so pruning can follow the references from image indexes to
+    # their manifests. Callers check this before fetching.
+    supports_manifests = False
+
+    def __init__(self, token: str, container_name: str, verbose: bool = False, pool_size: int = DEFAULT_POOL_SIZE,
+                 scheduler: Optional[RateLimitScheduler] = None, retry: Optional[RetryPolicy] = None,
+                 cache: Optional[HttpCache] = None, transport: Optional['Cassette'] = None,
+                 metrics: Optional['Metrics'] = None):
         self.token = token
         self.container_name = container_name
         self.verbose = verbose
+        self.pool_size = pool_size
+        # Paces every HTTP call against the registry's advertised rate limit
+        self.scheduler = scheduler or RateLimitScheduler()
+        # Re-sends transient failures; retries are counted on the policy
+        self.retry = retry or RetryPolicy()
+        # Optional on-disk cache that revalidates listing pages with ETags
+        self.cache = cache
+        # Optional cassette the HTTP exchanges are recorded to or replayed from
+        self.transport = transport
+        # Optional request and phase metrics shared by the whole run
+        self.metrics = metrics
+        self._http: Optional[HttpClient] = None
+        # Where log messages go (None means sys.stdout); pointed at a buffer
+        # when several registries are pruned in parallel.
+        self.output: Optional[TextIO] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def http(self) -> HttpClient:
+        """HTTP client shared by every call this registry makes (created lazily)."""
+        if self._http is None:
+            self._http = HttpClient(self._default_headers(), pool_size=self.pool_size, scheduler=self.scheduler,
+                                    retry=self.retry, cache=self.cache, transport=self.transport,
+                                    metrics=self.metrics, name=self.registry_name)
+        return self._http
+
+    def _default_headers(self) -> Dict[str, str]:
+        """Headers sent with every request to this registry."""
+        return {}
+
+    @staticmethod
+    def _delete_succeeded(resp) -> bool:
+        """Return True if a DELETE response means the resource is gone.
+
+        A 404 on a request that had to be re-sent means an earlier attempt
+        already deleted it, so it counts as success.
+        """
+        if 200 <= resp.status_code < 300:
+            return True
+        return resp.status_code == 404 and getattr(resp, 'attempts', 1) > 1
+
+    def _log(self, message: str) -> None:
+        """Print a log message to this registry's output stream."""
+        print(message, file=self.output)
+
+    def for_container(self, container_name: str) -> 'BaseRegistry':
+        """Return a registry for another container in the same account.
+
+        The copy sends through this registry's pooled session and shares its
+        credentials, rate-limit scheduler and retry budget, but counts its
+        own retries. This registry keeps ownership of the connections.
+        """
+        clone = copy.copy(self)
+        clone.container_name = container_name
+        clone.retry = self.retry.fork()
+        clone._http = self.http.fork(clone.retry)
+        clone.output = None
+        return clone
+
+    def close(self) -> None:
+        """Release the registry's HTTP connections."""
+        if self._http is not None:
+            self._http.close()
 
     @abstractmethod
     def list_versions(self) -> List[ImageVersion]:
         """List all versions of the container image."""
         pass
 
+    def iter_versions(self) -> Iterator[ImageVersion]:
+        """Yield versions of the container image as they are fetched.
+
+        Registries that page through their API override this to yield each
+        page as it arrives; the default simply walks list_versions().
+        """
+        yield from self.list_versions()
+
     @abstractmethod
     def delete_version(self, version_id: str) -> bool:
         """Delete a specific version by ID. Returns True if successful."""
         pass
 
+    def delete_versions(self, version_ids: List[str], concurrency: int = 1,
+                        names: Optional[List[str]] = None) -> Iterator[DeleteResult]:
+        """Delete many versions, yielding one result per ID in input order.
+
+        ``names`` holds each version's ImageVersion.name, for registries that
+        delete by name; the default deletes by ID and ignores it. Registries
+        with a bulk delete API override this. The default sends
+        delete_version() calls through a pool of ``concurrency`` threads;
+        results are yielded as soon as they are available in order.
+        """
+        yield from self._delete_each([(version_id,) for version_id in version_ids], concurrency, self.delete_version)
+
+    @staticmethod
+    def _delete_each(calls: List[Tuple], concurrency: int, delete: Callable[..., bool]) -> Iterator[DeleteResult]:
+        """Run ``delete(*args)`` for each tuple of arguments (the version ID first) on ``concurrency`` threads."""
+        def timed(args: Tuple) -> DeleteResult:
+            start = time.perf_counter()
+            success = delete(*args)
+            return DeleteResult(args[0], success, time.perf_counter() - start)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            yield from executor.map(timed, calls)
+
+    def inventory_fingerprint(self) -> Optional[Dict[str, Any]]:
+        """Return a cheap summary of the container's versions, or None if the registry has none.
+
+        Taken when a deletion plan is made and again before it is applied;
+        if the two differ, versions were pushed or deleted in between and
+        the plan is stale. Registries override this with a one-item listing
+        request.
+        """
+        return None
+
+    def plan_state(self, versions: List[ImageVersion]) -> Dict[str, Any]:
+        """Return what this registry needs, beyond the versions, to delete them without listing.
+
+        Called after the listing a plan was made from; the result is saved
+        in the plan and handed to restore_plan_state() when it is applied.
+        """
+        return {}
+
+    def restore_plan_state(self, state: Dict[str, Any]) -> None:
+        """Restore the state saved by plan_state() before deleting a plan's versions."""
+
     @property
     @abstractmethod
     def registry_name(self) -> str:
@@ -0,0 +1,146 @@
+"""On-disk HTTP cache for registry listings, revalidated with conditional requests."""
+
+import hashlib
+import json
+import os
+import threading
+from typing import TYPE_CHECKING, Any, Dict, Mapping, Optional
+
+if TYPE_CHECKING:
+    import requests
+
+# Default upper bound on the size of the cache directory
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Response headers kept with a cached body; the rest are dropped
+CACHED_HEADERS = ('content-type', 'etag', 'last-modified', 'link')
+
+
+def cache_root() -> str:
+    """Return the directory holding the script's caches ($PRUNE_CACHE_DIR, else under $XDG_CACHE_HOME or ~/.cache)."""
+    override = os.environ.get('PRUNE_CACHE_DIR')
+    if override:
+        return override
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'docker-network-tools-prune')
+
+
+def default_cache_dir() -> str:
+    """Return the HTTP cache directory."""
+    return os.path.join(cache_root(), 'http')
+
+
+class HttpCache:
+    """Stores GET response bodies with their ETag/Last-Modified validators.
+
+    A cached entry is never served blindly: the next request for the same
+    URL is sent with If-None-Match / If-Modified-Since, and only a 304 Not
+    Modified reply is answered from disk. GitHub doesn't count 304s against
+    the rate limit, so unchanged pages cost neither quota nor bandwidth.
+
+    Entries are keyed by URL and the credentials used, so one user's cache
+    is never served to another. The directory is kept under ``max_bytes``
+    by evicting the least recently used entries.
+    """
+
+    def __init__(self, directory: Optional[str] = None, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self._lock = threading.Lock()
+        self._size: Optional[int] = None
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+
+    @staticmethod
+    def key(url: str, headers: Mapping[str, str]) -> str:
+        """Cache key for a fully built URL and the request's headers."""
+        identity = f"{url}\n{headers.get('Authorization', '')}\n{headers.get('Accept', '')}"
+        return hashlib.sha256(identity.encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.json')
+
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the stored entry for ``key``, if any, marking it recently used."""
+        path = self._path(key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return entry
+
+    @staticmethod
+    def validators(entry: Dict[str, Any]) -> Dict[str, str]:
+        """Conditional request headers that revalidate ``entry``."""
+        headers = {}
+        if entry['headers'].get('etag'):
+            headers['If-None-Match'] = entry['headers']['etag']
+        if entry['headers'].get('last-modified'):
+            headers['If-Modified-Since'] = entry['headers']['last-modified']
+        return headers
+
+    def store(self, key: str, resp: 'requests.Response') -> None:
+        """Save a 200 response that carries a validator."""
+        headers = {name: resp.headers[name] for name in CACHED_HEADERS if name in resp.headers}
+        if 'etag' not in headers and 'last-modified' not in headers:
+            return
+
+        data = json.dumps({'url': resp.url, 'headers': headers, 'body': resp.text})
+        path = self._path(key)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+
+        with self._lock:
+            size = self._current_size()
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._size = size - previous + len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def response(self, entry: Dict[str, Any], not_modified: 'requests.Response') -> 'requests.Response':
+        """Build a 200 response from ``entry`` for a 304 reply to a revalidation."""
+        import requests
+        from requests.structures import CaseInsensitiveDict
+
+        resp = requests.Response()
+        resp.status_code = 200
+        resp.reason = 'OK'
+        resp.url = entry['url']
+        resp.encoding = 'utf-8'
+        resp._content = entry['body'].encode('utf-8')
+        resp.headers = CaseInsensitiveDict(entry['headers'])
+        # Keep the 304's fresh rate-limit headers
+        resp.headers.update({name: value for name, value in not_modified.headers.items()
+                             if name.lower().startswith('x-ratelimit-')})
+        resp.request = not_modified.request
+        resp.from_cache = True
+        with self._lock:
+            self.hits += 1
+        return resp
+
+    def _current_size(self) -> int:
+        if self._size is None:
+            self._size = sum(entry.stat().st_size for entry in os.scandir(self.directory)
+                             if entry.name.endswith('.json'))
+        return self._size
+
+    def _evict(self) -> None:
+        """Delete least recently used entries until the cache fits in max_bytes."""
+        entries = sorted(
+            (entry.stat().st_mtime, entry.stat().st_size, entry.path)
+            for entry in os.scandir(self.directory) if entry.name.endswith('.json')
+        )
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, path in entries:
+            if size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= entry_size
+        self._size = size
@@ -1,12 +1,31 @@
 """Docker Hub registry implementation."""
 
-import sys
-import requests
-import dateutil.parser
-from typing import List, Dict, Any
-from datetime import datetime
+import threading
+import time
+from collections import Counter
+from typing import TYPE_CHECKING, List, Dict, Any, Iterator, Optional, Set
 
-from .base import BaseRegistry, ImageVersion
+from .base import BaseRegistry, DeleteResult, ImageVersion, RegistryError, parse_timestamp
+from .cache import HttpCache
+from .http import DEFAULT_POOL_SIZE
+from .ratelimit import RateLimitScheduler
+from .retry import RetryPolicy
+from .tokens import TokenCache, jwt_expiry, token_fresh
+
+if TYPE_CHECKING:
+    import requests
+
+    from .metrics import Metrics
+    from .transport import Cassette
+
+
+class _AuthState:
+    """Login token shared by every container registry copy of one account."""
+
+    def __init__(self):
+        self.token: Optional[str] = None
+        self.expires_at: Optional[float] = None
+        self.lock = threading.Lock()
 
 
 class DockerHubRegistry(BaseRegistry):
@@ -14,58 +33,127 @@ class DockerHubRegistry(BaseRegistry):
 
     DOCKER_HUB_API = 'https://hub.docker.com/v2'
 
-    def __init__(self, username: str, password: str, container_name: str, verbose: bool = False):
+    # Manifests sent per request to the namespace bulk delete-images endpoint
+    BULK_DELETE_CHUNK_SIZE = 100
+
+    # Statuses meaning the bulk endpoint isn't available to this account
+    BULK_DELETE_UNSUPPORTED = (403, 404, 405)
+
+    registry_type = 'dockerhub'
+
+    def __init__(self, username: str, password: str, container_name: str, verbose: bool = False,
+                 pool_size: int = DEFAULT_POOL_SIZE, scheduler: Optional[RateLimitScheduler] = None,
+                 retry: Optional[RetryPolicy] = None, cache: Optional[HttpCache] = None,
+                 tokens: Optional[TokenCache] = None, api_url: Optional[str] = None,
+                 transport: Optional['Cassette'] = None, metrics: Optional['Metrics'] = None):
         # For Docker Hub, we use username/password instead of token
-        super().__init__(password, container_name, verbose)
+        super().__init__(password, container_name, verbose, pool_size, scheduler, retry, cache, transport,
+                         metrics)
+        if api_url:
+            self.DOCKER_HUB_API = api_url.rstrip('/')
         self.username = username
         self.password = password
-        self._auth_token = None
+        # Optional on-disk store that lets later runs reuse the JWT
+        self.tokens = tokens
+        self._auth = _AuthState()
+        # Maps version ID (digest) -> tag names not yet deleted, in listing order.
+        # Populated by list_versions() so deletes don't have to re-list the repository.
+        self._tag_index: Optional[Dict[str, List[str]]] = None
+        # False while a listing is still filling the index (e.g. under --stream), when a
+        # digest's other tags may be on pages not listed yet
+        self._index_complete = False
+        # Re-entrant: a delete that finds no index re-lists while holding it
+        self._index_lock = threading.RLock()
+        self._bulk_delete_supported = True
 
     @property
     def registry_name(self) -> str:
         return "Docker Hub"
 
-    def _get_auth_token(self) -> str:
-        """Get authentication token for Docker Hub API."""
-        if self._auth_token:
-            return self._auth_token
-
-        auth_data = {
-            'identifier': self.username,
-            'secret': self.password
-        }
-
-        resp = requests.post(f'{self.DOCKER_HUB_API}/auth/token', json=auth_data)
-        if resp.status_code != 200:
-            sys.stderr.write(f'Docker Hub auth failed: {resp.status_code}\n')
-            sys.stderr.write(f'{resp.text}\n')
-            sys.exit(1)
-
-        self._auth_token = resp.json()['access_token']
-        return self._auth_token
-
-    def list_versions(self) -> List[ImageVersion]:
-        """List all versions from Docker Hub."""
+    def _get_auth_token(self, stale: Optional[str] = None) -> str:
+        """Get authentication token for Docker Hub API.
+
+        The token in memory (or the token cache) is reused until it is close
+        to its ``exp`` claim. ``stale`` is a token the API just rejected; it
+        is replaced unless another thread already did so.
+        """
+        auth = self._auth
+        with auth.lock:
+            if auth.token and (auth.token == stale or not token_fresh(auth.expires_at)):
+                if self.tokens is not None:
+                    self.tokens.discard(self._token_key())
+                auth.token = None
+
+            if not auth.token and self.tokens is not None:
+                cached = self.tokens.get(self._token_key())
+                if cached and cached != stale:
+                    auth.token = cached
+                    auth.expires_at = jwt_expiry(cached)
+
+            if not auth.token:
+                auth_data = {
+                    'identifier': self.username,
+                    'secret': self.password
+                }
+
+                # Issuing a token has no side effects, so it is safe to re-send
+                resp = self.http.post(f'{self.DOCKER_HUB_API}/auth/token', json=auth_data, idempotent=True,
+                                      endpoint='auth')
+                if resp.status_code != 200:
+                    raise RegistryError(f'Docker Hub auth failed: {resp.status_code}: {resp.text}')
+
+                auth.token = resp.json()['access_token']
+                auth.expires_at = jwt_expiry(auth.token)
+                if self.tokens is not None:
+                    self.tokens.put(self._token_key(), auth.token)
+
+            self.http.session.headers['Authorization'] = f'Bearer {auth.token}'
+            return auth.token
+
+    def for_container(self, container_name: str) -> 'DockerHubRegistry':
+        """Return a registry for another repository that reuses this login."""
+        clone = super().for_container(container_name)
+        clone._tag_index = None
+        clone._index_complete = False
+        clone._index_lock = threading.RLock()
+        return clone
+
+    def _token_key(self) -> str:
+        return TokenCache.key(self.DOCKER_HUB_API, self.username, self.password)
+
+    def _request(self, method: str, url: str, **kwargs) -> 'requests.Response':
+        """Send an authenticated request, logging in again once if the token was rejected."""
         token = self._get_auth_token()
-
-        sess = requests.Session()
-        sess.headers.update({
-            'Authorization': f'Bearer {token}',
-            'Content-Type': 'application/json'
-        })
-
+        resp = self.http.request(method, url, **kwargs)
+        if resp.status_code == 401:
+            self._get_auth_token(stale=token)
+            resp = self.http.request(method, url, **kwargs)
+        return resp
+
+    def _default_headers(self) -> Dict[str, str]:
+        return {'Content-Type': 'application/json'}
+
+    def iter_versions(self) -> Iterator[ImageVersion]:
+        """Yield versions from Docker Hub page by page.
+
+        The ID to tag name index is filled in as versions are yielded, so
+        deletes can start before the listing has finished. An expired token
+        is renewed without restarting the listing.
+        """
         # Get repository info first
         repo_url = f'{self.DOCKER_HUB_API}/repositories/{self.username}/{self.container_name}/'
-        repo_resp = sess.get(repo_url)
+        repo_resp = self._request('GET', repo_url, endpoint='repository')
         if repo_resp.status_code != 200:
-            sys.stderr.write(f'Docker Hub repository not found: {repo_resp.status_code}\n')
-            sys.stderr.write(f'{repo_resp.text}\n')
-            sys.exit(1)
+            raise RegistryError(f'Docker Hub repository not found: {repo_resp.status_code}: {repo_resp.text}')
 
         # Get all tags for the repository
         tags_url = f'{self.DOCKER_HUB_API}/repositories/{self.username}/{self.container_name}/tags/'
 
-        versions = []
+        tag_index: Dict[str, List[str]] = {}
+        with self._index_lock:
+            self._tag_index = tag_index
+            self._index_complete = False
+
         page_size = 100
         page = 1
 
@@ -75,74 +163,204 @@ class DockerHubRegistry(BaseRegistry):
                 'page': page
             }
 
-            resp = sess.get(tags_url, params=params)
+            resp = self._request('GET', tags_url, params=params, endpoint='tags')
             if resp.status_code != 200:
-                sys.stderr.write(f'Docker Hub API error: {resp.status_code}\n')
-                sys.stderr.write(f'{resp.text}\n')
-                break
+                raise RegistryError(f'Docker Hub API error: {resp.status_code}: {resp.text}')
 
             data = resp.json()
 
             for tag_data in data.get('results', []):
                 # Docker Hub doesn't have version IDs like GHCR, so we use the digest
                 tag_id = tag_data.get('digest', tag_data['name'])
-                created = dateutil.parser.isoparse(tag_data['last_updated'])
+                created = parse_timestamp(tag_data['last_updated'])
 
                 # Extract tags - Docker Hub has one tag per entry
                 tags = [tag_data['name']] if tag_data['name'] != 'latest' or tag_data.get('tag_status') == 'active' else []
 
-                version = ImageVersion(
+                with self._index_lock:
+                    tag_index.setdefault(tag_id, []).append(tag_data['name'])
+
+                yield ImageVersion(
                     id=tag_id,
                     name=tag_data['name'],
                     created_at=created,
                     tags=tags,
-                    metadata=tag_data
+                    metadata=tag_data if self.keep_payloads else None,
+                    digest=tag_data.get('digest'),
+                    size=tag_data.get('full_size')
                 )
-                versions.append(version)
 
             # Check if there are more pages
             if not data.get('next'):
                 break
             page += 1
 
+        with self._index_lock:
+            self._index_complete = True
+
+    def list_versions(self) -> List[ImageVersion]:
+        """List all versions from Docker Hub."""
+        versions = list(self.iter_versions())
+
         if self.verbose:
-            print(f'Found {len(versions)} images in Docker Hub')
+            self._log(f'Found {len(versions)} images in Docker Hub')
 
         return versions
 
-    def delete_version(self, version_id: str) -> bool:
-        """Delete a version from Docker Hub."""
-        token = self._get_auth_token()
+    def inventory_fingerprint(self) -> Optional[Dict[str, Any]]:
+        """Return the tag count and the most recently updated tag, from a one-tag page."""
+        tags_url = f'{self.DOCKER_HUB_API}/repositories/{self.username}/{self.container_name}/tags/'
+        resp = self._request('GET', tags_url, params={'page_size': 1, 'page': 1}, endpoint='fingerprint')
+        if resp.status_code != 200:
+            raise RegistryError(f'Docker Hub API error: {resp.status_code}: {resp.text}')
+
+        data = resp.json()
+        results = data.get('results') or []
+        newest = f"{results[0]['name']}@{results[0]['last_updated']}" if results else None
+        return {'newest': newest, 'count': data.get('count')}
+
+    def plan_state(self, versions: List[ImageVersion]) -> Dict[str, Any]:
+        """Save every tag name of the planned digests, including tags that are kept.
+
+        Deleting a plan needs them to resolve tag names and to decide which
+        digests are safe to bulk delete.
+        """
+        with self._index_lock:
+            index = self._tag_index or {}
+            return {'tag_index': {version.id: list(index.get(version.id, ())) for version in versions}}
+
+    def restore_plan_state(self, state: Dict[str, Any]) -> None:
+        """Use the saved tag names in place of a listing; without them, deletes re-list."""
+        tag_index = state.get('tag_index')
+        with self._index_lock:
+            self._tag_index = {digest: list(tags) for digest, tags in tag_index.items()} if tag_index else None
+            self._index_complete = self._tag_index is not None
+
+    def invalidate_index(self) -> None:
+        """Forget the ID to tag name index so the next delete re-lists the repository."""
+        with self._index_lock:
+            self._tag_index = None
+            self._index_complete = False
+
+    def delete_version(self, version_id: str, name: Optional[str] = None) -> bool:
+        """Delete a version from Docker Hub.
+
+        Docker Hub deletes by tag name, not digest. ``name`` is the tag the
+        plan chose (ImageVersion.name); without one, the next tag of the
+        digest not yet deleted is used.
+        """
+        # Check the tag against the index built by the last listing
+        with self._index_lock:
+            if self._tag_index is None:
+                self.list_versions()
+
+            pending = self._tag_index.get(version_id)
+            tag_name = name if name is not None else (pending[0] if pending else None)
+            if not pending or tag_name not in pending:
+                if self.verbose:
+                    self._log(f"Version {version_id} ({tag_name}) not found")
+                return False
+
+            # Several tags can share a digest; claim this one so no other call deletes it
+            pending.remove(tag_name)
 
-        sess = requests.Session()
-        sess.headers.update({
-            'Authorization': f'Bearer {token}',
-            'Content-Type': 'application/json'
-        })
-
-        # For Docker Hub, we need to delete by tag name, not digest
-        # Find the version by ID to get the tag name
-        versions = self.list_versions()
-        version_to_delete = None
-        for version in versions:
-            if version.id == version_id:
-                version_to_delete = version
-                break
+        # Delete the tag
+        delete_url = f'{self.DOCKER_HUB_API}/repositories/{self.username}/{self.container_name}/tags/{tag_name}/'
 
-        if not version_to_delete:
-            if self.verbose:
-                print(f"Version {version_id} not found")
-            return False
+        resp = self._request('DELETE', delete_url, endpoint='delete_tag')
 
-        # Delete the tag
-        delete_url = f'{self.DOCKER_HUB_API}/repositories/{self.username}/{self.container_name}/tags/{version_to_delete.name}/'
+        if self._delete_succeeded(resp):
+            return True
+
+        with self._index_lock:
+            pending.insert(0, tag_name)
+        if self.verbose:
+            self._log(f"Failed to delete tag {tag_name}: {resp.status_code} - {resp.text}")
+        return False
+
+    def delete_versions(self, version_ids: List[str], concurrency: int = 1,
+                        names: Optional[List[str]] = None) -> Iterator[DeleteResult]:
+        """Delete many versions, using the bulk delete-images API where it is safe.
+
+        Deleting a manifest removes every tag that points at it, so a digest is
+        only bulk deleted when all of its remaining tags are being deleted in
+        this call: every tag in ``names``, or as many tags as the digest has
+        when no names are given. Everything else (and any chunk the bulk API
+        rejects) falls back to deleting tag by tag. While a listing is still
+        running, the index may lack tags on later pages, so every delete is
+        by tag until it has finished.
+        """
+        names = names if names is not None else [None] * len(version_ids)
+        with self._index_lock:
+            if self._tag_index is None:
+                self.list_versions()
+
+            wanted = Counter(version_ids)
+            named: Dict[str, Set[str]] = {}
+            for version_id, name in zip(version_ids, names):
+                if name is not None:
+                    named.setdefault(version_id, set()).add(name)
+
+            def covered(version_id: str) -> bool:
+                tags = self._tag_index.get(version_id, ())
+                if version_id in named:
+                    return bool(tags) and named[version_id].issuperset(tags)
+                return wanted[version_id] == len(tags)
+
+            digests = [version_id for version_id in wanted
+                       if self._index_complete and version_id.startswith('sha256:') and covered(version_id)]
+
+        bulk_results: Dict[str, DeleteResult] = {}
+        for start in range(0, len(digests), self.BULK_DELETE_CHUNK_SIZE):
+            if not self._bulk_delete_supported:
+                break
 
-        resp = sess.delete(delete_url)
+            chunk = digests[start:start + self.BULK_DELETE_CHUNK_SIZE]
+            started = time.perf_counter()
+            if self._bulk_delete(chunk):
+                elapsed = time.perf_counter() - started
+                for digest in chunk:
+                    bulk_results[digest] = DeleteResult(digest, True, elapsed)
+
+        singles = [(version_id, name) for version_id, name in zip(version_ids, names)
+                   if version_id not in bulk_results]
+        single_results = self._delete_each(singles, concurrency, self.delete_version)
+
+        for version_id in version_ids:
+            if version_id in bulk_results:
+                yield bulk_results[version_id]
+            else:
+                yield next(single_results)
+
+    def _bulk_delete(self, digests: List[str]) -> bool:
+        """Delete a chunk of manifests in one request. Returns True if successful."""
+        with self._index_lock:
+            tags = {digest: list(self._tag_index.get(digest, ())) for digest in digests}
+
+        # The API refuses to delete manifests that still have tags unless the
+        # "current_tag" warning is acknowledged for exactly those tags.
+        payload = {
+            'dry_run': False,
+            'manifests': [{'repository': self.container_name, 'digest': digest} for digest in digests],
+            'ignore_warnings': [
+                {'repository': self.container_name, 'digest': digest, 'warning': 'current_tag', 'tags': tags[digest]}
+                for digest in digests if tags[digest]
+            ],
+        }
+
+        url = f'{self.DOCKER_HUB_API}/namespaces/{self.username}/delete-images'
+        # Deleting the same manifests twice has the same outcome, so it is safe to re-send
+        resp = self._request('POST', url, json=payload, idempotent=True, endpoint='bulk_delete')
 
-        try:
-            resp.raise_for_status()
+        if resp.status_code == 200:
+            with self._index_lock:
+                for digest in digests:
+                    self._tag_index.pop(digest, None)
             return True
-        except requests.exceptions.HTTPError:
-            if self.verbose:
-                print(f"Failed to delete tag {version_to_delete.name}: {resp.status_code} - {resp.text}")
-            return False
+
+        if resp.status_code in self.BULK_DELETE_UNSUPPORTED:
+            self._bulk_delete_supported = False
+
+        if self.verbose:
+            self._log(f"Bulk delete of {len(digests)} images failed: {resp.status_code} - {resp.text}")
+        return False
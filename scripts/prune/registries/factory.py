@@ -1,15 +1,45 @@
 """Registry factory for creating registry instances."""
 
 import os
-from typing import List
+from typing import TYPE_CHECKING, List, Optional
 
 from .base import BaseRegistry
-from .ghcr import GHCRRegistry
-from .dockerhub import DockerHubRegistry
-
-
-def create_registry(registry_type: str, container_name: str, verbose: bool = False) -> BaseRegistry:
-    """Create a registry instance based on type and available credentials."""
+from .cache import HttpCache
+from .http import DEFAULT_POOL_SIZE
+from .retry import RetryBudget, RetryPolicy
+from .tokens import TokenCache
+
+if TYPE_CHECKING:
+    from .metrics import Metrics
+    from .transport import Cassette
+
+# The registry modules are imported by create_registry() so that only the
+# selected registries are loaded.
+
+
+DEFAULT_MAX_RETRIES = 4
+
+
+def create_registry(registry_type: str, container_name: str, verbose: bool = False,
+                    pool_size: int = DEFAULT_POOL_SIZE, max_retries: int = DEFAULT_MAX_RETRIES,
+                    retry_budget: Optional[RetryBudget] = None, cache: Optional[HttpCache] = None,
+                    tokens: Optional[TokenCache] = None, owner: Optional[str] = None,
+                    transport: Optional['Cassette'] = None, metrics: Optional['Metrics'] = None) -> BaseRegistry:
+    """Create a registry instance based on type and available credentials.
+
+    ``pool_size`` caps the number of pooled connections per host and should be
+    at least the number of concurrent delete workers. Each registry gets its
+    own retry policy (so retries are counted per registry) drawing on the
+    shared ``retry_budget``. Listing pages are revalidated against ``cache``
+    and Docker Hub logins are reused from ``tokens`` when they are given.
+    GHCR packages belong to the organization ``owner`` when one is given.
+    Every request is recorded to or replayed from ``transport``, and counted
+    in ``metrics``, when they are given.
+    GITHUB_API_URL and DOCKER_HUB_API_URL override the API endpoints, and
+    GHCR_REGISTRY_URL the GHCR registry itself (for GitHub Enterprise
+    Server, or a local stand-in server).
+    """
+    retry = RetryPolicy(max_attempts=max_retries + 1, budget=retry_budget)
 
     if registry_type.lower() in ['ghcr', 'github']:
         # GHCR uses token authentication
@@ -17,7 +47,10 @@ def create_registry(registry_type: str, container_name: str, verbose: bool = Fal
         if not token:
             raise ValueError('GHCR_TOKEN environment variable is required for GitHub Container Registry')
 
-        return GHCRRegistry(token, container_name, verbose)
+        from .ghcr import GHCRRegistry
+        return GHCRRegistry(token, container_name, verbose, pool_size, retry=retry, cache=cache, owner=owner,
+                            api_url=os.environ.get('GITHUB_API_URL'), transport=transport,
+                            metrics=metrics, registry_url=os.environ.get('GHCR_REGISTRY_URL'))
 
     elif registry_type.lower() in ['dockerhub', 'docker', 'hub']:
         # Docker Hub uses username/password authentication
@@ -27,19 +60,29 @@ def create_registry(registry_type: str, container_name: str, verbose: bool = Fal
         if not username or not password:
             raise ValueError('DOCKER_USERNAME and DOCKER_PASSWORD environment variables are required for Docker Hub')
 
-        return DockerHubRegistry(username, password, container_name, verbose)
+        from .dockerhub import DockerHubRegistry
+        return DockerHubRegistry(username, password, container_name, verbose, pool_size, retry=retry, cache=cache,
+                                 tokens=tokens, api_url=os.environ.get('DOCKER_HUB_API_URL'), transport=transport,
+                                 metrics=metrics)
 
     else:
         raise ValueError(f'Unsupported registry type: {registry_type}. Supported types: ghcr, dockerhub')
 
 
-def create_all_registries(container_name: str, verbose: bool = False) -> List[BaseRegistry]:
+def create_all_registries(container_name: str, verbose: bool = False,
+                          pool_size: int = DEFAULT_POOL_SIZE, max_retries: int = DEFAULT_MAX_RETRIES,
+                          retry_budget: Optional[RetryBudget] = None,
+                          cache: Optional[HttpCache] = None,
+                          tokens: Optional[TokenCache] = None,
+                          transport: Optional['Cassette'] = None,
+                          metrics: Optional['Metrics'] = None) -> List[BaseRegistry]:
     """Create registry instances for all available registries based on environment variables."""
     registries = []
 
     # Try to create GHCR registry
     try:
-        ghcr = create_registry('ghcr', container_name, verbose)
+        ghcr = create_registry('ghcr', container_name, verbose, pool_size, max_retries, retry_budget, cache,
+                               transport=transport, metrics=metrics)
         registries.append(ghcr)
     except ValueError as e:
         if verbose:
@@ -47,7 +90,8 @@ def create_all_registries(container_name: str, verbose: bool = False) -> List[Ba
 
     # Try to create Docker Hub registry
     try:
-        dockerhub = create_registry('dockerhub', container_name, verbose)
+        dockerhub = create_registry('dockerhub', container_name, verbose, pool_size, max_retries, retry_budget, cache,
+                                    tokens, transport=transport, metrics=metrics)
         registries.append(dockerhub)
     except ValueError as e:
         if verbose:
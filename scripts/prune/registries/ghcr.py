@@ -1,77 +1,248 @@
 """GitHub Container Registry implementation."""
 
-import sys
-import requests
-import dateutil.parser
-from typing import List
+import threading
+from fnmatch import fnmatchcase
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional
 from datetime import datetime
+from urllib.parse import parse_qs, quote, urlsplit
 
-from .base import BaseRegistry, ImageVersion
+from .base import BaseRegistry, ImageVersion, RegistryError, parse_timestamp
+from .cache import HttpCache
+from .http import DEFAULT_POOL_SIZE, HttpClient
+from .ratelimit import RateLimitScheduler
+from .retry import RetryPolicy
+
+if TYPE_CHECKING:
+    import requests
+
+    from .metrics import Metrics
+    from .transport import Cassette
+
+# Manifest formats asked for when fetching by digest: image indexes (multi-platform builds) and image manifests
+MANIFEST_ACCEPT = ', '.join((
+    'application/vnd.oci.image.index.v1+json',
+    'application/vnd.docker.distribution.manifest.list.v2+json',
+    'application/vnd.oci.image.manifest.v1+json',
+    'application/vnd.docker.distribution.manifest.v2+json',
+))
 
 
 class GHCRRegistry(BaseRegistry):
-    """GitHub Container Registry implementation."""
+    """GitHub Container Registry implementation.
 
-    GITHUB_API = 'https://api.github.com/user/packages/container'
+    Packages belong to the authenticated user unless an organization
+    ``owner`` is given. Versions are listed and deleted through the GitHub
+    API; manifests are fetched from the registry itself (``registry_url``)
+    through the OCI distribution API, with a pull token exchanged for the
+    GitHub token.
+    """
+
+    GITHUB_API_URL = 'https://api.github.com'
     GITHUB_API_ACCEPT = 'application/vnd.github.v3+json'
+    GITHUB_API_PAGE_SIZE = 100
+    GHCR_REGISTRY_URL = 'https://ghcr.io'
+
+    registry_type = 'ghcr'
+    supports_manifests = True
+
+    def __init__(self, token: str, container_name: str, verbose: bool = False,
+                 pool_size: int = DEFAULT_POOL_SIZE, scheduler: Optional[RateLimitScheduler] = None,
+                 retry: Optional[RetryPolicy] = None, cache: Optional[HttpCache] = None,
+                 owner: Optional[str] = None, api_url: Optional[str] = None,
+                 transport: Optional['Cassette'] = None, metrics: Optional['Metrics'] = None,
+                 registry_url: Optional[str] = None):
+        super().__init__(token, container_name, verbose, pool_size, scheduler, retry, cache, transport, metrics)
+        self.owner = owner
+        if api_url:
+            self.GITHUB_API_URL = api_url.rstrip('/')
+        if registry_url:
+            self.GHCR_REGISTRY_URL = registry_url.rstrip('/')
+        # Login of the token's user, looked up when packages belong to it rather than an organization
+        self._login: Optional[str] = None
+        self._registry_http: Optional[HttpClient] = None
+        # Pull token for this container's repository on the registry
+        self._pull_token: Optional[str] = None
+        self._pull_lock = threading.Lock()
 
     @property
     def registry_name(self) -> str:
         return "GitHub Container Registry"
 
-    def list_versions(self) -> List[ImageVersion]:
-        """List all versions from GHCR."""
-        sess = requests.Session()
-        sess.headers.update({
+    def _default_headers(self) -> Dict[str, str]:
+        return {
             'Authorization': f'token {self.token}',
             'Accept': self.GITHUB_API_ACCEPT
-        })
-
-        resp = sess.get(f'{self.GITHUB_API}/{self.container_name}/versions')
-        if resp.status_code != 200:
-            sys.stderr.write(f'GitHub API returned status code: {resp.status_code}\n')
-            sys.stderr.write(f'{resp.text}\n')
-            sys.exit(1)
+        }
 
-        versions_data = resp.json()
+    @property
+    def registry_http(self) -> HttpClient:
+        """HTTP client for the registry's OCI API, which doesn't take the GitHub API headers (created lazily).
+
+        Requests are paced by the retry policy only: the GitHub API rate
+        limit doesn't apply to the registry.
+        """
+        if self._registry_http is None:
+            self._registry_http = HttpClient(pool_size=self.pool_size, retry=self.retry, transport=self.transport,
+                                             metrics=self.metrics, name=self.registry_name)
+        return self._registry_http
+
+    def for_container(self, container_name: str) -> 'GHCRRegistry':
+        """Return a registry for another package that reuses this registry's connections."""
+        clone = super().for_container(container_name)
+        clone._registry_http = self.registry_http.fork(clone.retry)
+        clone._pull_token = None
+        clone._pull_lock = threading.Lock()
+        return clone
+
+    def close(self) -> None:
+        super().close()
+        if self._registry_http is not None:
+            self._registry_http.close()
+
+    def _packages_api(self) -> str:
+        if self.owner:
+            return f'{self.GITHUB_API_URL}/orgs/{quote(self.owner, safe="")}/packages'
+        return f'{self.GITHUB_API_URL}/user/packages'
+
+    def _package_url(self) -> str:
+        # Package names may contain slashes, which must be encoded
+        return f'{self._packages_api()}/container/{quote(self.container_name, safe="")}'
+
+    def _pages(self, url: str, params: Dict[str, Any], endpoint: str) -> Iterator[List[Dict[str, Any]]]:
+        """Yield the items of each page of a list endpoint, following the Link header."""
+        while url:
+            resp = self.http.get(url, params=params, endpoint=endpoint)
+            if resp.status_code != 200:
+                raise RegistryError(f'GitHub API returned status code: {resp.status_code}: {resp.text}')
+
+            yield resp.json()
+
+            # The next link already carries the query and the page cursor
+            url = resp.links.get('next', {}).get('url')
+            params = None
+
+    def discover_packages(self, pattern: Optional[str] = None) -> List[str]:
+        """Return the names of the owner's container packages, optionally filtered by a glob."""
+        params = {'package_type': 'container', 'per_page': self.GITHUB_API_PAGE_SIZE}
+        names = [
+            package['name']
+            for page in self._pages(self._packages_api(), params, 'packages')
+            for package in page
+            if pattern is None or fnmatchcase(package['name'], pattern)
+        ]
 
         if self.verbose:
-            ratelimit_reset_at = datetime.fromtimestamp(int(resp.headers["x-ratelimit-reset"]))
-            print(f'{resp.headers["x-ratelimit-remaining"]} requests remaining until {ratelimit_reset_at}')
-
-        versions = []
-        for version_data in versions_data:
-            created = dateutil.parser.isoparse(version_data['created_at'])
-            metadata = version_data["metadata"]["container"]
-
-            version = ImageVersion(
-                id=str(version_data['id']),
-                name=version_data['name'],
-                created_at=created,
-                tags=metadata['tags'],
-                metadata=version_data
-            )
-            versions.append(version)
+            self._log(f'Found {len(names)} container packages for {self.owner or "the authenticated user"}')
+
+        return names
+
+    def iter_versions(self) -> Iterator[ImageVersion]:
+        """Yield versions from GHCR page by page, following the Link header."""
+        params = {'per_page': self.GITHUB_API_PAGE_SIZE}
+        first_page = True
+
+        for page in self._pages(f'{self._package_url()}/versions', params, 'versions'):
+            if self.verbose and first_page and self.scheduler.reset_at is not None:
+                ratelimit_reset_at = datetime.fromtimestamp(self.scheduler.reset_at)
+                self._log(f'{self.scheduler.remaining} requests remaining until {ratelimit_reset_at}')
+            first_page = False
+
+            for version_data in page:
+                created = parse_timestamp(version_data['created_at'])
+                metadata = version_data["metadata"]["container"]
+
+                yield ImageVersion(
+                    id=str(version_data['id']),
+                    name=version_data['name'],
+                    created_at=created,
+                    tags=metadata['tags'],
+                    metadata=version_data if self.keep_payloads else None,
+                    digest=version_data['name']
+                )
+
+    def inventory_fingerprint(self) -> Optional[Dict[str, Any]]:
+        """Return the newest version ID and the version count, from a one-item page.
+
+        With one version per page, the page number of the Link header's
+        last link is the number of versions. The page isn't revalidated
+        against the HTTP cache: its body can be unchanged while the links
+        are not.
+        """
+        resp = self.http.get(f'{self._package_url()}/versions', params={'per_page': 1}, endpoint='fingerprint',
+                             cached=False)
+        if resp.status_code != 200:
+            raise RegistryError(f'GitHub API returned status code: {resp.status_code}: {resp.text}')
+
+        page = resp.json()
+        last_url = resp.links.get('last', {}).get('url')
+        count = int(parse_qs(urlsplit(last_url).query)['page'][0]) if last_url else len(page)
+        return {'newest': str(page[0]['id']) if page else None, 'count': count}
+
+    def _repository(self) -> str:
+        """The package's repository on the registry, e.g. "octo-org/network-tools"."""
+        if not self.owner and self._login is None:
+            resp = self.http.get(f'{self.GITHUB_API_URL}/user', endpoint='user')
+            if resp.status_code != 200:
+                raise RegistryError(f'GitHub API returned status code: {resp.status_code}: {resp.text}')
+            self._login = resp.json()['login']
+        # Registry repository names are lower case
+        return f'{self.owner or self._login}/{self.container_name}'.lower()
+
+    def _get_pull_token(self, stale: Optional[str] = None) -> str:
+        """Exchange the GitHub token for a registry token that can pull this repository.
+
+        ``stale`` is a token the registry just rejected; it is replaced unless
+        another thread already did so.
+        """
+        with self._pull_lock:
+            if self._pull_token is None or self._pull_token == stale:
+                repository = self._repository()
+                # Issuing a token has no side effects, so it is safe to re-send
+                resp = self.registry_http.get(f'{self.GHCR_REGISTRY_URL}/token',
+                                              params={'scope': f'repository:{repository}:pull'},
+                                              auth=(self.owner or self._login, self.token),
+                                              endpoint='registry_token')
+                if resp.status_code != 200:
+                    raise RegistryError(f'GHCR token request returned status code: {resp.status_code}: {resp.text}')
+                self._pull_token = resp.json()['token']
+            return self._pull_token
+
+    def _registry_get(self, url: str, **kwargs) -> 'requests.Response':
+        """GET from the registry API with a pull token, fetching a new one once if it was rejected."""
+        token = self._get_pull_token()
+        headers = {**kwargs.pop('headers', {}), 'Authorization': f'Bearer {token}'}
+        resp = self.registry_http.get(url, headers=headers, **kwargs)
+        if resp.status_code == 401:
+            headers['Authorization'] = f'Bearer {self._get_pull_token(stale=token)}'
+            resp = self.registry_http.get(url, headers=headers, **kwargs)
+        return resp
+
+    def fetch_manifest(self, digest: str) -> Optional[Dict[str, Any]]:
+        """Fetch the manifest or image index a version's digest names, or None if the registry has none."""
+        resp = self._registry_get(f'{self.GHCR_REGISTRY_URL}/v2/{self._repository()}/manifests/{digest}',
+                                  headers={'Accept': MANIFEST_ACCEPT}, endpoint='manifest')
+        if resp.status_code == 404:
+            return None
+        if resp.status_code != 200:
+            raise RegistryError(f'GHCR returned status code {resp.status_code} for manifest {digest}: {resp.text}')
+        return resp.json()
+
+    def list_versions(self) -> List[ImageVersion]:
+        """List all versions from GHCR."""
+        versions = list(self.iter_versions())
 
         if self.verbose:
-            print(f'Found {len(versions)} images in GitHub Container Registry')
+            self._log(f'Found {len(versions)} images in GitHub Container Registry')
 
         return versions
 
     def delete_version(self, version_id: str) -> bool:
         """Delete a version from GHCR."""
-        sess = requests.Session()
-        sess.headers.update({
-            'Authorization': f'token {self.token}',
-            'Accept': self.GITHUB_API_ACCEPT
-        })
-
-        resp = sess.delete(f'{self.GITHUB_API}/{self.container_name}/versions/{version_id}')
+        resp = self.http.delete(f'{self._package_url()}/versions/{version_id}', endpoint='delete_version')
 
-        try:
-            resp.raise_for_status()
+        if self._delete_succeeded(resp):
             return True
-        except requests.exceptions.HTTPError:
-            if self.verbose:
-                print(f"Failed to delete version {version_id}: {resp.status_code} - {resp.text}")
-            return False
+
+        if self.verbose:
+            self._log(f"Failed to delete version {version_id}: {resp.status_code} - {resp.text}")
+        return False
@@ -0,0 +1,207 @@
+"""HTTP session management shared by registry implementations."""
+
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+from .cache import HttpCache
+from .metrics import Metrics
+from .ratelimit import RateLimitScheduler
+from .retry import RetryPolicy
+
+if TYPE_CHECKING:
+    import requests
+
+    from .transport import Cassette
+
+# Connection pool size per host; should be at least the delete concurrency
+DEFAULT_POOL_SIZE = 10
+
+# (connect, read) timeouts in seconds applied to every request
+DEFAULT_TIMEOUT = (5, 30)
+
+# Statuses the GitHub and Docker Hub APIs use when a rate limit is exhausted
+RATE_LIMITED_STATUSES = (403, 429)
+
+
+class HttpClient:
+    """Owns one long-lived, pooled requests session for a registry.
+
+    The session is created on first use so constructing a registry (for
+    example to validate credentials or print --help) never opens a socket
+    or even imports requests.
+    Connections are kept alive and reused across list and delete calls.
+    Every request first takes a token from the rate-limit scheduler, if one
+    is given, and feeds the response headers back into it. Transient
+    failures are re-sent according to the retry policy, if one is given.
+    GET requests are revalidated against the HTTP cache, if one is given.
+    With a cassette, requests are recorded to or replayed from it instead of
+    only going over the network. Every request sent, and every retry, is
+    recorded in ``metrics`` (labelled with the registry ``name``) if given.
+    """
+
+    # How many times a request rejected for an exhausted quota is re-sent
+    # after the scheduler has waited for the rate-limit window to reset
+    MAX_RATE_LIMIT_WAITS = 2
+
+    def __init__(self, headers: Optional[Dict[str, str]] = None, pool_size: int = DEFAULT_POOL_SIZE,
+                 timeout: Tuple[float, float] = DEFAULT_TIMEOUT, scheduler: Optional[RateLimitScheduler] = None,
+                 retry: Optional[RetryPolicy] = None, cache: Optional[HttpCache] = None,
+                 transport: Optional['Cassette'] = None, metrics: Optional[Metrics] = None, name: str = ''):
+        self.headers = dict(headers or {})
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.scheduler = scheduler
+        self.retry = retry
+        self.cache = cache
+        self.transport = transport
+        self.metrics = metrics
+        self.name = name
+        self._session: Optional['requests.Session'] = None
+        self._lock = threading.Lock()
+        # Set on forks, which send through their parent's session
+        self._parent: Optional['HttpClient'] = None
+
+    def fork(self, retry: Optional[RetryPolicy] = None) -> 'HttpClient':
+        """Return a client that shares this client's session but has its own retry policy.
+
+        The parent owns the session; closing a fork leaves it open.
+        """
+        client = HttpClient(self.headers, self.pool_size, self.timeout, self.scheduler,
+                            retry or self.retry, self.cache, self.transport, self.metrics, self.name)
+        client._parent = self
+        return client
+
+    @property
+    def session(self) -> 'requests.Session':
+        """Return the shared session, creating it on first access."""
+        if self._parent is not None:
+            return self._parent.session
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._create_session()
+        return self._session
+
+    def _create_session(self) -> 'requests.Session':
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        sess = requests.Session()
+        # Block instead of opening throwaway connections when every pooled
+        # connection is busy, so the pool size is a hard cap per host.
+        if self.transport is not None:
+            adapter = self.transport.adapter(self.pool_size)
+        else:
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size, pool_block=True)
+        sess.mount('https://', adapter)
+        sess.mount('http://', adapter)
+        sess.headers.update(self.headers)
+        return sess
+
+    def request(self, method: str, url: str, idempotent: Optional[bool] = None, endpoint: Optional[str] = None,
+                cached: bool = True, **kwargs) -> 'requests.Response':
+        """Send a request on the shared session with the default timeouts.
+
+        ``idempotent`` overrides whether the method may be re-sent after an
+        ambiguous failure (for example a POST that is safe to repeat).
+        ``endpoint`` is a short name for the API called, used to label
+        metrics (default: the URL path). ``cached=False`` sends a GET without
+        the HTTP cache, whose 304 answers keep the cached headers (such as
+        pagination links) even if they changed. The returned response carries an
+        ``attempts`` attribute with the number of times the request was sent.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        endpoint = endpoint or urlsplit(url).path
+
+        if self.cache is None or not cached or method.upper() != 'GET':
+            return self._send(method, url, idempotent, endpoint, **kwargs)
+
+        import requests
+
+        # Revalidate any cached copy; a 304 is answered from disk
+        headers = {**self.session.headers, **(kwargs.get('headers') or {})}
+        prepared_url = requests.Request(method, url, params=kwargs.get('params')).prepare().url
+        key = self.cache.key(prepared_url, headers)
+        entry = self.cache.lookup(key)
+        if entry is not None:
+            kwargs['headers'] = {**(kwargs.get('headers') or {}), **self.cache.validators(entry)}
+
+        resp = self._send(method, url, idempotent, endpoint, **kwargs)
+
+        if resp.status_code == 304 and entry is not None:
+            return self.cache.response(entry, resp)
+        if resp.status_code == 200:
+            self.cache.store(key, resp)
+        return resp
+
+    def _send(self, method: str, url: str, idempotent: Optional[bool], endpoint: str,
+              **kwargs) -> 'requests.Response':
+        import requests
+
+        attempt = 0
+        rate_limit_waits = 0
+
+        while True:
+            if self.scheduler is not None:
+                self.scheduler.acquire()
+
+            started = time.perf_counter()
+            try:
+                resp = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if self.metrics is not None:
+                    self.metrics.observe_request(self.name, endpoint, method, None, time.perf_counter() - started)
+                if self.retry is None or not self.retry.should_retry(method, attempt, None, idempotent):
+                    raise
+                self._count_retry(endpoint)
+                self.retry.wait(attempt)
+                attempt += 1
+                continue
+
+            if self.metrics is not None:
+                body = resp.request.body if resp.request is not None else None
+                self.metrics.observe_request(self.name, endpoint, method, resp.status_code,
+                                             time.perf_counter() - started, len(body or b''), len(resp.content))
+
+            if self.scheduler is not None:
+                self.scheduler.update(resp.headers)
+
+                # A rejection for an exhausted quota leaves the bucket empty, so the
+                # next acquire() sleeps until the window resets before re-sending
+                if (resp.status_code in RATE_LIMITED_STATUSES and self.scheduler.exhausted(resp.headers)
+                        and rate_limit_waits < self.MAX_RATE_LIMIT_WAITS):
+                    rate_limit_waits += 1
+                    continue
+
+            if self.retry is not None and self.retry.should_retry(method, attempt, resp.status_code, idempotent):
+                self._count_retry(endpoint)
+                self.retry.wait(attempt, resp.headers)
+                attempt += 1
+                continue
+
+            resp.attempts = attempt + 1
+            return resp
+
+    def _count_retry(self, endpoint: str) -> None:
+        if self.metrics is not None:
+            self.metrics.count_retry(self.name, endpoint)
+
+    def get(self, url: str, **kwargs) -> 'requests.Response':
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> 'requests.Response':
+        return self.request('POST', url, **kwargs)
+
+    def delete(self, url: str, **kwargs) -> 'requests.Response':
+        return self.request('DELETE', url, **kwargs)
+
+    def close(self) -> None:
+        """Close the session and release pooled connections."""
+        if self._parent is not None:
+            return
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
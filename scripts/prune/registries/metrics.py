@@ -0,0 +1,168 @@
+"""Request and phase metrics for a prune run, exported as JSON or in the Prometheus textfile format."""
+
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+# Upper bounds, in seconds, of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Prefix of every exported Prometheus metric
+METRIC_PREFIX = 'prune'
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _header(name: str, kind: str, description: str) -> List[str]:
+    return [f'# HELP {METRIC_PREFIX}_{name} {description}', f'# TYPE {METRIC_PREFIX}_{name} {kind}']
+
+
+def _sample(name: str, value: Any, **labels: Any) -> str:
+    rendered = ','.join(f'{label}="{_escape(label_value)}"' for label, label_value in labels.items())
+    return f'{METRIC_PREFIX}_{name}{{{rendered}}} {value}' if labels else f'{METRIC_PREFIX}_{name} {value}'
+
+
+class Metrics:
+    """Thread-safe counters and histograms filled in while registries are pruned.
+
+    HTTP clients record every request they send, labelled with the registry
+    and a short endpoint name; retries are counted separately. The prune
+    loop records how long each registry/container spent listing, planning
+    and deleting, and how many versions each phase handled.
+    """
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._started = clock()
+        self._lock = threading.Lock()
+        self._requests: Counter = Counter()
+        self._latency: Dict[Tuple[str, str], List[Any]] = {}
+        self._bytes: Counter = Counter()
+        self._retries: Counter = Counter()
+        self._phases: Dict[Tuple[str, str, str], float] = {}
+        self._versions: Counter = Counter()
+
+    def observe_request(self, registry: str, endpoint: str, method: str, status: Optional[int], seconds: float,
+                        sent: int = 0, received: int = 0) -> None:
+        """Record one request; ``status`` is None when no response arrived."""
+        with self._lock:
+            self._requests[registry, endpoint, method, 'error' if status is None else str(status)] += 1
+            histogram = self._latency.get((registry, endpoint))
+            if histogram is None:
+                histogram = self._latency[registry, endpoint] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0]
+            histogram[0][bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            histogram[1] += seconds
+            self._bytes[registry, endpoint, 'sent'] += sent
+            self._bytes[registry, endpoint, 'received'] += received
+
+    def count_retry(self, registry: str, endpoint: str) -> None:
+        """Record that a request to ``endpoint`` is being re-sent."""
+        with self._lock:
+            self._retries[registry, endpoint] += 1
+
+    def observe_phase(self, registry: str, container: str, phase: str, seconds: float,
+                      versions: Optional[int] = None) -> None:
+        """Add ``seconds`` spent in a list/plan/delete phase, and the versions it handled."""
+        with self._lock:
+            key = (registry, container, phase)
+            self._phases[key] = self._phases.get(key, 0.0) + seconds
+            if versions is not None:
+                self._versions[key] += versions
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return every metric as plain JSON-serializable data."""
+        with self._lock:
+            return {
+                'started': self._started,
+                'duration': round(self._clock() - self._started, 6),
+                'requests': [
+                    {'registry': r, 'endpoint': e, 'method': m, 'status': s, 'count': count}
+                    for (r, e, m, s), count in sorted(self._requests.items())
+                ],
+                'latency': [
+                    {'registry': r, 'endpoint': e, 'count': sum(buckets), 'sum': round(total, 6),
+                     'buckets': dict(zip([*map(str, LATENCY_BUCKETS), '+Inf'], buckets))}
+                    for (r, e), (buckets, total) in sorted(self._latency.items())
+                ],
+                'bytes': [
+                    {'registry': r, 'endpoint': e, 'direction': d, 'bytes': count}
+                    for (r, e, d), count in sorted(self._bytes.items())
+                ],
+                'retries': [
+                    {'registry': r, 'endpoint': e, 'count': count}
+                    for (r, e), count in sorted(self._retries.items())
+                ],
+                'phases': [
+                    {'registry': r, 'container': c, 'phase': p, 'seconds': round(seconds, 6),
+                     'versions': self._versions.get((r, c, p))}
+                    for (r, c, p), seconds in sorted(self._phases.items())
+                ],
+            }
+
+    def to_prometheus(self) -> str:
+        """Return every metric in the Prometheus text exposition format."""
+        data = self.to_dict()
+
+        lines = _header('http_requests_total', 'counter', 'HTTP requests sent, by response status.')
+        lines += [_sample('http_requests_total', r['count'], registry=r['registry'], endpoint=r['endpoint'],
+                          method=r['method'], status=r['status'])
+                  for r in data['requests']]
+
+        lines += _header('http_request_duration_seconds', 'histogram', 'HTTP request latency.')
+        for h in data['latency']:
+            cumulative = 0
+            for bound, count in h['buckets'].items():
+                cumulative += count
+                lines.append(_sample('http_request_duration_seconds_bucket', cumulative,
+                                     registry=h['registry'], endpoint=h['endpoint'], le=bound))
+            lines.append(_sample('http_request_duration_seconds_sum', h['sum'],
+                                 registry=h['registry'], endpoint=h['endpoint']))
+            lines.append(_sample('http_request_duration_seconds_count', h['count'],
+                                 registry=h['registry'], endpoint=h['endpoint']))
+
+        lines += _header('http_bytes_total', 'counter', 'HTTP body bytes sent and received.')
+        lines += [_sample('http_bytes_total', b['bytes'], registry=b['registry'], endpoint=b['endpoint'],
+                          direction=b['direction'])
+                  for b in data['bytes']]
+
+        lines += _header('http_retries_total', 'counter', 'Requests re-sent after a transient failure.')
+        lines += [_sample('http_retries_total', r['count'], registry=r['registry'], endpoint=r['endpoint'])
+                  for r in data['retries']]
+
+        lines += _header('phase_duration_seconds', 'gauge', 'Time spent listing, planning and deleting.')
+        lines += [_sample('phase_duration_seconds', ph['seconds'], registry=ph['registry'],
+                          container=ph['container'], phase=ph['phase'])
+                  for ph in data['phases']]
+
+        lines += _header('phase_versions', 'gauge', 'Versions listed, planned and deleted by each phase.')
+        lines += [_sample('phase_versions', ph['versions'], registry=ph['registry'],
+                          container=ph['container'], phase=ph['phase'])
+                  for ph in data['phases'] if ph['versions'] is not None]
+
+        lines += _header('run_duration_seconds', 'gauge', 'Wall time of the run.')
+        lines.append(_sample('run_duration_seconds', data['duration']))
+        lines += _header('run_timestamp_seconds', 'gauge', 'When the run started.')
+        lines.append(_sample('run_timestamp_seconds', data['started']))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str) -> None:
+        """Write the metrics to ``path``: Prometheus text for a .prom file, JSON otherwise.
+
+        The file is replaced atomically, as the node exporter's textfile
+        collector requires.
+        """
+        if path.endswith('.prom'):
+            data = self.to_prometheus()
+        else:
+            data = json.dumps(self.to_dict(), indent=2)
+
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
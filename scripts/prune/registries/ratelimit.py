@@ -0,0 +1,116 @@
+"""Rate-limit-aware request scheduling driven by API response headers."""
+
+import threading
+import time
+from typing import Callable, Mapping, Optional
+
+# Both the GitHub and Docker Hub APIs report their quota with these headers;
+# x-ratelimit-reset is an epoch timestamp in seconds.
+LIMIT_HEADER = 'x-ratelimit-limit'
+REMAINING_HEADER = 'x-ratelimit-remaining'
+RESET_HEADER = 'x-ratelimit-reset'
+
+
+def _header_int(headers: Mapping[str, str], name: str) -> Optional[int]:
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimitScheduler:
+    """Token bucket fed by the registry's x-ratelimit-* response headers.
+
+    The bucket holds the requests the API says are left in the current
+    window. Every request takes a token before it is sent. While the bucket
+    is comfortably full requests go out immediately; once it drops below
+    ``slowdown_fraction`` of the limit, requests are spaced evenly over the
+    time left until reset so the quota runs out no sooner than the window
+    does. An empty bucket blocks callers until the reset time instead of
+    letting them collect 403/429 responses.
+
+    One scheduler can be shared by every thread (and registry) that draws on
+    the same quota.
+    """
+
+    def __init__(self, slowdown_fraction: float = 0.1, max_wait: float = 3600.0,
+                 clock: Callable[[], float] = time.time, sleep: Callable[[float], None] = time.sleep):
+        self.slowdown_fraction = slowdown_fraction
+        self.max_wait = max_wait
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self.limit: Optional[int] = None
+        self.remaining: Optional[int] = None
+        self.reset_at: Optional[float] = None
+        self._next_slot = 0.0
+        self.total_wait = 0.0
+
+    def acquire(self) -> float:
+        """Take a token, sleeping first if the quota requires it.
+
+        Returns the number of seconds spent waiting.
+        """
+        with self._lock:
+            wait = self._reserve(self._clock())
+
+        if wait > 0:
+            self._sleep(wait)
+            with self._lock:
+                self.total_wait += wait
+        return wait
+
+    def _reserve(self, now: float) -> float:
+        if self.remaining is None or self.reset_at is None:
+            return 0.0
+
+        if now >= self.reset_at:
+            # The window has rolled over; wait for fresh headers
+            self.remaining = None
+            self.reset_at = None
+            self._next_slot = 0.0
+            return 0.0
+
+        until_reset = self.reset_at - now
+
+        if self.remaining <= 0:
+            # Empty bucket: everyone waits for the reset
+            return min(until_reset, self.max_wait)
+
+        wait = 0.0
+        if self.limit and self.remaining < self.limit * self.slowdown_fraction:
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + max(self.reset_at - slot, 0.0) / self.remaining
+            wait = slot - now
+
+        self.remaining -= 1
+        return min(wait, self.max_wait)
+
+    def update(self, headers: Mapping[str, str]) -> None:
+        """Refill the bucket from a response's rate-limit headers."""
+        remaining = _header_int(headers, REMAINING_HEADER)
+        reset_at = _header_int(headers, RESET_HEADER)
+        if remaining is None or reset_at is None:
+            return
+
+        limit = _header_int(headers, LIMIT_HEADER)
+
+        with self._lock:
+            if limit is not None:
+                self.limit = limit
+
+            if self.reset_at is not None and reset_at == self.reset_at and self.remaining is not None:
+                # Same window: responses to concurrent requests can arrive out
+                # of order, so never let a stale header raise our estimate.
+                self.remaining = min(self.remaining, remaining)
+            else:
+                self.remaining = remaining
+                self.reset_at = reset_at
+                self._next_slot = 0.0
+
+    def exhausted(self, headers: Mapping[str, str]) -> bool:
+        """Return True if a response was rejected because the quota ran out."""
+        return _header_int(headers, REMAINING_HEADER) == 0
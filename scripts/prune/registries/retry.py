@@ -0,0 +1,130 @@
+"""Retry policy with capped exponential backoff for registry API calls."""
+
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Mapping, Optional
+
+# Methods that can be re-sent after an ambiguous failure without changing the outcome
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+
+# The server refused the request before acting on it, so any method may be re-sent
+REJECTED_STATUSES = frozenset([429, 503])
+
+# The request may or may not have been applied; only idempotent methods are re-sent
+AMBIGUOUS_STATUSES = frozenset([500, 502, 504])
+
+
+def parse_retry_after(headers: Mapping[str, str], now: Optional[datetime] = None) -> Optional[float]:
+    """Return the delay requested by a Retry-After header, in seconds."""
+    value = headers.get('retry-after')
+    if not isinstance(value, str) or not value.strip():
+        return None
+
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+
+    from email.utils import parsedate_to_datetime
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+
+    now = now or datetime.now(timezone.utc)
+    return max((retry_at - now).total_seconds(), 0.0)
+
+
+class RetryBudget:
+    """Caps the total number of retries across a whole prune run.
+
+    A budget is shared by every registry's RetryPolicy so that an outage
+    turns into a quick failure instead of every request backing off to its
+    own limit.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.spent = 0
+        self._lock = threading.Lock()
+
+    def try_spend(self) -> bool:
+        """Take one retry from the budget; False once it is used up."""
+        with self._lock:
+            if self.spent >= self.limit:
+                return False
+            self.spent += 1
+            return True
+
+    @property
+    def exhausted(self) -> bool:
+        return self.spent >= self.limit
+
+
+class RetryPolicy:
+    """Decides whether and when a failed request is re-sent.
+
+    Delays use "full jitter" exponential backoff, a random delay between 0
+    and min(max_delay, base_delay * 2**attempt), unless the server sent a
+    Retry-After header, which is honoured (up to max_delay) instead.
+    """
+
+    def __init__(self, max_attempts: int = 5, base_delay: float = 0.5, max_delay: float = 30.0,
+                 budget: Optional[RetryBudget] = None, sleep: Callable[[float], None] = time.sleep,
+                 rng: Callable[[], float] = random.random):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self._sleep = sleep
+        self._rng = rng
+        self._lock = threading.Lock()
+        self.retries = 0
+
+    def fork(self) -> 'RetryPolicy':
+        """Return a policy with the same settings and budget that counts its own retries."""
+        return RetryPolicy(self.max_attempts, self.base_delay, self.max_delay, self.budget, self._sleep, self._rng)
+
+    def should_retry(self, method: str, attempt: int, status: Optional[int] = None,
+                     idempotent: Optional[bool] = None) -> bool:
+        """Return True if a request that failed on ``attempt`` (0-based) may be re-sent.
+
+        ``status`` is None when no response was received (connection error or
+        timeout). Retries are taken from the shared budget, if any.
+        """
+        if attempt + 1 >= self.max_attempts:
+            return False
+
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+
+        if status is None or status in AMBIGUOUS_STATUSES:
+            if not idempotent:
+                return False
+        elif status not in REJECTED_STATUSES:
+            return False
+
+        if self.budget is not None and not self.budget.try_spend():
+            return False
+
+        with self._lock:
+            self.retries += 1
+        return True
+
+    def backoff(self, attempt: int, headers: Optional[Mapping[str, str]] = None) -> float:
+        """Return how long to wait before re-sending after ``attempt`` failed."""
+        if headers is not None:
+            retry_after = parse_retry_after(headers)
+            if retry_after is not None:
+                return min(retry_after, self.max_delay)
+
+        return self._rng() * min(self.max_delay, self.base_delay * (2 ** attempt))
+
+    def wait(self, attempt: int, headers: Optional[Mapping[str, str]] = None) -> None:
+        """Sleep for the backoff delay of ``attempt``."""
+        delay = self.backoff(attempt, headers)
+        if delay > 0:
+            self._sleep(delay)
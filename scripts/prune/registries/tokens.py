@@ -0,0 +1,118 @@
+"""Persistent cache of registry auth tokens."""
+
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from .cache import cache_root
+
+# Tokens this close to their expiry are treated as expired
+REFRESH_MARGIN = 60
+
+
+def default_token_path() -> str:
+    """Return the token cache file, next to the HTTP cache."""
+    return os.path.join(cache_root(), 'tokens.json')
+
+
+def jwt_expiry(token: str) -> Optional[float]:
+    """Return the ``exp`` claim of a JWT, or None if the token isn't one.
+
+    The signature is not checked; the expiry is only used to decide when to
+    ask the registry for a new token.
+    """
+    parts = token.split('.')
+    if len(parts) != 3:
+        return None
+    payload = parts[1] + '=' * (-len(parts[1]) % 4)
+    try:
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+        return float(claims['exp'])
+    except (ValueError, TypeError, KeyError):
+        return None
+
+
+def token_fresh(expires_at: Optional[float], now: Optional[float] = None) -> bool:
+    """Return True if a token expiring at ``expires_at`` can still be used."""
+    if expires_at is None:
+        return True
+    return expires_at - REFRESH_MARGIN > (time.time() if now is None else now)
+
+
+class TokenCache:
+    """Keeps auth tokens on disk so later runs can skip the login request.
+
+    Tokens are stored in a single JSON file readable only by the current
+    user, keyed by a hash of the API URL and credentials, so changing the
+    password never reuses a token issued for the old one. Only tokens with
+    a known expiry are stored, and they are dropped once they come within
+    REFRESH_MARGIN seconds of it.
+    """
+
+    def __init__(self, path: Optional[str] = None, clock: Callable[[], float] = time.time):
+        self.path = path or default_token_path()
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(api_url: str, username: str, secret: str) -> str:
+        return hashlib.sha256(f'{api_url}\n{username}\n{secret}'.encode()).hexdigest()
+
+    def fresh(self, expires_at: Optional[float]) -> bool:
+        return token_fresh(expires_at, self._clock())
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the stored token for ``key`` if it is not about to expire."""
+        with self._lock:
+            entry = self._load().get(key)
+        if not entry or not self.fresh(entry.get('expires_at')):
+            return None
+        return entry['token']
+
+    def put(self, key: str, token: str) -> None:
+        """Store ``token`` under ``key`` if its expiry is known."""
+        expires_at = jwt_expiry(token)
+        if expires_at is None:
+            return
+
+        with self._lock:
+            entries = {k: v for k, v in self._load().items() if self.fresh(v.get('expires_at'))}
+            entries[key] = {'token': token, 'expires_at': expires_at}
+            try:
+                self._save(entries)
+            except OSError:
+                # A cache that can't be written only costs a login on the next run
+                pass
+
+    def discard(self, key: str) -> None:
+        """Forget the token stored under ``key``, for example after a 401."""
+        with self._lock:
+            entries = self._load()
+            if entries.pop(key, None) is not None:
+                try:
+                    self._save(entries)
+                except OSError:
+                    pass
+
+    def _load(self) -> Dict[str, dict]:
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    def _save(self, entries: Dict[str, dict]) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.path)
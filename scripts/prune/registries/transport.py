@@ -0,0 +1,199 @@
+"""Record/replay transport that captures registry HTTP exchanges to a cassette file.
+
+Recording mounts an adapter that sends requests as usual and appends every
+exchange, with its response time, to a cassette. Replaying mounts an adapter
+that answers requests from the cassette without touching the network,
+waiting for each response as long as it originally took (divided by
+``speed``). A captured production prune can then be replayed offline, with
+no credentials, to catch changes in the requests sent and the time taken.
+
+Credentials are never written: request headers are not recorded, and
+secret fields of JSON request and response bodies are replaced with
+placeholders. This module imports requests, so it is only loaded when a
+cassette is used.
+"""
+
+import collections
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from .base import RegistryError
+
+CASSETTE_VERSION = 1
+
+# JSON body fields holding credentials or tokens
+SECRET_FIELDS = ('secret', 'password', 'token', 'access_token', 'refresh_token')
+
+REDACTED = 'REDACTED'
+
+# Response headers that describe the wire encoding rather than the body kept
+DROPPED_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding', 'connection', 'set-cookie')
+
+
+class ReplayError(RegistryError):
+    """Raised when a replayed run sends a request the cassette has no answer for."""
+
+
+def _redact(body: Optional[bytes]) -> Optional[bytes]:
+    """Return a JSON object body with its secret fields replaced; other bodies are unchanged."""
+    if not body:
+        return body
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return body
+    if not isinstance(data, dict) or not any(field in data for field in SECRET_FIELDS):
+        return body
+    return json.dumps({key: REDACTED if key in SECRET_FIELDS else value for key, value in data.items()},
+                      sort_keys=True).encode('utf-8')
+
+
+def _body_digest(body: Any) -> Optional[str]:
+    """Digest of a request body with its secrets redacted, used to tell apart requests to one URL."""
+    if not body:
+        return None
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    return hashlib.sha256(_redact(body)).hexdigest()
+
+
+class Cassette:
+    """Recorded HTTP exchanges, matched by method, URL and body when replayed.
+
+    A new cassette records; one read with load() replays. Exchanges for the
+    same request are replayed in recording order, so retries and re-listings
+    play back as they happened. A cassette is shared by every registry
+    session of a run.
+    """
+
+    def __init__(self, path: str, interactions: Optional[List[Dict[str, Any]]] = None,
+                 meta: Optional[Dict[str, Any]] = None, replay: bool = False, speed: float = 1.0):
+        self.path = path
+        self.replay = replay
+        self.interactions = interactions if interactions is not None else []
+        self.meta = meta if meta is not None else {}
+        self.speed = speed
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._pending: Dict[Tuple[str, str, Optional[str]], Deque[Dict[str, Any]]] = collections.defaultdict(
+            collections.deque)
+        for interaction in self.interactions:
+            self._pending[self._key(interaction['method'], interaction['url'], interaction.get('body_sha256'))].append(
+                interaction)
+
+    @classmethod
+    def load(cls, path: str, speed: float = 1.0) -> 'Cassette':
+        """Read a cassette for replay. Raises ValueError if it can't be read."""
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            raise ValueError(f'Cannot read cassette {path}: {e}')
+        if not isinstance(data, dict) or data.get('version') != CASSETTE_VERSION:
+            raise ValueError(f'{path} is not a version {CASSETTE_VERSION} cassette')
+        return cls(path, data['interactions'], data.get('meta'), replay=True, speed=speed)
+
+    def save(self, **meta: Any) -> None:
+        """Write the recorded exchanges, with ``meta`` added to the cassette's metadata."""
+        self.meta.update(meta, recorded=datetime.now(timezone.utc).isoformat(timespec='seconds'))
+        with self._lock:
+            data = {'version': CASSETTE_VERSION, 'meta': self.meta, 'interactions': self.interactions}
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=1)
+
+    @staticmethod
+    def _key(method: str, url: str, body_sha256: Optional[str]) -> Tuple[str, str, Optional[str]]:
+        return method.upper(), url, body_sha256
+
+    def record(self, request: 'requests.PreparedRequest', resp: 'requests.Response', elapsed: float) -> None:
+        """Append one exchange whose response took ``elapsed`` seconds."""
+        headers = {name: value for name, value in resp.headers.items() if name.lower() not in DROPPED_HEADERS}
+        interaction = {
+            'method': request.method,
+            'url': request.url,
+            'body_sha256': _body_digest(request.body),
+            'offset': round(time.monotonic() - self._started - elapsed, 4),
+            'elapsed': round(elapsed, 4),
+            'status': resp.status_code,
+            'reason': resp.reason,
+            'headers': headers,
+            # Lone surrogates survive the JSON round trip, so bodies that
+            # aren't valid UTF-8 are restored byte for byte
+            'body': _redact(resp.content).decode('utf-8', 'surrogateescape'),
+        }
+        with self._lock:
+            self.interactions.append(interaction)
+
+    def play(self, request: 'requests.PreparedRequest') -> Dict[str, Any]:
+        """Take the next unplayed exchange matching ``request``. Raises ReplayError if there is none."""
+        key = self._key(request.method, request.url, _body_digest(request.body))
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending:
+                return pending.popleft()
+            self.misses += 1
+        raise ReplayError(f'No recorded response for {request.method} {request.url} in {self.path}')
+
+    @property
+    def unplayed(self) -> int:
+        """Number of recorded exchanges the replayed run did not request."""
+        with self._lock:
+            return sum(len(pending) for pending in self._pending.values())
+
+    def adapter(self, pool_size: int) -> BaseAdapter:
+        """Return a transport adapter that records to, or replays from, this cassette."""
+        if self.replay:
+            return ReplayAdapter(self)
+        return RecordingAdapter(self, pool_connections=4, pool_maxsize=pool_size, pool_block=True)
+
+
+class RecordingAdapter(HTTPAdapter):
+    """Pooled HTTP adapter that records every exchange it sends to a cassette."""
+
+    def __init__(self, cassette: Cassette, **kwargs):
+        super().__init__(**kwargs)
+        self.cassette = cassette
+
+    def send(self, request, **kwargs):
+        started = time.monotonic()
+        resp = super().send(request, **kwargs)
+        # Reading the body here keeps it for the caller, which may stream it
+        resp.content
+        self.cassette.record(request, resp, time.monotonic() - started)
+        return resp
+
+
+class ReplayAdapter(BaseAdapter):
+    """Adapter that answers requests from a cassette, with the recorded response times."""
+
+    def __init__(self, cassette: Cassette):
+        super().__init__()
+        self.cassette = cassette
+
+    def send(self, request, **kwargs):
+        interaction = self.cassette.play(request)
+        if self.cassette.speed > 0:
+            time.sleep(interaction['elapsed'] / self.cassette.speed)
+
+        resp = requests.Response()
+        resp.status_code = interaction['status']
+        resp.reason = interaction.get('reason')
+        resp.url = request.url
+        resp.headers = CaseInsensitiveDict(interaction['headers'])
+        resp._content = interaction['body'].encode('utf-8', 'surrogateescape')
+        resp.encoding = requests.utils.get_encoding_from_headers(resp.headers)
+        resp.request = request
+        resp.connection = self
+        return resp
+
+    def close(self):
+        pass
@@ -1,20 +1,55 @@
 """Pruning strategies for container images."""
 
+import heapq
+import re
 from abc import ABC, abstractmethod
-from typing import List
+from typing import TYPE_CHECKING, Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple
 from datetime import datetime, timedelta
 
 from registries.base import ImageVersion
 
+if TYPE_CHECKING:
+    from table import VersionTable
+
 
 class PruningStrategy(ABC):
     """Abstract base class for pruning strategies."""
 
+    # True when a decision depends on other versions (e.g. ranking by age).
+    # Strategies that set this to False decide from each version alone via
+    # should_delete(), so versions can be evaluated as they are listed.
+    needs_inventory = True
+
+    # True when select_table() on a freshly built VersionTable is faster than
+    # select(), with either table backend (see benchmarks/strategies.py), so
+    # planning builds the table for this strategy.
+    prefers_table = False
+
     @abstractmethod
-    def should_delete(self, version: ImageVersion, all_versions: List[ImageVersion]) -> bool:
-        """Determine if a version should be deleted."""
+    def select(self, versions: List[ImageVersion]) -> List[ImageVersion]:
+        """Return the versions to delete, in inventory order.
+
+        The whole inventory is evaluated in a single pass, so this is the
+        entry point callers should use to build a deletion plan.
+        """
         pass
 
+    def select_table(self, table: 'VersionTable') -> List[ImageVersion]:
+        """Return the versions to delete from a columnar table of the inventory, in inventory order.
+
+        Strategies override this with whole-array operations on the table's
+        columns; the default runs select() on its versions.
+        """
+        return self.select(list(table.versions))
+
+    def should_delete(self, version: ImageVersion, all_versions: List[ImageVersion]) -> bool:
+        """Determine if a version should be deleted.
+
+        Compatibility shim around select(); evaluating a whole inventory one
+        version at a time through this method repeats the selection work.
+        """
+        return version.id in {v.id for v in self.select(all_versions)}
+
     @abstractmethod
     def get_description(self) -> str:
         """Get a human-readable description of the strategy."""
@@ -24,12 +59,22 @@ class PruningStrategy(ABC):
 class PruneUntaggedByAge(PruningStrategy):
     """Prune untagged images older than a specified age."""
 
+    needs_inventory = False
+
     def __init__(self, days: float):
         self.days = days
         self.cutoff_date = datetime.now().astimezone() - timedelta(days=days)
+        # Compared against ImageVersion.created_ts to avoid building datetimes
+        self.cutoff_ts = self.cutoff_date.timestamp()
+
+    def select(self, versions: List[ImageVersion]) -> List[ImageVersion]:
+        return [v for v in versions if not v.tags and v.created_ts < self.cutoff_ts]
+
+    def select_table(self, table: 'VersionTable') -> List[ImageVersion]:
+        return table.pick(~table.tagged & table.compare_created('<', self.cutoff_ts))
 
     def should_delete(self, version: ImageVersion, all_versions: List[ImageVersion]) -> bool:
-        return not version.is_tagged and version.created_at < self.cutoff_date
+        return not version.tags and version.created_ts < self.cutoff_ts
 
     def get_description(self) -> str:
         return f"Pruning untagged images older than {self.days} days (before {self.cutoff_date})"
@@ -38,8 +83,16 @@ class PruneUntaggedByAge(PruningStrategy):
 class PruneAllUntagged(PruningStrategy):
     """Prune all untagged images."""
 
+    needs_inventory = False
+
+    def select(self, versions: List[ImageVersion]) -> List[ImageVersion]:
+        return [v for v in versions if not v.tags]
+
+    def select_table(self, table: 'VersionTable') -> List[ImageVersion]:
+        return table.pick(~table.tagged)
+
     def should_delete(self, version: ImageVersion, all_versions: List[ImageVersion]) -> bool:
-        return not version.is_tagged
+        return not version.tags
 
     def get_description(self) -> str:
         return "Pruning all untagged images"
@@ -51,18 +104,139 @@ class KeepLatestCount(PruningStrategy):
     def __init__(self, count: int):
         self.count = count
 
-    def should_delete(self, version: ImageVersion, all_versions: List[ImageVersion]) -> bool:
-        # Sort all versions by creation date (newest first)
-        sorted_versions = sorted(all_versions, key=lambda v: v.created_at, reverse=True)
+    def select(self, versions: List[ImageVersion]) -> List[ImageVersion]:
+        # Rows sharing an ID (the tags of one Docker Hub digest) are one image, created
+        # when its newest row was, and are kept or deleted together
+        created: Dict[str, float] = {}
+        for v in versions:
+            if created.get(v.id, v.created_ts) <= v.created_ts:
+                created[v.id] = v.created_ts
+        # heapq.nlargest is equivalent to sorted(..., reverse=True)[:n] (ties keep
+        # inventory order) but only maintains a heap of size n.
+        keep_ids = set(heapq.nlargest(self.count, created, key=created.__getitem__))
+        return [v for v in versions if v.id not in keep_ids]
+
+    def select_table(self, table: 'VersionTable') -> List[ImageVersion]:
+        return table.pick(~table.newest(self.count))
+
+    def get_description(self) -> str:
+        return f"Keeping only the latest {self.count} images (deleting all others)"
+
+
+# --group-by value that groups tags by semantic version major.minor ("v1.2.3" and "1.2" are both "1.2")
+SEMVER_GROUP = 'semver'
+
+_SEMVER_TAG = re.compile(r'v?(\d+)\.(\d+)(?:\.\d+)?(?:[-+][0-9A-Za-z.+-]*)?')
+
 
-        # Find the index of this version in the sorted list
+def _semver_key(tag: str) -> Optional[str]:
+    match = _SEMVER_TAG.fullmatch(tag)
+    return f"{match.group(1)}.{match.group(2)}" if match else None
+
+
+class KeepLatestPerGroup(PruningStrategy):
+    """Keep the latest N images of each tag family, delete the older images of every family.
+
+    ``group_by`` derives a group key from each tag: SEMVER_GROUP for the
+    major.minor of semantic version tags, or a regular expression whose
+    capture groups (or whole match, without groups) are the key, e.g.
+    ``^(sha)-`` puts every ``sha-xxxx`` tag in one group. An image with
+    several tags is in each of their groups and is kept if it is among the
+    latest N of any of them. Images with no tag in any group are left alone.
+    Rows that share a version ID are one image, kept or deleted together.
+    """
+
+    prefers_table = True
+
+    def __init__(self, count: int, group_by: str = SEMVER_GROUP):
+        if not isinstance(group_by, str):
+            raise ValueError(f"Group key must be {SEMVER_GROUP!r} or a regular expression, not {group_by!r}")
+        self.count = count
+        self.group_by = group_by
+        if group_by == SEMVER_GROUP:
+            self._key: Callable[[str], Optional[Hashable]] = _semver_key
+        else:
+            try:
+                pattern = re.compile(group_by)
+            except re.error as e:
+                raise ValueError(f"Invalid group regular expression {group_by!r}: {e}")
+            self._key = lambda tag: self._regex_key(pattern, tag)
+        # Group key of each tag seen so far (None when it is in no group)
+        self._tag_keys: Dict[str, Optional[Hashable]] = {}
+
+    @staticmethod
+    def _regex_key(pattern: 're.Pattern[str]', tag: str) -> Optional[Hashable]:
+        match = pattern.search(tag)
+        if match is None:
+            return None
+        return match.groups() if pattern.groups else match.group(0)
+
+    def _tag_key(self, tag: str) -> Optional[Hashable]:
         try:
-            index = next(i for i, v in enumerate(sorted_versions) if v.id == version.id)
-            # Delete if this version is not in the top N
-            return index >= self.count
-        except StopIteration:
-            # If we can't find the version, don't delete it
-            return False
+            return self._tag_keys[tag]
+        except KeyError:
+            key = self._tag_keys[tag] = self._key(tag)
+            return key
+
+    def _plan_groups(self, group_keys: Iterable[Tuple[int, Hashable]], created) -> Tuple[Set[int], Set[int]]:
+        """Return the grouped IDs and the IDs to keep, from (ID group, tag group key) pairs.
+
+        ID groups number the version IDs in order of first appearance, and
+        ``created`` holds the creation time of each. Every tag group has a
+        min-heap of its ``count`` newest (created, -ID group) entries, so the
+        inventory is partitioned and ranked in one pass. Negating the ID group
+        makes the first listed of equal times the newest, as KeepLatestCount
+        does.
+        """
+        heaps: Dict[Hashable, List[Tuple[float, int]]] = {}
+        seen: Set[Tuple[Hashable, int]] = set()
+        grouped: Set[int] = set()
+        count = self.count
+        for group, key in group_keys:
+            if (key, group) in seen:
+                # Another tag of the same image in the same tag group
+                continue
+            seen.add((key, group))
+            grouped.add(group)
+            if count <= 0:
+                continue
+            entry = (created[group], -group)
+            heap = heaps.setdefault(key, [])
+            if len(heap) < count:
+                heapq.heappush(heap, entry)
+            elif entry > heap[0]:
+                heapq.heapreplace(heap, entry)
+
+        keep = {-entry[1] for heap in heaps.values() for entry in heap}
+        return grouped, keep
+
+    def select(self, versions: List[ImageVersion]) -> List[ImageVersion]:
+        # Rows sharing an ID (the tags of one Docker Hub digest) are one image,
+        # created when its newest row was, as in the table's ID groups
+        group_index: Dict[str, int] = {}
+        groups = [group_index.setdefault(v.id, len(group_index)) for v in versions]
+        created = [float('-inf')] * len(group_index)
+        for group, v in zip(groups, versions):
+            created[group] = max(created[group], v.created_ts)
+
+        tag_key = self._tag_key
+        group_keys = ((group, key) for group, version in zip(groups, versions) for tag in version.tags
+                      for key in (tag_key(tag),) if key is not None)
+        grouped, keep = self._plan_groups(group_keys, created)
+        delete = grouped - keep
+        return [v for group, v in zip(groups, versions) if group in delete]
+
+    def select_table(self, table: 'VersionTable') -> List[ImageVersion]:
+        # The table has already interned the tags, so each distinct tag is keyed once
+        tag_keys = [self._tag_key(tag) for tag in table.tags]
+        groups = table.groups.tolist()
+        group_keys = ((groups[row], tag_keys[tag_id])
+                      for row, tag_id in zip(table.tag_rows.tolist(), table.tag_ids.tolist())
+                      if tag_keys[tag_id] is not None)
+        grouped, keep = self._plan_groups(group_keys, table.group_created.tolist())
+        delete = grouped - keep
+        return [v for group, v in zip(groups, table.versions) if group in delete]
 
     def get_description(self) -> str:
-        return f"Keeping only the latest {self.count} images (deleting all others)"
+        return (f"Keeping the latest {self.count} images of each tag group by {self.group_by} "
+                f"(deleting older images in each group)")
@@ -0,0 +1,297 @@
+"""Columnar view of a listed inventory, for evaluating strategies as whole-array operations.
+
+A VersionTable holds one column per field strategies look at: creation
+times as int64 epoch seconds, whether each version is tagged, interned tag
+IDs and per-version-ID group IDs. Strategies combine row masks with ``&``,
+``|`` and ``~`` instead of calling methods on each ImageVersion.
+
+Several rows can share a version ID (on Docker Hub every tag of a digest is
+a row, and the digest is the ID), and deleting an ID deletes all of its
+rows, so rankings are over distinct IDs and a kept ID keeps every row.
+
+NumPy is used when it is installed. Without it, columns are ``array``
+module arrays and a mask is a RowMask: one byte per row packed into a
+Python integer, so the boolean operations still run in C.
+"""
+
+import heapq
+import operator
+from array import array
+from itertools import compress, islice
+from operator import attrgetter
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+from registries.base import ImageVersion
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Comparison operators accepted by compare_created() and compare_rank()
+COMPARISONS = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge, '==': operator.eq}
+
+# Method of the right-hand operand that answers ``left OP right``, so map() can compare in C
+_REFLECTED = {'<': '__gt__', '<=': '__ge__', '>': '__lt__', '>=': '__le__', '==': '__eq__'}
+
+
+class RowMask:
+    """Row mask used without NumPy: byte ``i`` of ``value`` is 1 when row ``i`` is selected."""
+
+    __slots__ = ('value', 'rows')
+
+    def __init__(self, value: int, rows: int):
+        self.value = value
+        self.rows = rows
+
+    @classmethod
+    def from_flags(cls, flags, rows: int) -> 'RowMask':
+        """Build a mask from an iterable of one truth value per row."""
+        return cls(int.from_bytes(bytes(map(bool, flags)), 'little'), rows)
+
+    def __and__(self, other: 'RowMask') -> 'RowMask':
+        return RowMask(self.value & other.value, self.rows)
+
+    def __or__(self, other: 'RowMask') -> 'RowMask':
+        return RowMask(self.value | other.value, self.rows)
+
+    def __invert__(self) -> 'RowMask':
+        return RowMask(self.value ^ int.from_bytes(b'\x01' * self.rows, 'little'), self.rows)
+
+    def flags(self) -> bytes:
+        """One byte (0 or 1) per row."""
+        return self.value.to_bytes(self.rows, 'little')
+
+
+Mask = Union[RowMask, 'np.ndarray']
+
+
+class VersionTable:
+    """Columns of a list of versions, in inventory order.
+
+    Column attributes:
+        created   creation time of each row, epoch seconds (int64)
+        tagged    mask of the rows that have at least one tag
+        tags      every distinct tag name; a tag's ID is its position here
+        tag_rows  row of each (row, tag) pair, for rows with several tags
+        tag_ids   tag ID of each (row, tag) pair
+        groups    group ID of each row; rows with the same version ID share one,
+                  numbered in order of first appearance
+        ids       the version ID of each group ID
+
+    The tag and group columns are built the first time they are used, since
+    most strategies only look at creation times and whether rows are tagged.
+    ``use_numpy`` picks the backend (default: NumPy if it is installed).
+    """
+
+    def __init__(self, versions: Sequence[ImageVersion], use_numpy: Optional[bool] = None):
+        self.versions = versions
+        self.rows = len(versions)
+        self.numpy = np is not None if use_numpy is None else use_numpy
+        if self.numpy and np is None:
+            raise ImportError('NumPy is not installed')
+
+        # Filled with map() so the per-row work stays in C
+        created = map(attrgetter('created_ts'), versions)
+        if self.numpy:
+            self.created = np.fromiter(created, dtype=np.int64, count=self.rows)
+        else:
+            self.created = array('q', list(created))
+        self._tagged_flags = bytes(map(bool, map(attrgetter('tags'), versions)))
+        if self.numpy:
+            self.tagged = np.frombuffer(self._tagged_flags, dtype=np.bool_).copy()
+        else:
+            self.tagged = RowMask(int.from_bytes(self._tagged_flags, 'little'), self.rows)
+
+        self._tag_columns: Optional[Tuple[List[str], Any, Any]] = None
+        self._group_columns: Optional[Tuple[Any, List[str], Any]] = None
+        self._ranks = None
+
+    def _column(self, values: array):
+        """An int64 column in the table's backend."""
+        if self.numpy:
+            return np.frombuffer(values, dtype=np.int64).copy() if len(values) else np.zeros(0, np.int64)
+        return values
+
+    def _index_tags(self) -> Tuple[List[str], Any, Any]:
+        if self._tag_columns is None:
+            tag_index: Dict[str, int] = {}
+            tag_rows = array('q')
+            tag_ids = array('q')
+            versions = self.versions
+            for row in compress(range(self.rows), self._tagged_flags):
+                for tag in versions[row].tags:
+                    tag_rows.append(row)
+                    tag_ids.append(tag_index.setdefault(tag, len(tag_index)))
+            self._tag_columns = (list(tag_index), self._column(tag_rows), self._column(tag_ids))
+        return self._tag_columns
+
+    @property
+    def tags(self) -> List[str]:
+        return self._index_tags()[0]
+
+    @property
+    def tag_rows(self):
+        return self._index_tags()[1]
+
+    @property
+    def tag_ids(self):
+        return self._index_tags()[2]
+
+    def _index_groups(self) -> Tuple[Any, List[str], Any]:
+        if self._group_columns is None:
+            ids = list(map(attrgetter('id'), self.versions))
+            if len(set(ids)) == self.rows:
+                # Every row has its own ID (as on GHCR): groups are rows
+                groups = np.arange(self.rows, dtype=np.int64) if self.numpy else array('q', range(self.rows))
+                self._group_columns = (groups, ids, self.created)
+            else:
+                group_index: Dict[str, int] = {}
+                groups = self._column(array('q', [group_index.setdefault(version_id, len(group_index))
+                                                  for version_id in ids]))
+                self._group_columns = (groups, list(group_index), self._group_created(groups, len(group_index)))
+        return self._group_columns
+
+    def _group_created(self, groups, count: int):
+        """Creation time of each group: the newest of its rows."""
+        if self.numpy:
+            created = np.full(count, np.iinfo(np.int64).min, dtype=np.int64)
+            np.maximum.at(created, groups, self.created)
+            return created
+        created = array('q', [-2 ** 63]) * count
+        for group, row_created in zip(groups, self.created):
+            if row_created > created[group]:
+                created[group] = row_created
+        return created
+
+    @property
+    def groups(self):
+        return self._index_groups()[0]
+
+    @property
+    def ids(self) -> List[str]:
+        return self._index_groups()[1]
+
+    @property
+    def group_created(self):
+        """Creation time of each group ID, the newest of its rows."""
+        return self._index_groups()[2]
+
+    def _spread(self, group_mask) -> Mask:
+        """The rows of the groups a per-group mask (bool array or bytes) selects."""
+        if len(group_mask) == self.rows:
+            # One row per group, in the same order
+            return group_mask if self.numpy else RowMask(int.from_bytes(group_mask, 'little'), self.rows)
+        if self.numpy:
+            return group_mask[self.groups]
+        return RowMask(int.from_bytes(bytes(map(group_mask.__getitem__, self.groups)), 'little'), self.rows)
+
+    def any_in_group(self, mask: Mask) -> Mask:
+        """Every row of each version ID that has at least one row in ``mask``."""
+        if len(self.ids) == self.rows:
+            return mask
+        groups = self.groups
+        if self.numpy:
+            hits = np.zeros(len(self.ids), dtype=np.bool_)
+            hits[groups[mask]] = True
+            return hits[groups]
+        hits = bytearray(len(self.ids))
+        for group in compress(groups, mask.flags()):
+            hits[group] = 1
+        return self._spread(hits)
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def constant(self, value: bool) -> Mask:
+        """A mask selecting every row, or none."""
+        if self.numpy:
+            return np.full(self.rows, value, dtype=np.bool_)
+        return RowMask(int.from_bytes(b'\x01' * self.rows, 'little') if value else 0, self.rows)
+
+    def compare_created(self, op: str, timestamp: float) -> Mask:
+        """Rows whose creation time compares to ``timestamp`` with ``op`` (e.g. '<')."""
+        if self.numpy:
+            return COMPARISONS[op](self.created, timestamp)
+        # Creation times are whole seconds, so comparing with an integer bound gives the same
+        # rows while keeping every comparison int to int
+        bound = int(timestamp)
+        if bound != timestamp and op in ('<', '>='):
+            bound += 1
+        elif bound != timestamp and op == '==':
+            return self.constant(False)
+        return RowMask.from_flags(map(getattr(bound, _REFLECTED[op]), self.created), self.rows)
+
+    def newest(self, count: int) -> Mask:
+        """Every row of the ``count`` newest version IDs; of IDs created at the same time, the first listed win."""
+        created = self.group_created
+        groups = len(created)
+        if count >= groups:
+            return self.constant(True)
+        if count <= 0:
+            return self.constant(False)
+
+        # Everything newer than the count-th newest time, then the first IDs at that time
+        if self.numpy:
+            threshold = np.partition(created, groups - count)[groups - count]
+            kept = created > threshold
+            ties = np.flatnonzero(created == threshold)[:count - int(kept.sum())]
+            kept[ties] = True
+            return self._spread(kept)
+
+        threshold = heapq.nlargest(count, created)[-1]
+        flags = bytearray(map(threshold.__lt__, created))
+        ties = compress(range(groups), map(threshold.__eq__, created))
+        for group in islice(ties, count - flags.count(1)):
+            flags[group] = 1
+        return self._spread(flags)
+
+    def ranks(self):
+        """Rank of every row's version ID when sorted newest first, 1 being the newest (computed once)."""
+        if self._ranks is None:
+            created = self.group_created
+            groups = len(created)
+            if self.numpy:
+                order = np.argsort(-created, kind='stable')
+                ranks = np.empty(groups, dtype=np.int64)
+                ranks[order] = np.arange(1, groups + 1)
+                self._ranks = ranks if groups == self.rows else ranks[self.groups]
+            else:
+                order = sorted(range(groups), key=created.__getitem__, reverse=True)
+                ranks = array('q', bytes(8 * groups))
+                for rank, group in enumerate(order, 1):
+                    ranks[group] = rank
+                self._ranks = ranks if groups == self.rows else array('q', map(ranks.__getitem__, self.groups))
+        return self._ranks
+
+    def compare_rank(self, op: str, rank: int) -> Mask:
+        """Rows whose rank (see ranks()) compares to ``rank`` with ``op``."""
+        # Rank <= n is exactly the rows of the n newest IDs, without ranking the rest
+        if op in ('<=', '<'):
+            return self.newest(rank if op == '<=' else rank - 1)
+        if op in ('>', '>='):
+            return ~self.newest(rank if op == '>' else rank - 1)
+        if self.numpy:
+            return COMPARISONS[op](self.ranks(), rank)
+        compare = COMPARISONS[op]
+        return RowMask.from_flags((compare(r, rank) for r in self.ranks()), self.rows)
+
+    def with_tags(self, hits: Sequence[Any]) -> Mask:
+        """Rows with at least one of the tags whose entry in ``hits`` (one per tag ID) is true."""
+        if self.numpy:
+            mask = np.zeros(self.rows, dtype=np.bool_)
+            if hits:
+                mask[self.tag_rows[np.asarray(hits, dtype=np.bool_)[self.tag_ids]]] = True
+            return mask
+
+        flags = bytearray(self.rows)
+        for row, tag_id in zip(self.tag_rows, self.tag_ids):
+            if hits[tag_id]:
+                flags[row] = 1
+        return RowMask(int.from_bytes(flags, 'little'), self.rows)
+
+    def pick(self, mask: Mask) -> List[ImageVersion]:
+        """The versions of the rows a mask selects, in inventory order."""
+        # A NumPy bool array's bytes are already one 0 or 1 per row
+        return list(compress(self.versions, mask.tobytes() if self.numpy else mask.flags()))
+
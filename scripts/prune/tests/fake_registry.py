@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the registry HTTP APIs used by the prune script.
+
+The server runs on 127.0.0.1 in a background thread using only the standard
+library, keeps its state in memory and records every request it receives,
+so tests and benchmarks can exercise the real registry classes (or main.py,
+via GITHUB_API_URL and DOCKER_HUB_API_URL) over HTTP. Successful GET
+responses carry an ETag and are answered with 304 Not Modified when the
+request's If-None-Match matches. Docker Hub logins issue unsigned JWTs whose
+``exp`` claim is ``token_ttl`` seconds away; other Docker Hub endpoints answer
+401 unless they are sent a token that is still valid.
+
+Every response can be delayed by ``latency`` seconds, a seeded fraction
+``error_rate`` of requests is answered with 503, and setting ``rate_limit``
+adds x-ratelimit-* headers and answers 429 once a window's quota is spent.
+
+Emulated Docker Hub endpoints (under /v2):
+
+- POST   /auth/token
+- GET    /repositories/{namespace}/{repo}/
+- GET    /repositories/{namespace}/{repo}/tags/?page=N&page_size=N
+- DELETE /repositories/{namespace}/{repo}/tags/{tag}/
+- POST   /namespaces/{namespace}/delete-images
+
+Emulated GitHub endpoints (the owner is either /user or /orgs/{org}):
+
+- GET    /user
+- GET    {owner}/packages?package_type=container&per_page=N&page=N
+- GET    {owner}/packages/container/{package}/versions?per_page=N&page=N
+- DELETE {owner}/packages/container/{package}/versions/{id}
+
+Emulated GHCR registry endpoints (under /ghcr, for GHCR_REGISTRY_URL):
+
+- GET    /token?scope=repository:{owner}/{package}:pull
+- GET    /v2/{owner}/{package}/manifests/{digest}
+"""
+
+import base64
+import hashlib
+import itertools
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlencode, urlsplit
+
+# Creation time of the newest synthetic version; older ones are a minute apart
+SYNTHETIC_EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def _timestamp(index: int) -> str:
+    return (SYNTHETIC_EPOCH - timedelta(minutes=index)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class FakeRegistry:
+    """In-memory registry state served over HTTP."""
+
+    def __init__(self, namespace: str = 'testuser', latency: float = 0.0, error_rate: float = 0.0,
+                 rate_limit: Optional[int] = None, rate_limit_window: float = 60.0, seed: int = 0):
+        self.namespace = namespace
+        # repository name -> list of Docker Hub tag records, newest first
+        self.dockerhub_tags: Dict[str, List[dict]] = {}
+        # package name -> list of GHCR version records, newest first
+        self.ghcr_versions: Dict[str, List[dict]] = {}
+        # digest -> manifest served by the GHCR registry endpoints
+        self.ghcr_manifests: Dict[str, dict] = {}
+        self.pull_tokens: set = set()
+        self.bulk_delete_enabled = True
+        self.token_ttl = 300
+        self.tokens: Dict[str, float] = {}
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.rate_limit_window = rate_limit_window
+        self.requests: List[tuple] = []
+        self.connections = 0
+        self._token_ids = itertools.count(1)
+        self._version_ids = itertools.count(1)
+        self._rng = random.Random(seed)
+        self._window_reset = 0.0
+        self._window_used = 0
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def seed_dockerhub(self, repo: str, tags: List[dict]) -> None:
+        """Add tag records ({'name', 'digest', 'last_updated', ...}) to a repository."""
+        with self._lock:
+            self.dockerhub_tags.setdefault(repo, []).extend(tags)
+
+    def seed_dockerhub_synthetic(self, repo: str, count: int, tagged_every: int = 5) -> None:
+        """Add ``count`` tags with a digest each; every ``tagged_every``-th one is active."""
+        self.seed_dockerhub(repo, [
+            {'name': f'build-{i}', 'digest': f'sha256:{i:064x}', 'last_updated': _timestamp(i),
+             'full_size': 10_000_000 + i, 'tag_status': 'active' if i % tagged_every == 0 else 'inactive'}
+            for i in range(count)
+        ])
+
+    def seed_ghcr(self, package: str, count: int, tagged_every: int = 5) -> None:
+        """Add ``count`` versions to a GHCR package; every ``tagged_every``-th one is tagged."""
+        with self._lock:
+            versions = self.ghcr_versions.setdefault(package, [])
+            for i in range(count):
+                version_id = next(self._version_ids)
+                self.ghcr_manifests[f'sha256:{version_id:064x}'] = {
+                    'schemaVersion': 2, 'mediaType': 'application/vnd.oci.image.manifest.v1+json', 'layers': []}
+                versions.append({
+                    'id': version_id,
+                    'name': f'sha256:{version_id:064x}',
+                    'created_at': _timestamp(len(versions)),
+                    'updated_at': _timestamp(len(versions)),
+                    'metadata': {'package_type': 'container',
+                                 'container': {'tags': [f'v{i}'] if i % tagged_every == 0 else []}},
+                })
+
+    def seed_ghcr_multiarch(self, package: str, count: int, platforms: Tuple[str, ...] = ('amd64', 'arm64'),
+                            attestations: bool = True, tagged: bool = True) -> List[str]:
+        """Add ``count`` multi-platform images as buildx pushes them and return their index digests.
+
+        Each image is a newest-first group of versions: an image index
+        (tagged ``build-N`` unless ``tagged`` is false) followed by an untagged
+        manifest per platform and, with ``attestations``, an untagged
+        attestation manifest per platform, all listed by the index.
+        """
+        oci_manifest = 'application/vnd.oci.image.manifest.v1+json'
+        indexes = []
+        with self._lock:
+            versions = self.ghcr_versions.setdefault(package, [])
+            for i in range(count):
+                children = [{'architecture': platform, 'os': 'linux'} for platform in platforms]
+                if attestations:
+                    children += [{'architecture': 'unknown', 'os': 'unknown'} for _ in platforms]
+                ids = [next(self._version_ids) for _ in range(len(children) + 1)]
+                digests = [f'sha256:{version_id:064x}' for version_id in ids]
+
+                self.ghcr_manifests[digests[0]] = {
+                    'schemaVersion': 2,
+                    'mediaType': 'application/vnd.oci.image.index.v1+json',
+                    'manifests': [{'mediaType': oci_manifest, 'digest': digest, 'size': 1000, 'platform': platform}
+                                  for digest, platform in zip(digests[1:], children)],
+                }
+                for digest in digests[1:]:
+                    self.ghcr_manifests[digest] = {'schemaVersion': 2, 'mediaType': oci_manifest, 'layers': []}
+
+                tags = [f'build-{i}'] if tagged else []
+                for version_id, digest, version_tags in zip(ids, digests, [tags] + [[]] * len(children)):
+                    versions.append({
+                        'id': version_id,
+                        'name': digest,
+                        'created_at': _timestamp(len(versions)),
+                        'updated_at': _timestamp(len(versions)),
+                        'metadata': {'package_type': 'container', 'container': {'tags': version_tags}},
+                    })
+                indexes.append(digests[0])
+        return indexes
+
+    def issue_token(self) -> str:
+        """Mint a token the Docker Hub endpoints accept until it expires."""
+        expires_at = time.time() + self.token_ttl
+        claims = {'sub': self.namespace, 'jti': next(self._token_ids), 'exp': int(expires_at)}
+        token = '.'.join(base64.urlsafe_b64encode(json.dumps(part).encode()).decode().rstrip('=')
+                         for part in ({'alg': 'none'}, claims, 'sig'))
+        self.tokens[token] = expires_at
+        return token
+
+    def revoke_tokens(self) -> None:
+        """Invalidate every token issued so far, as an expiry would."""
+        with self._lock:
+            self.tokens.clear()
+            self.pull_tokens.clear()
+
+    def count(self, method: str, path_prefix: str = '') -> int:
+        """Number of requests received with the given method and path prefix."""
+        with self._lock:
+            return sum(1 for m, path in self.requests if m == method and path.startswith(path_prefix))
+
+    def request_counts(self) -> Dict[str, int]:
+        """Number of requests received per method."""
+        counts: Dict[str, int] = {}
+        with self._lock:
+            for method, _ in self.requests:
+                counts[method] = counts.get(method, 0) + 1
+        return counts
+
+    def _take_rate_limit(self) -> Tuple[Dict[str, str], bool]:
+        """Count a request against the current window; returns its headers and whether it is over quota."""
+        if self.rate_limit is None:
+            return {}, False
+        now = time.time()
+        if now >= self._window_reset:
+            self._window_reset = now + self.rate_limit_window
+            self._window_used = 0
+        self._window_used += 1
+        headers = {
+            'x-ratelimit-limit': str(self.rate_limit),
+            'x-ratelimit-remaining': str(max(self.rate_limit - self._window_used, 0)),
+            'x-ratelimit-reset': str(int(self._window_reset)),
+        }
+        return headers, self._window_used > self.rate_limit
+
+    def start(self) -> 'FakeRegistry':
+        registry = self
+
+        class Handler(_Handler):
+            state = registry
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> 'FakeRegistry':
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    state: FakeRegistry
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.state._lock:
+            self.state.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def _dispatch(self, method: str) -> None:
+        state = self.state
+        parts = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+
+        with state._lock:
+            state.requests.append((method, parts.path))
+            headers, limited = state._take_rate_limit()
+            failed = state.error_rate > 0 and state._rng.random() < state.error_rate
+
+        if state.latency:
+            time.sleep(state.latency)
+
+        if limited:
+            self._send(method, 429, {'message': 'rate limit exceeded'}, headers)
+            return
+        if failed:
+            self._send(method, 503, {'message': 'service unavailable'}, headers)
+            return
+
+        query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        segments = [unquote(segment) for segment in parts.path.split('/') if segment]
+
+        if segments[:1] == ['v2']:
+            status, payload = self._route_dockerhub(method, segments[1:], query, body)
+        elif segments[:1] == ['ghcr']:
+            status, payload = self._route_ghcr_registry(method, segments[1:], query)
+        else:
+            status, payload, links = self._route_github(method, segments, query)
+            if links:
+                headers['Link'] = ', '.join(f'<{url}>; rel="{rel}"' for rel, url in links.items())
+        self._send(method, status, payload, headers)
+
+    def _send(self, method: str, status: int, payload, headers: Optional[Dict[str, str]] = None) -> None:
+        data = b'' if payload is None else json.dumps(payload).encode()
+        etag = None
+        if method == 'GET' and status == 200:
+            etag = f'"{hashlib.sha1(data).hexdigest()}"'
+            if self.headers.get('If-None-Match') == etag:
+                status, data = 304, b''
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        if etag is not None:
+            self.send_header('ETag', etag)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _route_dockerhub(self, method, segments, query, body):
+        state = self.state
+
+        if method == 'POST' and segments == ['auth', 'token']:
+            with state._lock:
+                return 200, {'access_token': state.issue_token()}
+
+        token = (self.headers.get('Authorization') or '').partition('Bearer ')[2]
+        with state._lock:
+            if state.tokens.get(token, 0) < time.time():
+                return 401, {'message': 'authentication required'}
+
+        if segments[:1] == ['repositories'] and len(segments) >= 3 and segments[1] == state.namespace:
+            repo = segments[2]
+            with state._lock:
+                tags = state.dockerhub_tags.get(repo)
+                if tags is None:
+                    return 404, {'message': 'repository not found'}
+
+                if method == 'GET' and len(segments) == 3:
+                    return 200, {'name': repo, 'namespace': state.namespace}
+
+                if method == 'GET' and segments[3:] == ['tags']:
+                    page, page_size = int(query.get('page', 1)), int(query.get('page_size', 10))
+                    start = (page - 1) * page_size
+                    results = tags[start:start + page_size]
+                    has_next = start + page_size < len(tags)
+                    next_url = f'{self.path.split("?")[0]}?page={page + 1}&page_size={page_size}' if has_next else None
+                    return 200, {'count': len(tags), 'next': next_url, 'results': results}
+
+                if method == 'DELETE' and len(segments) == 5 and segments[3] == 'tags':
+                    for i, tag in enumerate(tags):
+                        if tag['name'] == segments[4]:
+                            del tags[i]
+                            return 204, None
+                    return 404, {'message': 'tag not found'}
+
+        if method == 'POST' and segments[:1] == ['namespaces'] and segments[2:] == ['delete-images']:
+            if not state.bulk_delete_enabled:
+                return 404, {'message': 'not found'}
+            return self._bulk_delete(body)
+
+        return 404, {'message': 'not found'}
+
+    def _bulk_delete(self, body):
+        state = self.state
+        acknowledged = {
+            (w['repository'], w['digest']): set(w.get('tags', []))
+            for w in body.get('ignore_warnings', []) if w.get('warning') == 'current_tag'
+        }
+
+        with state._lock:
+            warnings = []
+            for manifest in body['manifests']:
+                key = (manifest['repository'], manifest['digest'])
+                current = {t['name'] for t in state.dockerhub_tags.get(key[0], []) if t.get('digest') == key[1]}
+                if current and not current <= acknowledged.get(key, set()):
+                    warnings.append({'repository': key[0], 'digest': key[1], 'warning': 'current_tag',
+                                     'tags': sorted(current)})
+            if warnings:
+                return 400, {'errinfo': {'type': 'validation', 'details': {'warnings': warnings}}}
+
+            manifest_deletes = tag_deletes = 0
+            for manifest in body['manifests']:
+                tags = state.dockerhub_tags.get(manifest['repository'], [])
+                remaining = [t for t in tags if t.get('digest') != manifest['digest']]
+                tag_deletes += len(tags) - len(remaining)
+                manifest_deletes += 1
+                tags[:] = remaining
+
+        return 200, {'dry_run': body.get('dry_run', False), 'metrics': {
+            'manifest_deletes': manifest_deletes, 'manifest_errors': 0,
+            'tag_deletes': tag_deletes, 'tag_errors': 0,
+        }}
+
+    def _route_ghcr_registry(self, method, segments, query):
+        state = self.state
+
+        if method == 'GET' and segments == ['token']:
+            if not (self.headers.get('Authorization') or '').startswith('Basic '):
+                return 401, {'errors': [{'code': 'UNAUTHORIZED'}]}
+            with state._lock:
+                token = f'pull-{next(state._token_ids)}'
+                state.pull_tokens.add(token)
+            return 200, {'token': token}
+
+        token = (self.headers.get('Authorization') or '').partition('Bearer ')[2]
+        with state._lock:
+            if token not in state.pull_tokens:
+                return 401, {'errors': [{'code': 'UNAUTHORIZED'}]}
+
+            if method == 'GET' and segments[:1] == ['v2'] and segments[-2:-1] == ['manifests']:
+                manifest = state.ghcr_manifests.get(segments[-1])
+                if manifest is not None:
+                    return 200, manifest
+
+        return 404, {'errors': [{'code': 'MANIFEST_UNKNOWN'}]}
+
+    def _route_github(self, method, segments, query):
+        """Route a GitHub API request; returns (status, payload, Link header URLs by rel)."""
+        state = self.state
+
+        if not (self.headers.get('Authorization') or '').startswith('token '):
+            return 401, {'message': 'Requires authentication'}, None
+
+        if method == 'GET' and segments == ['user']:
+            return 200, {'login': state.namespace}, None
+
+        # Strip the owner: /user/... or /orgs/{org}/...
+        if segments[:1] == ['user']:
+            segments = segments[1:]
+        elif segments[:1] == ['orgs'] and len(segments) >= 2:
+            segments = segments[2:]
+        else:
+            return 404, {'message': 'Not Found'}, None
+
+        with state._lock:
+            if method == 'GET' and segments == ['packages']:
+                packages = [{'name': name, 'package_type': 'container'} for name in state.ghcr_versions]
+                return self._page(packages, query)
+
+            if segments[:2] != ['packages', 'container'] or len(segments) < 4 or segments[3] != 'versions':
+                return 404, {'message': 'Not Found'}, None
+
+            versions = state.ghcr_versions.get(segments[2])
+            if versions is None:
+                return 404, {'message': 'Package not found.'}, None
+
+            if method == 'GET' and len(segments) == 4:
+                return self._page(versions, query)
+
+            if method == 'DELETE' and len(segments) == 5:
+                for i, version in enumerate(versions):
+                    if str(version['id']) == segments[4]:
+                        del versions[i]
+                        return 204, None, None
+                return 404, {'message': 'Package version not found.'}, None
+
+        return 404, {'message': 'Not Found'}, None
+
+    def _page(self, items, query):
+        per_page, page = int(query.get('per_page', 30)), int(query.get('page', 1))
+        start = (page - 1) * per_page
+        links = {}
+        if start + per_page < len(items):
+            # Like GitHub, link the next and last pages while there are more
+            base_url = f'http://{self.headers["Host"]}{self.path.split("?")[0]}'
+            last_page = (len(items) + per_page - 1) // per_page
+            links['next'] = f'{base_url}?{urlencode(dict(query, page=page + 1))}'
+            links['last'] = f'{base_url}?{urlencode(dict(query, page=last_page))}'
+        return 200, items[start:start + per_page], links
@@ -15,6 +15,16 @@ from pathlib import Path
 # Get the script directory (parent of tests)
 script_dir = Path(__file__).parent.parent
 
+# Cumulative `python -X importtime` budget for `import main`, in microseconds
+IMPORT_TIME_BUDGET_US = 120000
+
+# Modules that must only be loaded once a registry is actually used
+LAZY_MODULES = ["requests", "dateutil", "registries.ghcr", "registries.dockerhub", "registries.transport"]
+
+# Credentials and endpoints cleared before replaying a cassette
+REPLAY_VARIABLES = ["GHCR_TOKEN", "DOCKER_USERNAME", "DOCKER_PASSWORD", "GITHUB_API_URL", "DOCKER_HUB_API_URL",
+                    "GHCR_REGISTRY_URL"]
+
 def run_command(cmd, env=None):
     """Run a command and return the result."""
     if env is None:
@@ -108,6 +118,25 @@ def test_mutually_exclusive_options():
     print("✅ Mutually exclusive options handled correctly")
     return True
 
+def test_invalid_concurrency():
+    """Test that a non-positive concurrency is rejected."""
+    print("Testing invalid concurrency handling...")
+
+    returncode, stdout, stderr = run_command(
+        "python3 main.py --container test --registry ghcr --prune-all-untagged --concurrency 0"
+    )
+
+    if returncode == 0:
+        print("❌ Command should have failed with --concurrency 0")
+        return False
+
+    if "concurrency" not in stderr:
+        print(f"❌ Expected concurrency error, got: {stderr}")
+        return False
+
+    print("✅ Invalid concurrency handled correctly")
+    return True
+
 def test_missing_required_args():
     """Test missing required arguments."""
     print("Testing missing required arguments...")
@@ -175,6 +204,153 @@ def test_version_info():
     print("✅ Version information accessible")
     return True
 
+def test_import_time():
+    """Test that importing the CLI stays within its import time budget."""
+    print("Testing import time...")
+
+    check = "import sys, main; print(*[m for m in %r if m in sys.modules])" % LAZY_MODULES
+    returncode, stdout, stderr = run_command(f'python3 -c "{check}"')
+    if returncode != 0 or stdout.strip():
+        print(f"❌ Modules imported eagerly: {stdout.strip() or stderr}")
+        return False
+
+    # Best of three runs, so a busy machine doesn't fail the check
+    timings = []
+    for _ in range(3):
+        returncode, stdout, stderr = run_command("python3 -X importtime -c 'import main'")
+        lines = [line for line in stderr.splitlines() if line.rstrip().endswith("| main")]
+        if returncode != 0 or not lines:
+            print(f"❌ Could not measure import time: {stderr}")
+            return False
+        timings.append(int(lines[-1].split("|")[1]))
+
+    if min(timings) > IMPORT_TIME_BUDGET_US:
+        print(f"❌ Importing main took {min(timings) / 1000:.0f}ms (budget {IMPORT_TIME_BUDGET_US / 1000:.0f}ms)")
+        return False
+
+    print(f"✅ Importing main took {min(timings) / 1000:.0f}ms")
+    return True
+
+def test_record_replay():
+    """Test that a recorded prune replays offline, without credentials, and catches changed requests."""
+    print("Testing record and replay...")
+
+    sys.path.insert(0, str(script_dir))
+    from tests.fake_registry import FakeRegistry
+
+    clean_env = {k: v for k, v in os.environ.items() if k not in REPLAY_VARIABLES}
+    args = "--container app --registry all --keep-latest 10 --concurrency 4"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cassette = os.path.join(tmp, "prune.cassette.json")
+
+        with FakeRegistry("replayuser", latency=0.005) as server:
+            server.seed_ghcr("app", 300)
+            server.seed_dockerhub_synthetic("app", 100)
+            env = dict(clean_env, GHCR_TOKEN="ghcr-secret", DOCKER_USERNAME="replayuser",
+                       DOCKER_PASSWORD="hub-secret", GITHUB_API_URL=server.url,
+                       DOCKER_HUB_API_URL=f"{server.url}/v2", PRUNE_CACHE_DIR=tmp)
+            returncode, stdout, stderr = run_command(f"python3 main.py {args} --record {cassette}", env=env)
+            sent = sum(server.request_counts().values())
+            tokens = list(server.tokens)
+
+        if returncode != 0 or f"Recorded {sent} HTTP requests" not in stdout:
+            print(f"❌ Recording failed ({sent} requests sent): {stdout}{stderr}")
+            return False
+
+        with open(cassette, encoding="utf-8") as f:
+            recorded = f.read()
+        leaked = [secret for secret in ["ghcr-secret", "hub-secret", *tokens] if secret in recorded]
+        if leaked:
+            print(f"❌ Cassette contains credentials: {leaked}")
+            return False
+
+        # The server is gone and no credentials are set
+        returncode, stdout, stderr = run_command(
+            f"python3 main.py {args} --replay {cassette} --replay-speed 0", env=clean_env)
+        if returncode != 0 or f"Replayed {sent} of {sent} recorded HTTP requests" not in stdout:
+            print(f"❌ Replay failed: {stdout}{stderr}")
+            return False
+
+        # Keeping more versions sends fewer deletes than were recorded
+        returncode, stdout, stderr = run_command(
+            f"python3 main.py {args.replace('10', '20')} --replay {cassette} --replay-speed 0", env=clean_env)
+        if returncode == 0 or "unsent" not in stderr:
+            print(f"❌ Replay with changed requests should have failed: {stdout}{stderr}")
+            return False
+
+    print(f"✅ Recorded and replayed {sent} requests offline")
+    return True
+
+def test_plan_apply():
+    """Test that --plan-out deletes nothing and --apply deletes the plan once, refusing it when stale."""
+    print("Testing plan and apply...")
+
+    sys.path.insert(0, str(script_dir))
+    from tests.fake_registry import FakeRegistry
+
+    clean_env = {k: v for k, v in os.environ.items() if k not in REPLAY_VARIABLES}
+
+    with tempfile.TemporaryDirectory() as tmp, FakeRegistry("planuser") as server:
+        server.seed_ghcr("app", 120)
+        server.seed_dockerhub_synthetic("app", 60)
+        env = dict(clean_env, GHCR_TOKEN="token", DOCKER_USERNAME="planuser", DOCKER_PASSWORD="password",
+                   GITHUB_API_URL=server.url, DOCKER_HUB_API_URL=f"{server.url}/v2", PRUNE_CACHE_DIR=tmp)
+        plan = os.path.join(tmp, "plan.json")
+
+        returncode, stdout, stderr = run_command(
+            f"python3 main.py --container app --registry all --keep-latest 10 --plan-out {plan}", env=env)
+        if returncode != 0 or "Wrote a plan to delete 160 images" not in stdout or server.count("DELETE"):
+            print(f"❌ Planning failed: {stdout}{stderr}")
+            return False
+
+        returncode, stdout, stderr = run_command(f"python3 main.py --apply {plan} --concurrency 4", env=env)
+        remaining = (len(server.ghcr_versions["app"]), len(server.dockerhub_tags["app"]))
+        if returncode != 0 or "160 images were deleted" not in stdout or remaining != (10, 10):
+            print(f"❌ Applying the plan failed ({remaining} left): {stdout}{stderr}")
+            return False
+
+        # Everything planned is gone, so the inventory no longer matches
+        returncode, stdout, stderr = run_command(f"python3 main.py --apply {plan}", env=env)
+        if returncode == 0 or "The plan is stale" not in stdout:
+            print(f"❌ Applying a stale plan should have failed: {stdout}{stderr}")
+            return False
+
+    print("✅ Planned, applied and refused a stale plan")
+    return True
+
+def test_follow_references():
+    """Test that --follow-references keeps multi-platform images whole and reuses cached manifest references."""
+    print("Testing manifest references...")
+
+    sys.path.insert(0, str(script_dir))
+    from tests.fake_registry import FakeRegistry
+
+    clean_env = {k: v for k, v in os.environ.items() if k not in REPLAY_VARIABLES}
+
+    with tempfile.TemporaryDirectory() as tmp, FakeRegistry("refuser") as server:
+        server.seed_ghcr_multiarch("app", 4)
+        env = dict(clean_env, GHCR_TOKEN="token", GITHUB_API_URL=server.url, GHCR_REGISTRY_URL=f"{server.url}/ghcr",
+                   PRUNE_CACHE_DIR=tmp)
+        args = "--container app --registry ghcr --keep-latest 2 --follow-references"
+
+        # Keeping 2 images keeps their 4 platform and attestation manifests each
+        returncode, stdout, stderr = run_command(f"python3 main.py {args} --dry-run", env=env)
+        fetched = server.count("GET", "/ghcr/v2/")
+        if returncode != 0 or "10 planned" not in stdout or fetched != 4:
+            print(f"❌ Planning with references failed ({fetched} manifests fetched): {stdout}{stderr}")
+            return False
+
+        returncode, stdout, stderr = run_command(f"python3 main.py {args}", env=env)
+        tags = [tag for v in server.ghcr_versions["app"] for tag in v["metadata"]["container"]["tags"]]
+        if (returncode != 0 or len(server.ghcr_versions["app"]) != 10 or tags != ["build-0", "build-1"]
+                or server.count("GET", "/ghcr/v2/") != fetched):
+            print(f"❌ Pruning with references failed: {stdout}{stderr}")
+            return False
+
+    print("✅ Kept multi-platform images whole and reused cached manifest references")
+    return True
+
 def main():
     """Run integration tests."""
     print("Running integration tests for prune script...\n")
@@ -182,11 +358,16 @@ def main():
     tests = [
         test_import_structure,
         test_version_info,
+        test_import_time,
         test_help_output,
         test_missing_credentials,
         test_invalid_registry,
         test_mutually_exclusive_options,
+        test_invalid_concurrency,
         test_missing_required_args,
+        test_record_replay,
+        test_plan_apply,
+        test_follow_references,
     ]
 
     passed = 0
@@ -13,17 +13,41 @@ This test suite covers:
 import unittest
 import sys
 import os
+import random
+import time
+import itertools
+import tempfile
+import json
 from unittest.mock import Mock, patch, MagicMock
 from datetime import datetime, timedelta
 from io import StringIO
 
+import requests
+
 # Add the parent directory to the Python path
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from registries.base import ImageVersion, BaseRegistry
-from strategies import PruneUntaggedByAge, PruneAllUntagged, KeepLatestCount
+from registries.base import ImageVersion, BaseRegistry, RegistryError, parse_timestamp
+from strategies import PruneUntaggedByAge, PruneAllUntagged, KeepLatestCount, KeepLatestPerGroup
+from policy import PolicyError, compile_policy, load_policy_file
+import table as version_table
+from graph import ManifestFetcher, ReferenceAwareStrategy, ReferenceCache
+from table import VersionTable
 from registries.factory import create_registry, create_all_registries
+from registries.dockerhub import DockerHubRegistry
+from registries.ghcr import GHCRRegistry
+from registries.cache import HttpCache
+from registries.http import HttpClient
+from registries.ratelimit import RateLimitScheduler
+from registries.retry import RetryBudget, RetryPolicy
+from registries.metrics import Metrics
+from registries.tokens import TokenCache, jwt_expiry
+from registries.transport import Cassette, ReplayError
 import main
+from output import JsonLinesOutput
+from plan import load_plan, write_plan, PlanEntry
+from tests.fake_registry import FakeRegistry
+from benchmarks import memory as memory_benchmark
 
 
 class TestImageVersion(unittest.TestCase):
@@ -36,13 +60,13 @@ class TestImageVersion(unittest.TestCase):
         """Test a tagged image."""
         version = ImageVersion("v1", "test", self.now, ["latest", "v1.0"])
         self.assertTrue(version.is_tagged)
-        self.assertEqual(version.tags, ["latest", "v1.0"])
+        self.assertEqual(version.tags, ("latest", "v1.0"))
 
     def test_untagged_image(self):
         """Test an untagged image."""
         version = ImageVersion("v2", "test", self.now, [])
         self.assertFalse(version.is_tagged)
-        self.assertEqual(version.tags, [])
+        self.assertEqual(version.tags, ())
 
     def test_metadata(self):
         """Test image with metadata."""
@@ -51,6 +75,26 @@ class TestImageVersion(unittest.TestCase):
         self.assertEqual(version.metadata["size"], 100)
         self.assertEqual(version.metadata["digest"], "sha256:abc123")
 
+    def test_compact_fields(self):
+        """Test that versions are slotted and store the creation time as an epoch."""
+        version = ImageVersion("v4", "test", self.now, ["dev"], digest="sha256:abc", size=42)
+        self.assertFalse(hasattr(version, "__dict__"))
+        self.assertEqual(version.created_ts, int(self.now.timestamp()))
+        self.assertEqual(version.created_at, self.now.replace(microsecond=0))
+        self.assertIsNone(ImageVersion("v5", "test", 0, []).metadata)
+
+    def test_parse_timestamp(self):
+        """Test that registry timestamps parse to epoch seconds without dateutil."""
+        self.assertEqual(parse_timestamp('2024-01-01T00:00:00Z'), 1704067200)
+        self.assertEqual(parse_timestamp('2024-01-01T00:00:00.123456Z'), 1704067200)
+        self.assertEqual(parse_timestamp('2024-01-01T02:00:00+02:00'), 1704067200)
+        self.assertEqual(parse_timestamp('2024-01-01T00:00:00'), 1704067200)
+
+    def test_memory_per_version(self):
+        """Test that slotted versions hold several times less memory than payload-keeping ones."""
+        results = memory_benchmark.run(1000)
+        self.assertGreater(results['payload'] / results['slotted'], 3)
+
 
 class TestPruningStrategies(unittest.TestCase):
     """Test the pruning strategies."""
@@ -124,6 +168,306 @@ class TestPruningStrategies(unittest.TestCase):
         to_delete = [v for v in self.versions if strategy.should_delete(v, self.versions)]
         self.assertEqual(len(to_delete), 4)  # Should keep only the newest
 
+    def test_select_matches_should_delete(self):
+        """Test that the batch selection and the per-version shim both pick the expected versions."""
+        # Expected deletions worked out by hand from the fixture's ages and tags
+        cases = [
+            (PruneUntaggedByAge(10), ["v2"]),
+            (PruneAllUntagged(), ["v2", "v4"]),
+            (KeepLatestCount(3), ["v1", "v2"]),
+            (KeepLatestCount(0), ["v1", "v2", "v3", "v4", "v5"]),
+        ]
+
+        for strategy, expected in cases:
+            with self.subTest(strategy=strategy.get_description()):
+                self.assertEqual([v.id for v in strategy.select(self.versions)], expected)
+                shim = [v.id for v in self.versions if strategy.should_delete(v, self.versions)]
+                self.assertEqual(shim, expected)
+
+    def test_keep_latest_count_select_large_inventory(self):
+        """Test that keep latest selects in one pass over a large inventory."""
+        versions = [
+            ImageVersion(f"id{i}", f"v{i}", self.now - timedelta(minutes=i), [])
+            for i in range(20000)
+        ]
+        strategy = KeepLatestCount(25)
+
+        to_delete = strategy.select(versions)
+
+        self.assertEqual(len(to_delete), 20000 - 25)
+        self.assertEqual(to_delete[0].id, "id25")
+        self.assertEqual(to_delete[-1].id, "id19999")
+
+    def test_keep_latest_per_group_semver(self):
+        """Test keeping the latest N images of each major.minor release line."""
+        versions = [
+            ImageVersion("a", "n", self.now - timedelta(days=1), ["v1.2.3", "1.2"]),
+            ImageVersion("b", "n", self.now - timedelta(days=2), ["v1.2.2"]),
+            ImageVersion("c", "n", self.now - timedelta(days=3), ["v1.2.1"]),
+            ImageVersion("d", "n", self.now - timedelta(days=4), ["v1.1.9", "latest"]),
+            ImageVersion("e", "n", self.now - timedelta(days=5), ["1.1.8-rc.1"]),
+            ImageVersion("f", "n", self.now - timedelta(days=6), ["main"]),
+            ImageVersion("g", "n", self.now - timedelta(days=7), []),
+        ]
+        strategy = KeepLatestPerGroup(1)
+
+        # "a" is the newest 1.2 once, despite having two 1.2 tags; "f" and "g" are in no group
+        self.assertEqual([v.id for v in strategy.select(versions)], ["b", "c", "e"])
+        self.assertIn("semver", strategy.get_description())
+        self.assertEqual(KeepLatestPerGroup(2).select(versions), [versions[2]])
+        self.assertEqual([v.id for v in KeepLatestPerGroup(0).select(versions)], ["a", "b", "c", "d", "e"])
+
+    def test_keep_latest_per_group_regex(self):
+        """Test grouping by a regular expression's capture groups."""
+        versions = [
+            ImageVersion("a", "n", self.now - timedelta(days=1), ["sha-1111"]),
+            ImageVersion("b", "n", self.now - timedelta(days=2), ["sha-2222", "pr-7"]),
+            ImageVersion("c", "n", self.now - timedelta(days=3), ["sha-3333", "pr-8"]),
+            ImageVersion("d", "n", self.now - timedelta(days=4), ["pr-7"]),
+        ]
+
+        # "b" and "c" are old sha images but the newest pr-7 and pr-8
+        strategy = KeepLatestPerGroup(1, r"^(sha|pr-\d+)")
+        self.assertEqual([v.id for v in strategy.select(versions)], ["d"])
+        # Without capture groups the whole match is the key
+        self.assertEqual([v.id for v in KeepLatestPerGroup(1, "^sha-").select(versions)], ["b", "c"])
+
+        with self.assertRaisesRegex(ValueError, "Invalid group regular expression"):
+            KeepLatestPerGroup(1, "(sha")
+        with self.assertRaisesRegex(ValueError, "not 5"):
+            KeepLatestPerGroup(1, 5)
+
+    def test_keep_latest_per_group_shared_ids(self):
+        """Test that the Docker Hub tags of one digest are kept or deleted as one image."""
+        versions = [
+            ImageVersion("sha256:a", "v1.2.3", self.now - timedelta(days=1), ["v1.2.3"]),
+            ImageVersion("sha256:b", "v1.2.2", self.now - timedelta(days=2), ["v1.2.2"]),
+            ImageVersion("sha256:a", "1.2", self.now - timedelta(days=3), ["1.2"]),
+            ImageVersion("sha256:c", "v1.1.0", self.now - timedelta(days=4), ["v1.1.0"]),
+            ImageVersion("sha256:b", "main", self.now - timedelta(days=5), ["main"]),
+        ]
+
+        # The old "1.2" row is the newest 1.2 image through "v1.2.3"; "main" goes with "v1.2.2"
+        self.assertEqual([v.name for v in KeepLatestPerGroup(1).select(versions)], ["v1.2.2", "main"])
+        self.assertEqual(KeepLatestPerGroup(2).select(versions), [])
+
+    def test_keep_latest_per_group_many_groups(self):
+        """Test that each of thousands of groups keeps its own latest images in one pass."""
+        versions = [
+            ImageVersion(f"id{i}", "n", self.now - timedelta(minutes=i), [f"branch{i % 3000}-{i}"])
+            for i in range(12000)
+        ]
+        strategy = KeepLatestPerGroup(2, r"^(branch\d+)-")
+
+        to_delete = strategy.select(versions)
+
+        # Every group has 4 images; the 2 listed first are the newest
+        self.assertEqual(len(to_delete), 6000)
+        self.assertEqual(to_delete[0].id, "id6000")
+        self.assertEqual(to_delete[-1].id, "id11999")
+
+
+class TestRetentionPolicy(unittest.TestCase):
+    """Test retention policy expressions and policy files."""
+
+    def setUp(self):
+        self.now = datetime.now().astimezone()
+        self.versions = [
+            ImageVersion("v1", "old-release", self.now - timedelta(days=30), ["v1.0"]),
+            ImageVersion("v2", "old-untagged", self.now - timedelta(days=20), []),
+            ImageVersion("v3", "recent-tagged", self.now - timedelta(days=5), ["latest"]),
+            ImageVersion("v4", "recent-untagged", self.now - timedelta(days=2), []),
+            ImageVersion("v5", "newest", self.now - timedelta(hours=1), ["dev"]),
+        ]
+
+    def deleted(self, policy):
+        return [v.id for v in policy.select(self.versions)]
+
+    def test_combined_terms(self):
+        """Test that terms combine with or/and/not and everything not kept is deleted."""
+        policy = compile_policy('latest 1 or tag "v*" or (untagged and age < 3d)')
+
+        self.assertEqual(self.deleted(policy), ["v2", "v3"])
+        self.assertTrue(policy.needs_inventory)
+
+    def test_matches_builtin_strategies(self):
+        """Test that policies equivalent to the built-in strategies select the same versions."""
+        versions = [ImageVersion(f"v{i}", "n", self.now - timedelta(hours=i % 7), [] if i % 3 else [f"t{i}"])
+                    for i in range(200)]
+        pairs = [
+            (compile_policy('latest 10'), KeepLatestCount(10)),
+            (compile_policy('tagged'), PruneAllUntagged()),
+            (compile_policy('not (untagged and age > 3h)'), PruneUntaggedByAge(3 / 24)),
+        ]
+        for policy, strategy in pairs:
+            self.assertEqual([v.id for v in policy.select(versions)], [v.id for v in strategy.select(versions)],
+                             policy.source)
+
+    def test_tag_matchers(self):
+        """Test glob and regex tag terms, including a regex that can't join the combined alternation."""
+        self.assertEqual(self.deleted(compile_policy('tag ~ "^v[0-9]" or tag "lat*"')), ["v2", "v4", "v5"])
+        self.assertEqual(self.deleted(compile_policy('tag ~ "(?i)^DEV$"')), ["v1", "v2", "v3", "v4"])
+
+    def test_protected_tags_are_kept(self):
+        """Test that protected tags override the expression."""
+        policy = compile_policy('untagged', protect=["latest", "d*"])
+
+        self.assertEqual(self.deleted(policy), ["v1"])
+        self.assertIn("protected tags: latest, d*", policy.get_description())
+
+    def test_shared_ids_are_one_image(self):
+        """Test that rows sharing an ID (Docker Hub tags of one digest) are ranked and kept together."""
+        versions = [
+            ImageVersion("sha256:a", "sha-1", self.now - timedelta(days=1), ["sha-1"]),
+            ImageVersion("sha256:b", "sha-2", self.now - timedelta(days=2), ["sha-2"]),
+            ImageVersion("sha256:a", "v1.0", self.now - timedelta(days=9), ["v1.0"]),
+            ImageVersion("sha256:c", "sha-3", self.now - timedelta(days=3), ["sha-3"]),
+            ImageVersion("sha256:d", "v0.9", self.now - timedelta(days=20), ["v0.9"]),
+        ]
+        cases = [
+            # "v1.0" keeps the image its newer "sha-1" tag also points at
+            ('tag "v1*"', ["sha-2", "sha-3", "v0.9"]),
+            # sha256:a is one image, so the 2 latest are sha256:a and sha256:b
+            ('latest 2', ["sha-3", "v0.9"]),
+            ('rank <= 3', ["v0.9"]),
+        ]
+        for source, expected in cases:
+            policy = compile_policy(source)
+            with self.subTest(policy=source):
+                deleted = policy.select(versions)
+                self.assertEqual([v.name for v in deleted], expected)
+                for use_numpy in TestVersionTable.BACKENDS:
+                    self.assertEqual(policy.select_table(VersionTable(versions, use_numpy=use_numpy)), deleted)
+
+    def test_invalid_policies(self):
+        """Test that malformed expressions are rejected with a PolicyError."""
+        for source in ['', 'latest', 'latest 2.5', 'tag v*', 'age < 3y', 'rank ~ 3', '(tagged', 'tagged or',
+                       'newest 3', 'tag ~ "("']:
+            with self.assertRaises(PolicyError, msg=source):
+                compile_policy(source)
+
+    def test_policy_files(self):
+        """Test that JSON and YAML policy files OR their keep expressions together."""
+        with tempfile.TemporaryDirectory() as tmp:
+            json_path = os.path.join(tmp, 'policy.json')
+            with open(json_path, 'w', encoding='utf-8') as f:
+                json.dump({'keep': ['latest 1', 'tag "v*"'], 'protect': ['latest']}, f)
+            self.assertEqual(self.deleted(load_policy_file(json_path)), ["v2", "v4"])
+
+            yaml_path = os.path.join(tmp, 'policy.yaml')
+            with open(yaml_path, 'w', encoding='utf-8') as f:
+                f.write('keep:\n  - latest 1\n  - untagged and age < 3d\n')
+            try:
+                import yaml  # noqa: F401
+            except ImportError:
+                with self.assertRaises(PolicyError):
+                    load_policy_file(yaml_path)
+            else:
+                self.assertEqual(self.deleted(load_policy_file(yaml_path)), ["v1", "v2", "v3"])
+
+            with open(json_path, 'w', encoding='utf-8') as f:
+                json.dump({'keep': 'latest 1', 'delete': 'untagged'}, f)
+            with self.assertRaises(PolicyError):
+                load_policy_file(json_path)
+
+
+class TestVersionTable(unittest.TestCase):
+    """Test the columnar inventory and strategies evaluated on it."""
+
+    BACKENDS = [False] + ([True] if version_table.np is not None else [])
+
+    def setUp(self):
+        rng = random.Random(7)
+        now = int(time.time())
+        self.versions = [
+            ImageVersion(f"id{i}", "n", now - rng.randrange(40) * 86400,
+                         [] if i % 3 else [rng.choice(["v1.0", "v2.0", "latest", "dev-1", "dev-2"])],
+                         digest=f"sha256:{i // 2}")
+            for i in range(500)
+        ]
+
+    def test_columns(self):
+        """Test the creation time, tag and version ID group columns."""
+        versions = [
+            ImageVersion("sha256:1", "x", 100, ["x", "y"], digest="sha256:1"),
+            ImageVersion("sha256:1", "z", 200, [], digest="sha256:1"),
+            ImageVersion("c", "n", 300, ["y"]),
+        ]
+        for use_numpy in self.BACKENDS:
+            with self.subTest(numpy=use_numpy):
+                table = VersionTable(versions, use_numpy=use_numpy)
+                self.assertEqual(list(table.created), [100, 200, 300])
+                self.assertEqual(table.pick(table.tagged), [versions[0], versions[2]])
+                self.assertEqual(table.tags, ["x", "y"])
+                self.assertEqual(list(zip(table.tag_rows, table.tag_ids)), [(0, 0), (0, 1), (2, 1)])
+                self.assertEqual(list(table.groups), [0, 0, 1])
+                self.assertEqual(table.ids, ["sha256:1", "c"])
+                self.assertEqual(list(table.group_created), [200, 300])
+
+    def test_strategies_match_select(self):
+        """Test that every strategy picks the same versions from a table as from the list."""
+        strategies = [
+            PruneUntaggedByAge(10.5), PruneAllUntagged(), KeepLatestCount(0), KeepLatestCount(40),
+            KeepLatestCount(1000),
+            compile_policy('latest 25 or tag "v*" or (untagged and age < 3d)', protect=["dev-2"]),
+            compile_policy('rank > 10 and not tag ~ "^dev-" or rank <= 3'),
+            compile_policy('age >= 2.5d and (tagged or rank >= 100)'),
+            KeepLatestPerGroup(3), KeepLatestPerGroup(5, r"^(dev)-|^v"), KeepLatestPerGroup(0, "."),
+        ]
+        for use_numpy in self.BACKENDS:
+            table = VersionTable(self.versions, use_numpy=use_numpy)
+            for strategy in strategies:
+                with self.subTest(numpy=use_numpy, strategy=strategy.get_description()):
+                    self.assertEqual(strategy.select_table(table), strategy.select(self.versions))
+
+    def test_shared_ids_match_select(self):
+        """Test that rows sharing an ID (Docker Hub tags of one digest) are ranked and kept as one image."""
+        rng = random.Random(11)
+        versions = [
+            ImageVersion(f"sha256:{i % 40}", f"tag-{i}", 1000 + rng.randrange(60), [f"tag-{i}"],
+                         digest=f"sha256:{i % 40}")
+            for i in range(200)
+        ]
+        # The tag pushed last points at an image with older tags too
+        versions.insert(0, ImageVersion("sha256:7", "latest", 2000, ["latest"], digest="sha256:7"))
+        strategies = [KeepLatestCount(count) for count in (0, 1, 5, 39, 40, 500)]
+        for use_numpy in self.BACKENDS:
+            table = VersionTable(versions, use_numpy=use_numpy)
+            for strategy in [KeepLatestPerGroup(2, r"^tag-\d"), KeepLatestPerGroup(1, r"^tag-(\d)")]:
+                with self.subTest(numpy=use_numpy, strategy=strategy.get_description()):
+                    deleted = strategy.select(versions)
+                    self.assertEqual(strategy.select_table(table), deleted)
+                    self.assertFalse({v.id for v in deleted} & {v.id for v in versions if v not in deleted})
+            for strategy in strategies:
+                with self.subTest(numpy=use_numpy, count=strategy.count):
+                    deleted = strategy.select(versions)
+                    self.assertEqual(strategy.select_table(table), deleted)
+                    deleted_ids = {v.id for v in deleted}
+                    # An ID is deleted with every row or none
+                    self.assertFalse(deleted_ids & {v.id for v in versions if v not in deleted})
+                    self.assertEqual(len({v.id for v in versions} - deleted_ids), min(strategy.count, 40))
+                    if strategy.count:
+                        self.assertNotIn("sha256:7", deleted_ids)
+
+    def test_planning_builds_table_only_when_preferred(self):
+        """Test that prune_registry plans on a table for the strategies that prefer one, and on the list otherwise."""
+        cases = [(PruneAllUntagged(), 0), (PruneUntaggedByAge(10), 0), (KeepLatestCount(5), 0),
+                 (KeepLatestPerGroup(1), 1), (compile_policy('latest 5 or tagged'), 1)]
+        for strategy, tables in cases:
+            with self.subTest(strategy=strategy.get_description()):
+                registry = MockRegistry("Mock", self.versions)
+                with patch('table.VersionTable', wraps=VersionTable) as table_class:
+                    main.prune_registry(registry, strategy, dry_run=True, out=StringIO())
+                self.assertEqual(table_class.call_count, tables)
+
+    def test_newest_keeps_first_listed_ties(self):
+        """Test that of versions created at the same time, the first listed are the newest."""
+        versions = [ImageVersion(f"id{i}", "n", 1000 if i % 2 else 500, []) for i in range(10)]
+        for use_numpy in self.BACKENDS:
+            with self.subTest(numpy=use_numpy):
+                table = VersionTable(versions, use_numpy=use_numpy)
+                self.assertEqual([v.id for v in table.pick(table.newest(3))], ["id1", "id3", "id5"])
+
 
 class MockRegistry(BaseRegistry):
     """Mock registry for testing."""
@@ -193,6 +537,996 @@ class TestRegistryFactory(unittest.TestCase):
         self.assertIn("Docker Hub", registry_names)
 
 
+class TestDockerHubTagIndex(unittest.TestCase):
+    """Test the Docker Hub ID to tag name index."""
+
+    def setUp(self):
+        self.registry = DockerHubRegistry('testuser', 'testpass', 'test-container')
+        self.registry._auth.token = 'jwt'
+        self.tags_page = {
+            'next': None,
+            'results': [
+                {'name': 'latest', 'digest': 'sha256:aaa', 'last_updated': '2024-01-03T00:00:00Z', 'tag_status': 'active'},
+                {'name': 'sha-aaa', 'digest': 'sha256:aaa', 'last_updated': '2024-01-02T00:00:00Z'},
+                {'name': 'sha-bbb', 'digest': 'sha256:bbb', 'last_updated': '2024-01-01T00:00:00Z'},
+            ],
+        }
+
+    def _mock_session(self, mock_session_cls):
+        sess = mock_session_cls.return_value
+        self.requests = []
+
+        def request(method, url, **kwargs):
+            self.requests.append((method, url))
+            if method == 'DELETE':
+                return Mock(status_code=204, raise_for_status=Mock())
+            return Mock(status_code=200, json=Mock(return_value=self.tags_page))
+
+        sess.request.side_effect = request
+        return sess
+
+    def _calls(self, method):
+        return [url for m, url in self.requests if m == method]
+
+    @patch('requests.Session')
+    def test_delete_uses_index_without_relisting(self, mock_session_cls):
+        """Test that deletes resolve tag names from the listing index."""
+        self._mock_session(mock_session_cls)
+
+        self.registry.list_versions()
+        list_calls = len(self._calls('GET'))
+
+        self.assertTrue(self.registry.delete_version('sha256:bbb'))
+        self.assertTrue(self.registry.delete_version('sha256:aaa'))
+        self.assertTrue(self.registry.delete_version('sha256:aaa'))
+
+        self.assertEqual(len(self._calls('GET')), list_calls)
+        deleted = [url.rstrip('/').rsplit('/', 1)[-1] for url in self._calls('DELETE')]
+        self.assertEqual(deleted, ['sha-bbb', 'latest', 'sha-aaa'])
+
+        # Every tag for the digest is gone
+        self.assertFalse(self.registry.delete_version('sha256:aaa'))
+
+    @patch('requests.Session')
+    def test_delete_uses_planned_tag_name(self, mock_session_cls):
+        """Test that a digest's tags are deleted by the names the plan chose, not in listing order."""
+        self._mock_session(mock_session_cls)
+        versions = self.registry.list_versions()
+        planned = [v for v in versions if v.name != 'latest']
+
+        results = list(self.registry.delete_versions([v.id for v in planned], names=[v.name for v in planned]))
+
+        self.assertTrue(all(r.success for r in results))
+        # sha-bbb's digest has no other tag and is bulk deleted; "latest" keeps sha256:aaa
+        deleted = [url.rstrip('/').rsplit('/', 1)[-1] for url in self._calls('DELETE')]
+        self.assertEqual(deleted, ['sha-aaa'])
+        self.assertEqual(len(self._calls('POST')), 1)
+        # The tag was deleted already
+        self.assertFalse(self.registry.delete_version('sha256:aaa', 'sha-aaa'))
+
+    @patch('requests.Session')
+    def test_invalidate_index_relists(self, mock_session_cls):
+        """Test that an invalidated index is rebuilt on the next delete."""
+        self._mock_session(mock_session_cls)
+
+        self.registry.list_versions()
+        self.registry.invalidate_index()
+        # No digest is bulk deleted on the forgotten index
+        self.assertFalse(self.registry._index_complete)
+        list_calls = len(self._calls('GET'))
+
+        self.assertTrue(self.registry.delete_version('sha256:bbb'))
+        self.assertGreater(len(self._calls('GET')), list_calls)
+
+
+class TestDockerHubBulkDelete(unittest.TestCase):
+    """Test batched deletes against the local stand-in registry server."""
+
+    def setUp(self):
+        self.server = FakeRegistry('testuser').start()
+        self.addCleanup(self.server.stop)
+        tags = [
+            {'name': f'sha-{i:04d}', 'digest': f'sha256:{i:064x}', 'last_updated': '2024-01-01T00:00:00Z'}
+            for i in range(250)
+        ]
+        # "latest" shares a digest with sha-0000 and one of the two tags is kept
+        tags.insert(0, {'name': 'latest', 'digest': f'sha256:{0:064x}', 'last_updated': '2024-01-02T00:00:00Z',
+                        'tag_status': 'active'})
+        self.server.seed_dockerhub('test-container', tags)
+
+        self.registry = DockerHubRegistry('testuser', 'testpass', 'test-container')
+        self.registry.DOCKER_HUB_API = f'{self.server.url}/v2'
+        self.addCleanup(self.registry.close)
+
+    def _delete_all_but_latest(self):
+        versions = self.registry.list_versions()
+        planned = [v for v in versions if v.name != 'latest']
+        ids = [v.id for v in planned]
+        return ids, list(self.registry.delete_versions(ids, concurrency=4, names=[v.name for v in planned]))
+
+    def test_bulk_delete_in_chunks(self):
+        """Test that fully deleted digests go out in chunked bulk requests."""
+        ids, results = self._delete_all_but_latest()
+
+        self.assertEqual([r.version_id for r in results], ids)
+        self.assertTrue(all(r.success for r in results))
+        self.assertEqual(self.server.count('POST', '/v2/namespaces/testuser/delete-images'), 3)
+        # The digest shared with the kept tag is deleted by tag name, never as a manifest
+        self.assertEqual(self.server.count('DELETE'), 1)
+        remaining = self.server.dockerhub_tags['test-container']
+        self.assertEqual([(t['name'], t['digest']) for t in remaining], [('latest', f'sha256:{0:064x}')])
+
+    def test_no_bulk_delete_while_listing(self):
+        """Test that a digest isn't bulk deleted before the listing has seen all of its tags."""
+        # A second tag of sha-0001's digest is on the second page
+        self.server.dockerhub_tags['test-container'].insert(150, {
+            'name': 'keep', 'digest': f'sha256:{1:064x}', 'last_updated': '2024-01-01T00:00:00Z'})
+        listing = self.registry.iter_versions()
+        first_page = [next(listing) for _ in range(100)]
+        planned = [v for v in first_page if v.name == 'sha-0001']
+
+        results = list(self.registry.delete_versions([v.id for v in planned], names=[v.name for v in planned]))
+
+        self.assertTrue(results[0].success)
+        self.assertEqual(self.server.count('POST', '/v2/namespaces/'), 0)
+        names = [t['name'] for t in self.server.dockerhub_tags['test-container']]
+        self.assertIn('keep', names)
+        self.assertNotIn('sha-0001', names)
+
+    def test_falls_back_without_bulk_api(self):
+        """Test that registries without the bulk endpoint delete tag by tag."""
+        self.server.bulk_delete_enabled = False
+
+        ids, results = self._delete_all_but_latest()
+
+        self.assertTrue(all(r.success for r in results))
+        self.assertEqual(self.server.count('POST', '/v2/namespaces/'), 1)
+        self.assertEqual(self.server.count('DELETE'), 250)
+        self.assertEqual(len(self.server.dockerhub_tags['test-container']), 1)
+
+    def test_default_delete_versions_loops(self):
+        """Test the base implementation for registries without a bulk API."""
+        registry = MockRegistry("Test Registry")
+
+        results = list(registry.delete_versions(["a", "b", "c"], concurrency=2))
+
+        self.assertEqual([(r.version_id, r.success) for r in results], [("a", True), ("b", True), ("c", True)])
+        self.assertEqual(sorted(registry._deleted_versions), ["a", "b", "c"])
+
+
+class TestDockerHubAuthToken(unittest.TestCase):
+    """Test that Docker Hub logins are cached across runs and renewed mid-run."""
+
+    def setUp(self):
+        self.server = FakeRegistry('testuser').start()
+        self.addCleanup(self.server.stop)
+        self.server.seed_dockerhub('test-container', [
+            {'name': f'v{i}', 'digest': f'sha256:{i:064x}', 'last_updated': '2024-01-01T00:00:00Z'}
+            for i in range(250)
+        ])
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'tokens.json')
+
+    def _registry(self, tokens=None):
+        registry = DockerHubRegistry('testuser', 'testpass', 'test-container', tokens=tokens)
+        registry.DOCKER_HUB_API = f'{self.server.url}/v2'
+        self.addCleanup(registry.close)
+        return registry
+
+    def test_token_reused_across_runs(self):
+        """Test that a second run skips the login and the file is private."""
+        self._registry(TokenCache(self.path)).list_versions()
+        self._registry(TokenCache(self.path)).list_versions()
+
+        self.assertEqual(self.server.count('POST', '/v2/auth/token'), 1)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+
+    def test_token_near_expiry_refreshed(self):
+        """Test that a token within the refresh margin of its exp claim is replaced."""
+        self._registry(TokenCache(self.path)).list_versions()
+        expires_at = jwt_expiry(next(iter(self.server.tokens)))
+
+        later = TokenCache(self.path, clock=lambda: expires_at - 30)
+        self._registry(later).list_versions()
+
+        self.assertEqual(self.server.count('POST', '/v2/auth/token'), 2)
+
+    def test_401_mid_listing_renews_token(self):
+        """Test that a rejected token is renewed without restarting the listing."""
+        tokens = TokenCache(self.path)
+        versions = self._registry(tokens).iter_versions()
+        first = next(versions)
+        stale = next(iter(self.server.tokens))
+        self.server.revoke_tokens()
+
+        rest = list(versions)
+
+        self.assertEqual(len(rest) + 1, 250)
+        self.assertEqual(first.name, 'v0')
+        self.assertEqual(self.server.count('POST', '/v2/auth/token'), 2)
+        self.assertEqual(self.server.count('GET', '/v2/repositories/testuser/test-container/tags/'), 4)
+        self.assertNotEqual(tokens.get(TokenCache.key(f'{self.server.url}/v2', 'testuser', 'testpass')), stale)
+
+    def test_tokens_without_expiry_not_stored(self):
+        """Test that opaque tokens are kept in memory only."""
+        TokenCache(self.path).put('key', 'opaque-token')
+
+        self.assertFalse(os.path.exists(self.path))
+
+
+class TestGHCRPagination(unittest.TestCase):
+    """Test GHCR version listing across pages."""
+
+    def _page(self, ids, next_url=None):
+        data = [
+            {'id': i, 'name': f'sha256:{i}', 'created_at': '2024-01-01T00:00:00Z',
+             'metadata': {'container': {'tags': []}}}
+            for i in ids
+        ]
+        links = {'next': {'url': next_url}} if next_url else {}
+        return Mock(status_code=200, headers={}, links=links, json=Mock(return_value=data))
+
+    @patch('requests.Session')
+    def test_iter_versions_follows_next_links(self, mock_session_cls):
+        """Test that every page is requested and yielded in order."""
+        sess = mock_session_cls.return_value
+        sess.request.side_effect = [
+            self._page(range(0, 100), 'https://api.github.com/next?page=2'),
+            self._page(range(100, 200), 'https://api.github.com/next?page=3'),
+            self._page(range(200, 250)),
+        ]
+        registry = GHCRRegistry('token', 'test-container')
+
+        versions = registry.list_versions()
+
+        self.assertEqual([v.id for v in versions], [str(i) for i in range(250)])
+        self.assertEqual(versions[0].digest, 'sha256:0')
+        self.assertIsNone(versions[0].metadata)
+        calls = sess.request.call_args_list
+        self.assertEqual(calls[0].kwargs['params'], {'per_page': 100})
+        self.assertEqual(calls[1].args[1], 'https://api.github.com/next?page=2')
+        self.assertEqual(calls[2].args[1], 'https://api.github.com/next?page=3')
+
+    @patch('requests.Session')
+    def test_iter_versions_is_lazy(self, mock_session_cls):
+        """Test that later pages are only fetched when consumed."""
+        sess = mock_session_cls.return_value
+        sess.request.side_effect = [
+            self._page(range(0, 100), 'https://api.github.com/next?page=2'),
+            self._page(range(100, 150)),
+        ]
+        registry = GHCRRegistry('token', 'test-container')
+
+        first = next(registry.iter_versions())
+
+        self.assertEqual(first.id, '0')
+        self.assertEqual(sess.request.call_count, 1)
+
+
+class TestGHCROrganization(unittest.TestCase):
+    """Test organization-wide GHCR package discovery."""
+
+    def _packages(self, names, next_url=None):
+        links = {'next': {'url': next_url}} if next_url else {}
+        return Mock(status_code=200, headers={}, links=links,
+                    json=Mock(return_value=[{'name': name, 'package_type': 'container'} for name in names]))
+
+    @patch('requests.Session')
+    def test_discover_packages_filters_by_glob(self, mock_session_cls):
+        """Test that every page of packages is read and filtered."""
+        sess = mock_session_cls.return_value
+        sess.request.side_effect = [
+            self._packages(['tools-a', 'web'], 'https://api.github.com/next?page=2'),
+            self._packages(['tools-b']),
+        ]
+        registry = GHCRRegistry('token', '', owner='acme')
+
+        self.assertEqual(registry.discover_packages('tools-*'), ['tools-a', 'tools-b'])
+        first = sess.request.call_args_list[0]
+        self.assertEqual(first.args[1], 'https://api.github.com/orgs/acme/packages')
+        self.assertEqual(first.kwargs['params'], {'package_type': 'container', 'per_page': 100})
+
+    def test_package_urls(self):
+        """Test that org packages use the org endpoints and names are encoded."""
+        self.assertEqual(GHCRRegistry('token', 'team/app', owner='acme')._package_url(),
+                         'https://api.github.com/orgs/acme/packages/container/team%2Fapp')
+        self.assertEqual(GHCRRegistry('token', 'app')._package_url(),
+                         'https://api.github.com/user/packages/container/app')
+
+    @patch('main.create_registry')
+    @patch('sys.argv', ['main.py', '--org', 'acme', '--package-glob', 'tools-*', '--registry', 'ghcr',
+                        '--prune-all-untagged', '--dry-run'])
+    def test_main_prunes_discovered_packages(self, mock_create_registry):
+        """Test that discovered packages are pruned as separate containers."""
+        registry = MockRegistry("GHCR", [ImageVersion("v1", "untagged", datetime.now().astimezone(), [])])
+        registry.container_name = ''
+        registry.discover_packages = Mock(return_value=['tools-a', 'tools-b'])
+        mock_create_registry.return_value = registry
+
+        with patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+            main.main()
+
+        self.assertEqual(mock_create_registry.call_args.kwargs['owner'], 'acme')
+        registry.discover_packages.assert_called_once_with('tools-*')
+        output = mock_stdout.getvalue()
+        self.assertIn("=== GHCR (tools-a) ===", output)
+        self.assertIn("GHCR (tools-b): 1 planned", output)
+
+    @patch('sys.argv', ['main.py', '--org', 'acme', '--registry', 'all', '--prune-all-untagged'])
+    def test_org_requires_ghcr(self):
+        """Test that --org is rejected for other registries."""
+        with patch('sys.stderr', new_callable=StringIO) as mock_stderr:
+            with self.assertRaises(SystemExit):
+                main.main()
+
+        self.assertIn("--registry ghcr", mock_stderr.getvalue())
+
+
+class TestGHCRFakeServer(unittest.TestCase):
+    """Test GHCRRegistry end to end against the local fake GitHub API."""
+
+    def test_lists_and_deletes_across_pages(self):
+        """Test that paged listing and deletes go through the real HTTP stack."""
+        with FakeRegistry('testuser') as server:
+            server.seed_ghcr('app', 250, tagged_every=5)
+            registry = GHCRRegistry('token', 'app', api_url=server.url)
+
+            versions = registry.list_versions()
+            self.assertEqual(len(versions), 250)
+            self.assertEqual(sum(1 for v in versions if v.tags), 50)
+            self.assertEqual(server.count('GET', '/user/packages/container/app/versions'), 3)
+
+            self.assertTrue(registry.delete_version(versions[0].id))
+            self.assertEqual(len(registry.list_versions()), 249)
+            registry.close()
+
+    def test_retries_server_errors(self):
+        """Test that injected 503s are retried until the listing succeeds."""
+        with FakeRegistry('testuser', error_rate=0.3, seed=1) as server:
+            server.seed_ghcr('app', 300)
+            retry = RetryPolicy(max_attempts=10, sleep=lambda _: None)
+            registry = GHCRRegistry('token', 'app', retry=retry, api_url=server.url)
+
+            self.assertEqual(len(registry.list_versions()), 300)
+            self.assertGreater(server.count('GET'), 3)
+            registry.close()
+
+    def test_rate_limit_headers_feed_scheduler(self):
+        """Test that x-ratelimit headers from the server reach the scheduler."""
+        with FakeRegistry('testuser', rate_limit=100) as server:
+            server.seed_ghcr('app', 10)
+            registry = GHCRRegistry('token', 'app', api_url=server.url)
+
+            registry.list_versions()
+
+            self.assertEqual(registry.scheduler.remaining, 99)
+            registry.close()
+
+
+class TestReferenceGraph(unittest.TestCase):
+    """Test pruning that follows image indexes to their platform and attestation manifests."""
+
+    def setUp(self):
+        self.server = FakeRegistry('testuser').start()
+        self.addCleanup(self.server.stop)
+        self.registry = GHCRRegistry('token', 'app', api_url=self.server.url,
+                                     registry_url=f'{self.server.url}/ghcr')
+        self.addCleanup(self.registry.close)
+
+    def _plan(self, strategy, cache=None):
+        versions = self.registry.list_versions()
+        return [v.id for v in ReferenceAwareStrategy(strategy, self.registry, cache).select(versions)]
+
+    def test_keeps_manifests_of_tagged_indexes(self):
+        """Test that untagged manifests a tagged index lists are not pruned as untagged."""
+        self.server.seed_ghcr_multiarch('app', 3)
+
+        self.assertEqual(len(PruneAllUntagged().select(self.registry.list_versions())), 12)
+        self.assertEqual(self._plan(PruneAllUntagged()), [])
+
+    def test_collects_manifests_of_deleted_indexes(self):
+        """Test that keep-latest counts images and deletes their manifests with them."""
+        self.server.seed_ghcr_multiarch('app', 3)
+        self.server.seed_ghcr_multiarch('app', 1, tagged=False)
+
+        # The untagged index is the oldest image; it goes with every manifest it lists
+        self.assertEqual(self._plan(KeepLatestCount(2)), [str(i) for i in range(11, 21)])
+
+    def test_keeps_tagged_manifests_of_deleted_indexes(self):
+        """Test that a manifest with its own tag is decided as an image, not deleted with its index."""
+        self.server.seed_ghcr_multiarch('app', 1, tagged=False)
+        self.server.ghcr_versions['app'][1]['metadata']['container']['tags'] = ['amd64']
+        versions = self.registry.list_versions()
+        self.assertEqual(list(versions[1].tags), ['amd64'])
+
+        # The untagged index goes with its untagged manifests, but the tagged one stays
+        self.assertEqual(self._plan(PruneAllUntagged()), [v.id for v in versions if v is not versions[1]])
+
+    def test_fetches_each_manifest_once(self):
+        """Test that only indexes are fetched, and that cached references are not fetched again."""
+        self.server.seed_ghcr_multiarch('app', 3, attestations=False)
+        self.server.seed_ghcr('app', 2, tagged_every=1)
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = ReferenceCache(os.path.join(tmp, 'manifests.json'))
+
+            self.assertEqual(self._plan(KeepLatestCount(1), cache), [str(i) for i in range(4, 12)])
+            # The platform manifests are known from their indexes and aren't fetched
+            self.assertEqual(self.server.count('GET', '/ghcr/v2/'), 5)
+            self.assertEqual(self.server.count('GET', '/ghcr/token'), 1)
+
+            self._plan(KeepLatestCount(1), cache)
+            self.assertEqual(self.server.count('GET', '/ghcr/v2/'), 5)
+
+    def test_missing_manifest_aborts_container(self):
+        """Test that a listed version without a manifest stops planning instead of counting as no references."""
+        self.server.seed_ghcr_multiarch('app', 2, tagged=False)
+        del self.server.ghcr_manifests[self.registry.list_versions()[0].digest]
+
+        with self.assertRaisesRegex(RegistryError, 'not found'):
+            self._plan(PruneAllUntagged())
+
+        report = main.PruneReport(self.registry.registry_name)
+        strategy = ReferenceAwareStrategy(KeepLatestCount(1), self.registry)
+        self.assertEqual(main.prune_registry(self.registry, strategy, dry_run=False, out=StringIO(), report=report), 0)
+        self.assertIn('not found', report.error)
+        self.assertEqual(len(self.server.ghcr_versions['app']), 10)
+
+        with self.assertRaises(ValueError):
+            ReferenceAwareStrategy(PruneAllUntagged(), MockRegistry("Mock"))
+
+    def test_renews_rejected_pull_token(self):
+        """Test that a pull token the registry stops accepting is exchanged again once."""
+        self.server.seed_ghcr_multiarch('app', 1)
+        digest = self.registry.list_versions()[0].digest
+        self.assertEqual(len(self.registry.fetch_manifest(digest)['manifests']), 4)
+
+        self.server.revoke_tokens()
+
+        self.assertEqual(len(self.registry.fetch_manifest(digest)['manifests']), 4)
+        self.assertEqual(self.server.count('GET', '/ghcr/token'), 2)
+        self.assertIsNone(self.registry.fetch_manifest('sha256:missing'))
+
+    def test_fetcher_runs_concurrently_once_per_digest(self):
+        """Test that duplicate digests are fetched once."""
+        calls = []
+        fetcher = ManifestFetcher(lambda digest: calls.append(digest) or {'manifests': []}, concurrency=4)
+
+        fetcher.references(['a', 'b', 'a', 'c'])
+        fetcher.references(['c', 'd'])
+
+        self.assertEqual(sorted(calls), ['a', 'b', 'c', 'd'])
+        self.assertEqual(fetcher.fetched, 4)
+
+
+class TestCassette(unittest.TestCase):
+    """Test recording registry exchanges to a cassette and replaying them offline."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'cassette.json')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_replays_without_network(self):
+        """Test that a recorded listing and delete replay once the server is gone."""
+        with FakeRegistry('testuser') as server:
+            server.seed_ghcr('app', 150)
+            api_url = server.url
+            cassette = Cassette(self.path)
+            registry = GHCRRegistry('token', 'app', api_url=api_url, transport=cassette)
+            recorded = registry.list_versions()
+            registry.delete_version(recorded[-1].id)
+            registry.close()
+            cassette.save()
+
+        replay = Cassette.load(self.path, speed=0)
+        registry = GHCRRegistry('other-token', 'app', api_url=api_url, transport=replay)
+
+        self.assertEqual([v.id for v in registry.list_versions()], [v.id for v in recorded])
+        self.assertTrue(registry.delete_version(recorded[-1].id))
+        self.assertEqual(replay.unplayed, 0)
+        with self.assertRaises(ReplayError):
+            registry.delete_version(recorded[0].id)
+        self.assertEqual(replay.misses, 1)
+        registry.close()
+
+    def test_credentials_are_not_recorded(self):
+        """Test that Docker Hub passwords and issued tokens are redacted."""
+        with FakeRegistry('testuser') as server:
+            server.seed_dockerhub_synthetic('app', 5)
+            api_url = f'{server.url}/v2'
+            cassette = Cassette(self.path)
+            registry = DockerHubRegistry('testuser', 'hub-secret', 'app', api_url=api_url,
+                                         transport=cassette)
+            registry.list_versions()
+            registry.close()
+            cassette.save()
+            issued = list(server.tokens)
+
+        with open(self.path, encoding='utf-8') as f:
+            recorded = f.read()
+        for secret in ['hub-secret', *issued]:
+            self.assertNotIn(secret, recorded)
+
+        # The login still matches on replay, whatever the password
+        replay = Cassette.load(self.path, speed=0)
+        registry = DockerHubRegistry('testuser', 'other', 'app', api_url=api_url, transport=replay)
+        self.assertEqual(len(registry.list_versions()), 5)
+        self.assertEqual(replay.unplayed, 0)
+        registry.close()
+
+
+class TestMetrics(unittest.TestCase):
+    """Test request and phase metrics and their export."""
+
+    def test_requests_and_retries_are_counted(self):
+        """Test that every attempt is recorded per endpoint and status, with retries counted."""
+        metrics = Metrics()
+        with FakeRegistry('testuser', error_rate=0.3, seed=1) as server:
+            server.seed_ghcr('app', 150)
+            retry = RetryPolicy(max_attempts=10, sleep=lambda _: None)
+            registry = GHCRRegistry('token', 'app', retry=retry, api_url=server.url, metrics=metrics)
+            registry.list_versions()
+            registry.close()
+            sent = server.count('GET')
+
+        data = metrics.to_dict()
+        requests_sent = {(r['status']): r['count'] for r in data['requests'] if r['endpoint'] == 'versions'}
+        self.assertEqual(sum(requests_sent.values()), sent)
+        self.assertEqual(requests_sent['200'], 2)
+        self.assertEqual(data['retries'][0]['count'], requests_sent['503'])
+        self.assertEqual(data['latency'][0]['count'], sent)
+        self.assertGreater(next(b['bytes'] for b in data['bytes'] if b['direction'] == 'received'), 0)
+
+    def test_prometheus_histogram_is_cumulative(self):
+        """Test the textfile format of a latency histogram."""
+        metrics = Metrics()
+        for seconds in (0.004, 0.2, 30):
+            metrics.observe_request('GHCR', 'versions', 'GET', 200, seconds)
+        text = metrics.to_prometheus()
+
+        self.assertIn('# TYPE prune_http_request_duration_seconds histogram', text)
+        self.assertIn('prune_http_request_duration_seconds_bucket{registry="GHCR",endpoint="versions",le="0.005"} 1',
+                      text)
+        self.assertIn('prune_http_request_duration_seconds_bucket{registry="GHCR",endpoint="versions",le="10.0"} 2',
+                      text)
+        self.assertIn('prune_http_request_duration_seconds_bucket{registry="GHCR",endpoint="versions",le="+Inf"} 3',
+                      text)
+        self.assertIn('prune_http_requests_total{registry="GHCR",endpoint="versions",method="GET",status="200"} 3',
+                      text)
+
+    @patch('main.create_registry')
+    def test_main_writes_metrics_files(self, mock_create_registry):
+        """Test that --metrics-out writes phase timings as JSON and Prometheus text."""
+        now = datetime.now().astimezone()
+        registry = MockRegistry("GHCR", [ImageVersion("v1", "a", now, []), ImageVersion("v2", "b", now, ["x"])])
+        registry.container_name = 'app'
+        mock_create_registry.return_value = registry
+
+        with tempfile.TemporaryDirectory() as tmp:
+            json_path, prom_path = os.path.join(tmp, 'metrics.json'), os.path.join(tmp, 'metrics.prom')
+            argv = ['main.py', '--container', 'app', '--registry', 'ghcr', '--prune-all-untagged',
+                    '--metrics-out', json_path, '--metrics-out', prom_path]
+            with patch('sys.argv', argv), patch('sys.stdout', new_callable=StringIO):
+                main.main()
+
+            self.assertIsNotNone(mock_create_registry.call_args.kwargs['metrics'])
+            with open(json_path, encoding='utf-8') as f:
+                phases = {p['phase']: p['versions'] for p in json.load(f)['phases']}
+            with open(prom_path, encoding='utf-8') as f:
+                text = f.read()
+
+        self.assertEqual(phases, {'list': 2, 'plan': 1, 'delete': 1})
+        self.assertIn('prune_phase_versions{registry="GHCR",container="app",phase="delete"} 1', text)
+
+
+class TestJsonLinesOutput(unittest.TestCase):
+    """Test the machine-readable --output jsonl format."""
+
+    def setUp(self):
+        self.now = datetime.now().astimezone().replace(microsecond=0)
+        self.versions = [
+            ImageVersion("v1", "tagged", self.now - timedelta(days=10), ["latest"]),
+            ImageVersion("v2", "untagged", self.now - timedelta(days=5), []),
+            ImageVersion("v3", "untagged", self.now - timedelta(days=1), []),
+        ]
+
+    def test_records_per_decision(self):
+        """Test that each deletion is one record with its result and latency."""
+        registry = MockRegistry("Test Registry", self.versions, fail_delete=True)
+        registry.container_name = 'app'
+
+        with patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+            main.prune_registry(registry, PruneAllUntagged(), dry_run=False, output_format=JsonLinesOutput())
+
+        records = [json.loads(line) for line in mock_stdout.getvalue().splitlines()]
+        self.assertEqual([(r['id'], r['result']) for r in records], [('v2', 'failed'), ('v3', 'failed')])
+        self.assertEqual(records[0]['registry'], 'Test Registry')
+        self.assertEqual(records[0]['container'], 'app')
+        self.assertEqual(records[0]['tags'], [])
+        self.assertEqual(records[0]['created_at'], (self.now - timedelta(days=5)).isoformat())
+        self.assertIsInstance(records[0]['latency'], float)
+
+    @patch('main.create_registry')
+    @patch('sys.argv', ['main.py', '--container', 'app', '--registry', 'ghcr', '--prune-all-untagged', '--dry-run',
+                        '--output', 'jsonl'])
+    def test_main_emits_only_json(self, mock_create_registry):
+        """Test that stdout holds only records, ending with the summary."""
+        registry = MockRegistry("GHCR", self.versions)
+        registry.container_name = 'app'
+        mock_create_registry.return_value = registry
+
+        with patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+            main.main()
+
+        records = [json.loads(line) for line in mock_stdout.getvalue().splitlines()]
+        self.assertEqual([r['result'] for r in records[:-1]], ['planned', 'planned'])
+        summary = records[-1]
+        self.assertEqual(summary['type'], 'summary')
+        self.assertTrue(summary['dry_run'])
+        self.assertEqual(summary['planned'], 2)
+        self.assertEqual(summary['registries'][0]['listed'], 3)
+
+    def test_text_output_is_batched(self):
+        """Test that version lines are written in batches rather than one write each."""
+        versions = [ImageVersion(f"v{i}", "untagged", self.now, []) for i in range(1200)]
+        registry = MockRegistry("Test Registry", versions)
+        stream = Mock()
+
+        main.prune_registry(registry, PruneAllUntagged(), dry_run=True, out=stream)
+
+        self.assertLessEqual(stream.write.call_count, 4)
+        written = ''.join(call.args[0] for call in stream.write.call_args_list)
+        self.assertEqual(written.count("Would delete image:"), 1200)
+
+
+class TestPlanApply(unittest.TestCase):
+    """Test saving a deletion plan with --plan-out and applying it with --apply."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'plan.json')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _plan(self, registry, strategy):
+        report = main.PruneReport(registry.registry_name)
+        main.prune_registry(registry, strategy, dry_run=True, out=StringIO(), report=report, fingerprint=True)
+        write_plan(self.path, [PlanEntry(registry.registry_type, registry.container_name, report.plan,
+                                         report.fingerprint, registry.plan_state(report.plan),
+                                         description=strategy.get_description())])
+        registry.close()
+        return load_plan(self.path)[0]
+
+    def _apply(self, registry, entry):
+        report = main.PruneReport(registry.registry_name)
+        main.prune_registry(registry, None, dry_run=False, concurrency=4, out=StringIO(), report=report,
+                            saved_plan=entry)
+        registry.close()
+        return report
+
+    def test_ghcr_applies_without_listing(self):
+        """Test that applying a plan checks one page and deletes exactly the planned versions."""
+        with FakeRegistry('testuser') as server:
+            server.seed_ghcr('app', 150)
+            entry = self._plan(GHCRRegistry('token', 'app', api_url=server.url), KeepLatestCount(10))
+            self.assertEqual(entry.fingerprint, {'newest': '1', 'count': 150})
+            self.assertEqual(len(entry.versions), 140)
+            listed = server.count('GET', '/user/packages/container/app/versions')
+
+            report = self._apply(GHCRRegistry('token', 'app', api_url=server.url), entry)
+
+            self.assertIsNone(report.error)
+            self.assertEqual(report.deleted, 140)
+            self.assertEqual(server.count('GET', '/user/packages/container/app/versions'), listed + 1)
+            self.assertEqual(len(server.ghcr_versions['app']), 10)
+
+    def test_stale_plan_deletes_nothing(self):
+        """Test that a version pushed after planning makes the plan stale."""
+        with FakeRegistry('testuser') as server:
+            server.seed_ghcr('app', 50)
+            entry = self._plan(GHCRRegistry('token', 'app', api_url=server.url), KeepLatestCount(10))
+            server.seed_ghcr('app', 1)
+
+            report = self._apply(GHCRRegistry('token', 'app', api_url=server.url), entry)
+
+            self.assertEqual(report.error, 'plan is stale')
+            self.assertEqual(report.deleted, 0)
+            self.assertEqual(server.count('DELETE'), 0)
+
+    def test_dockerhub_restores_tag_index(self):
+        """Test that Docker Hub deletes a plan from its saved tag names, bulk deleting whole digests."""
+        with FakeRegistry('testuser') as server:
+            server.seed_dockerhub('app', [
+                {'name': 'new', 'digest': 'sha256:' + 'b' * 64, 'last_updated': '2024-03-01T00:00:00Z'},
+                {'name': 'old-2', 'digest': 'sha256:' + 'a' * 64, 'last_updated': '2024-02-01T00:00:00Z'},
+                {'name': 'old-1', 'digest': 'sha256:' + 'a' * 64, 'last_updated': '2024-01-01T00:00:00Z'},
+            ])
+            api_url = f'{server.url}/v2'
+            entry = self._plan(DockerHubRegistry('testuser', 'pw', 'app', api_url=api_url), KeepLatestCount(1))
+            self.assertEqual(entry.state, {'tag_index': {'sha256:' + 'a' * 64: ['old-2', 'old-1']}})
+            listed = server.count('GET', '/v2/repositories/testuser/app/tags')
+
+            report = self._apply(DockerHubRegistry('testuser', 'pw', 'app', api_url=api_url), entry)
+
+            self.assertEqual(report.deleted, 2)
+            self.assertEqual(server.count('GET', '/v2/repositories/testuser/app/tags'), listed + 1)
+            self.assertEqual(server.count('POST', '/v2/namespaces/testuser/delete-images'), 1)
+            self.assertEqual([tag['name'] for tag in server.dockerhub_tags['app']], ['new'])
+
+    def test_rejects_other_files(self):
+        """Test that a file that isn't a plan is refused."""
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump({'version': 1, 'interactions': []}, f)
+
+        with self.assertRaises(ValueError):
+            load_plan(self.path)
+
+
+class FakeClock:
+    """Deterministic clock whose sleep() just advances time."""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestRateLimitScheduler(unittest.TestCase):
+    """Test the header-driven rate-limit scheduler."""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = RateLimitScheduler(clock=self.clock.time, sleep=self.clock.sleep)
+
+    def _headers(self, remaining, reset_in, limit=5000):
+        return {
+            'x-ratelimit-limit': str(limit),
+            'x-ratelimit-remaining': str(remaining),
+            'x-ratelimit-reset': str(int(self.clock.now + reset_in)),
+        }
+
+    def test_no_wait_with_plenty_of_quota(self):
+        """Test that requests are not delayed while the bucket is full."""
+        self.scheduler.update(self._headers(4000, 3600))
+        for _ in range(100):
+            self.assertEqual(self.scheduler.acquire(), 0.0)
+        self.assertEqual(self.scheduler.remaining, 3900)
+
+    def test_paces_requests_near_exhaustion(self):
+        """Test that a low bucket spreads the remaining requests until reset."""
+        self.scheduler.update(self._headers(10, 100))
+
+        for _ in range(5):
+            self.scheduler.acquire()
+
+        self.assertEqual(self.clock.sleeps, [10.0, 10.0, 10.0, 10.0])
+
+    def test_sleeps_until_reset_when_exhausted(self):
+        """Test that an empty bucket blocks until the window resets."""
+        self.scheduler.update(self._headers(0, 42))
+
+        self.assertEqual(self.scheduler.acquire(), 42)
+        # The window rolled over; requests flow again until new headers arrive
+        self.assertEqual(self.scheduler.acquire(), 0.0)
+
+    def test_stale_headers_do_not_raise_estimate(self):
+        """Test that out-of-order responses in one window keep the lowest count."""
+        self.scheduler.update(self._headers(100, 60))
+        self.scheduler.update(self._headers(150, 60))
+        self.assertEqual(self.scheduler.remaining, 100)
+
+    @patch('requests.Session')
+    def test_http_client_resends_after_rate_limit_reset(self, mock_session_cls):
+        """Test that a request rejected for exhausted quota is re-sent after reset."""
+        sess = mock_session_cls.return_value
+        sess.request.side_effect = [
+            Mock(status_code=403, headers=self._headers(0, 30)),
+            Mock(status_code=200, headers=self._headers(4999, 3600)),
+        ]
+        client = HttpClient(scheduler=self.scheduler)
+
+        resp = client.get('https://api.github.com/user/packages')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(sess.request.call_count, 2)
+        self.assertEqual(self.clock.sleeps, [30])
+
+
+class TestRetryPolicy(unittest.TestCase):
+    """Test retry decisions, backoff and the shared retry budget."""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.policy = RetryPolicy(max_attempts=4, base_delay=1.0, max_delay=8.0,
+                                  sleep=self.clock.sleep, rng=lambda: 1.0)
+
+    def test_idempotency_aware_decisions(self):
+        """Test that ambiguous failures are only retried for idempotent methods."""
+        self.assertTrue(self.policy.should_retry('GET', 0, 502))
+        self.assertTrue(self.policy.should_retry('DELETE', 0, None))
+        self.assertFalse(self.policy.should_retry('POST', 0, 502))
+        self.assertTrue(self.policy.should_retry('POST', 0, 502, idempotent=True))
+        self.assertTrue(self.policy.should_retry('POST', 0, 429))
+        self.assertFalse(self.policy.should_retry('GET', 0, 404))
+        self.assertFalse(self.policy.should_retry('GET', 3, 503))
+        self.assertEqual(self.policy.retries, 4)
+
+    def test_backoff_is_capped_and_honours_retry_after(self):
+        """Test exponential backoff caps and Retry-After precedence."""
+        self.assertEqual([self.policy.backoff(a) for a in range(5)], [1.0, 2.0, 4.0, 8.0, 8.0])
+        self.assertEqual(self.policy.backoff(0, {'retry-after': '3'}), 3.0)
+        self.assertEqual(self.policy.backoff(0, {'retry-after': '120'}), 8.0)
+
+        jittered = RetryPolicy(base_delay=1.0, rng=lambda: 0.25)
+        self.assertEqual(jittered.backoff(2), 1.0)
+
+    def test_budget_is_shared(self):
+        """Test that policies stop retrying once the run's budget is spent."""
+        budget = RetryBudget(2)
+        first, second = RetryPolicy(budget=budget), RetryPolicy(budget=budget)
+
+        self.assertTrue(first.should_retry('GET', 0, 503))
+        self.assertTrue(second.should_retry('GET', 0, 503))
+        self.assertFalse(first.should_retry('GET', 1, 503))
+        self.assertTrue(budget.exhausted)
+
+    @patch('requests.Session')
+    def test_http_client_retries_transient_errors(self, mock_session_cls):
+        """Test that a transient 502 and a connection error are retried."""
+        sess = mock_session_cls.return_value
+        sess.request.side_effect = [
+            Mock(status_code=502, headers={}),
+            requests.exceptions.ConnectionError('reset'),
+            Mock(status_code=200, headers={}),
+        ]
+        client = HttpClient(retry=self.policy)
+
+        resp = client.get('https://api.github.com/user/packages')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.attempts, 3)
+        self.assertEqual(self.clock.sleeps, [1.0, 2.0])
+
+    @patch('requests.Session')
+    def test_retried_delete_404_counts_as_deleted(self, mock_session_cls):
+        """Test that a 404 after an ambiguous failure means the delete landed."""
+        sess = mock_session_cls.return_value
+        sess.request.side_effect = [Mock(status_code=504, headers={}), Mock(status_code=404, headers={})]
+        registry = GHCRRegistry('token', 'test-container', retry=self.policy)
+
+        self.assertTrue(registry.delete_version('123'))
+
+    @patch('requests.Session')
+    def test_list_raises_after_retries(self, mock_session_cls):
+        """Test that listing raises instead of exiting once retries run out."""
+        sess = mock_session_cls.return_value
+        sess.request.return_value = Mock(status_code=503, headers={}, text='unavailable')
+        registry = GHCRRegistry('token', 'test-container', retry=self.policy)
+
+        with self.assertRaises(RegistryError):
+            registry.list_versions()
+        self.assertEqual(sess.request.call_count, 4)
+
+
+class TestRegistrySession(unittest.TestCase):
+    """Test the pooled HTTP session owned by each registry."""
+
+    @patch('requests.Session')
+    def test_session_reused_across_calls(self, mock_session_cls):
+        """Test that list and delete share one lazily created session."""
+        sess = mock_session_cls.return_value
+        sess.request.return_value = Mock(status_code=200, headers={}, links={}, json=Mock(return_value=[]),
+                                         raise_for_status=Mock())
+        registry = GHCRRegistry('token', 'test-container')
+        mock_session_cls.assert_not_called()
+
+        registry.list_versions()
+        registry.delete_version('123')
+
+        mock_session_cls.assert_called_once()
+        for call in sess.request.call_args_list:
+            self.assertEqual(call.kwargs['timeout'], registry.http.timeout)
+
+    @patch('requests.Session')
+    def test_pool_size_and_context_manager(self, mock_session_cls):
+        """Test that the adapter pool is sized for concurrency and closed on exit."""
+        sess = mock_session_cls.return_value
+
+        with GHCRRegistry('token', 'test-container', pool_size=16) as registry:
+            registry.http.session
+            adapter = sess.mount.call_args.args[1]
+            self.assertEqual(adapter._pool_maxsize, 16)
+
+        sess.close.assert_called_once()
+
+
+class TestHttpCache(unittest.TestCase):
+    """Test conditional revalidation of listing pages."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cache = HttpCache(os.path.join(tmp.name, 'http'))
+        # Entries are keyed by credentials, so every run has to reuse the login
+        self.tokens = TokenCache(os.path.join(tmp.name, 'tokens.json'))
+
+    def _response(self, url, body, etag='"v1"'):
+        resp = requests.Response()
+        resp.status_code = 200
+        resp.url = url
+        resp._content = body.encode()
+        resp.headers['ETag'] = etag
+        return resp
+
+    def _registry(self, server):
+        registry = DockerHubRegistry('testuser', 'testpass', 'test-container', cache=self.cache, tokens=self.tokens)
+        registry.DOCKER_HUB_API = f'{server.url}/v2'
+        self.addCleanup(registry.close)
+        return registry
+
+    def test_unchanged_pages_served_from_cache(self):
+        """Test that a second listing revalidates every page and reuses the bodies."""
+        with FakeRegistry('testuser') as server:
+            server.seed_dockerhub('test-container', [
+                {'name': f'v{i}', 'digest': f'sha256:{i:064x}', 'last_updated': '2024-01-01T00:00:00Z'}
+                for i in range(150)
+            ])
+            first = self._registry(server).list_versions()
+            self.assertEqual(self.cache.hits, 0)
+
+            # The repository lookup and both tag pages are unchanged
+            second = self._registry(server).list_versions()
+            self.assertEqual(self.cache.hits, 3)
+            self.assertEqual([v.id for v in second], [v.id for v in first])
+
+            server.dockerhub_tags['test-container'].pop()
+            third = self._registry(server).list_versions()
+            self.assertEqual(self.cache.hits, 4)
+            self.assertEqual(len(third), 149)
+
+    def test_keys_separate_credentials(self):
+        """Test that a cached page is never revalidated with another user's token."""
+        url = 'https://example.test/tags?page=1'
+        alice = HttpCache.key(url, {'Authorization': 'token alice'})
+        self.cache.store(alice, self._response(url, '[1]'))
+
+        self.assertIsNotNone(self.cache.lookup(alice))
+        self.assertIsNone(self.cache.lookup(HttpCache.key(url, {'Authorization': 'token bob'})))
+
+    def test_skips_responses_without_validators(self):
+        """Test that responses with nothing to revalidate are not stored."""
+        resp = self._response('https://example.test/a', '[]')
+        del resp.headers['ETag']
+        self.cache.store('a', resp)
+
+        self.assertIsNone(self.cache.lookup('a'))
+
+    def test_evicts_least_recently_used(self):
+        """Test that the directory is trimmed to max_bytes, oldest entries first."""
+        body = 'x' * 400
+        for name in ('a', 'b', 'c'):
+            self.cache.store(name, self._response(f'https://example.test/{name}', body))
+            os.utime(self.cache._path(name), (time.time() - 100, time.time() - 100))
+        self.cache.lookup('a')
+        self.cache.max_bytes = 1200
+
+        self.cache.store('d', self._response('https://example.test/d', body))
+
+        self.assertIsNotNone(self.cache.lookup('a'))
+        self.assertIsNone(self.cache.lookup('b'))
+        self.assertIsNotNone(self.cache.lookup('d'))
+
+
 class TestPruneRegistry(unittest.TestCase):
     """Test the prune_registry function."""
 
@@ -244,6 +1578,35 @@ class TestPruneRegistry(unittest.TestCase):
         output = mock_stdout.getvalue()
         self.assertIn("Failed to delete image: v2", output)
 
+    def test_prune_registry_concurrent_deletes(self):
+        """Test that concurrent deletes keep plan order and accurate counts."""
+        versions = [
+            ImageVersion(f"v{i}", "untagged", self.now - timedelta(minutes=i), [])
+            for i in range(40)
+        ]
+        registry = MockRegistry("Test Registry", versions)
+        failing = {"v3", "v17"}
+
+        def delete_version(version_id):
+            time.sleep(random.uniform(0, 0.005))
+            if version_id in failing:
+                return False
+            registry._deleted_versions.append(version_id)
+            return True
+
+        registry.delete_version = delete_version
+
+        with patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+            deleted_count = main.prune_registry(registry, PruneAllUntagged(), dry_run=False, concurrency=8)
+
+        self.assertEqual(deleted_count, 38)
+        self.assertEqual(sorted(registry._deleted_versions), sorted(f"v{i}" for i in range(40) if f"v{i}" not in failing))
+
+        lines = [line for line in mock_stdout.getvalue().splitlines() if "image: " in line]
+        self.assertEqual([line.split("image: ")[1].split(" ")[0] for line in lines], [f"v{i}" for i in range(40)])
+        self.assertIn("Failed to delete image: v3", lines[3])
+        self.assertIn("38 deleted, 2 failed", mock_stdout.getvalue())
+
     def test_prune_registry_no_images(self):
         """Test registry with no images."""
         registry = MockRegistry("Empty Registry", [])
@@ -271,6 +1634,271 @@ class TestPruneRegistry(unittest.TestCase):
         self.assertIn("API Error", output)
 
 
+class PagedMockRegistry(MockRegistry):
+    """Mock registry that lists versions in slow pages and logs event times."""
+
+    def __init__(self, name, versions, page_size=10, page_delay=0.02):
+        super().__init__(name, versions)
+        self.page_size = page_size
+        self.page_delay = page_delay
+        self.events = []
+
+    def iter_versions(self):
+        for start in range(0, len(self._versions), self.page_size):
+            time.sleep(self.page_delay)
+            self.events.append(("page", time.perf_counter()))
+            yield from self._versions[start:start + self.page_size]
+
+    def list_versions(self):
+        return list(self.iter_versions())
+
+    def delete_version(self, version_id):
+        self.events.append(("delete", time.perf_counter()))
+        return super().delete_version(version_id)
+
+
+class TestStreamingPrune(unittest.TestCase):
+    """Test the pipelined list -> plan -> delete mode."""
+
+    def setUp(self):
+        self.now = datetime.now().astimezone()
+        self.versions = [
+            ImageVersion(f"v{i}", "image", self.now - timedelta(days=i), [] if i % 2 else ["tag"])
+            for i in range(60)
+        ]
+
+    def test_deletes_overlap_listing(self):
+        """Test that deletes start before the last page has been listed."""
+        registry = PagedMockRegistry("Test Registry", self.versions)
+
+        with patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+            deleted_count = main.prune_registry(registry, PruneAllUntagged(), dry_run=False, stream=True)
+
+        self.assertEqual(deleted_count, 30)
+        self.assertEqual(registry._deleted_versions, [f"v{i}" for i in range(1, 60, 2)])
+
+        first_delete = min(t for kind, t in registry.events if kind == "delete")
+        last_page = max(t for kind, t in registry.events if kind == "page")
+        self.assertLess(first_delete, last_page)
+
+        lines = [line for line in mock_stdout.getvalue().splitlines() if line.startswith("Deleted image")]
+        self.assertEqual(lines[0], "Deleted image: v1 (untagged)")
+        self.assertEqual(len(lines), 30)
+
+    def test_bounded_queue_and_dry_run(self):
+        """Test backpressure with a tiny queue and dry-run output."""
+        registry = PagedMockRegistry("Test Registry", self.versions, page_delay=0)
+        strategy = PruneUntaggedByAge(10)
+
+        with patch('main.STREAM_QUEUE_SIZE', 2), patch('main.STREAM_BATCH_SIZE', 3):
+            with patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+                main.prune_registry(registry, strategy, dry_run=True, stream=True)
+
+        expected = [f"v{i}" for i in range(11, 60, 2)]
+        lines = [line for line in mock_stdout.getvalue().splitlines() if line.startswith("Would delete")]
+        self.assertEqual([line.split(": ")[1].split(" ")[0] for line in lines], expected)
+        self.assertEqual(registry._deleted_versions, [])
+
+    def test_inventory_strategies_ignore_stream(self):
+        """Test that keep-latest still plans over the complete inventory."""
+        registry = PagedMockRegistry("Test Registry", self.versions, page_delay=0)
+
+        with patch('sys.stdout', new_callable=StringIO):
+            deleted_count = main.prune_registry(registry, KeepLatestCount(50), dry_run=False, stream=True)
+
+        self.assertEqual(deleted_count, 10)
+        self.assertEqual(registry._deleted_versions, [f"v{i}" for i in range(50, 60)])
+
+    def test_relists_versions_moved_by_deletes(self):
+        """Test that a streamed run leaves no eligible version behind on a page-numbered listing."""
+        with FakeRegistry('testuser') as server:
+            server.seed_ghcr('app', 1000)
+            registry = GHCRRegistry('token', 'app', api_url=server.url)
+            self.addCleanup(registry.close)
+            report = main.PruneReport(registry.registry_name)
+
+            with patch('sys.stdout', new_callable=StringIO):
+                deleted_count = main.prune_registry(registry, PruneAllUntagged(), dry_run=False, report=report,
+                                                    concurrency=4, stream=True)
+
+            remaining = server.ghcr_versions['app']
+            self.assertEqual([v for v in remaining if not v['metadata']['container']['tags']], [])
+            self.assertEqual(len(remaining), 200)
+            self.assertEqual((deleted_count, report.planned, report.listed), (800, 800, 1000))
+
+    def test_listing_error_is_reported(self):
+        """Test that a failure part way through listing is reported."""
+        registry = PagedMockRegistry("Test Registry", self.versions, page_delay=0)
+        iter_versions = registry.iter_versions
+
+        def failing_iter():
+            yield from itertools.islice(iter_versions(), 15)
+            raise RegistryError("page 2 failed")
+
+        registry.iter_versions = failing_iter
+        report = main.PruneReport("Test Registry")
+
+        with patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+            main.prune_registry(registry, PruneAllUntagged(), dry_run=False, report=report, stream=True)
+
+        self.assertEqual(registry._deleted_versions, [f"v{i}" for i in range(1, 15, 2)])
+        self.assertEqual(report.error, "page 2 failed")
+        self.assertIn("Error listing versions", mock_stdout.getvalue())
+
+
+class TestPruneAll(unittest.TestCase):
+    """Test pruning several registries in parallel."""
+
+    def setUp(self):
+        self.now = datetime.now().astimezone()
+
+    def _slow_registry(self, name, count, delay):
+        versions = [
+            ImageVersion(f"{name}-{i}", "untagged", self.now - timedelta(minutes=i), [])
+            for i in range(count)
+        ]
+        registry = MockRegistry(name, versions)
+        list_versions = registry.list_versions
+
+        def slow_list():
+            time.sleep(delay)
+            registry._log(f"Listed {name}")
+            return list_versions()
+
+        registry.list_versions = slow_list
+        return registry
+
+    def test_registries_run_concurrently_with_block_output(self):
+        """Test that registries overlap and each prints one contiguous block."""
+        registries = [self._slow_registry("Alpha", 3, 0.2), self._slow_registry("Beta", 2, 0.2)]
+
+        start = time.perf_counter()
+        with patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+            reports = main.prune_all(registries, PruneAllUntagged(), dry_run=False)
+        elapsed = time.perf_counter() - start
+
+        self.assertLess(elapsed, 0.35)
+        self.assertEqual([(r.registry_name, r.deleted, r.failed) for r in reports], [("Alpha", 3, 0), ("Beta", 2, 0)])
+        for report in reports:
+            self.assertGreaterEqual(report.elapsed, 0.2)
+
+        output = mock_stdout.getvalue()
+        alpha, beta = output.index("=== Alpha ==="), output.index("=== Beta ===")
+        self.assertLess(alpha, beta)
+        self.assertLess(output.index("Listed Alpha"), beta)
+        self.assertEqual(output[alpha:beta].count("Deleted image: Alpha-"), 3)
+        self.assertNotIn("Beta", output[alpha:beta])
+
+    @patch('main.create_all_registries')
+    @patch('sys.argv', ['main.py', '--container', 'test-container', '--registry', 'all', '--prune-all-untagged'])
+    def test_summary_reports_timing(self, mock_create_registries):
+        """Test that the summary lists per-registry timing and the critical path."""
+        mock_create_registries.return_value = [self._slow_registry("Alpha", 1, 0.05), self._slow_registry("Beta", 1, 0.1)]
+
+        with patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+            main.main()
+
+        output = mock_stdout.getvalue()
+        self.assertRegex(output, r"Alpha: 1 deleted, 0 failed in \d+\.\d\ds")
+        self.assertRegex(output, r"Critical path: Beta \(")
+        self.assertIn("2 images were deleted", output)
+
+
+class TestMultiContainer(unittest.TestCase):
+    """Test pruning several containers in one run."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+
+    def _write(self, content):
+        path = os.path.join(self.dir, 'containers.json')
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_containers_file_strategies(self):
+        """Test that entries use their own strategy or fall back to the CLI one."""
+        path = self._write('["a", {"name": "b", "keep_latest": 5}, {"name": "c", "prune_untagged_age": 7}, '
+                           '{"name": "d", "policy": "latest 3 or tagged"}, '
+                           '{"name": "e", "keep_latest_per_group": 2, "group_by": "^(sha)-"}]')
+
+        targets = main.load_containers_file(path, PruneAllUntagged())
+
+        self.assertEqual([name for name, _ in targets], ["a", "b", "c", "d", "e"])
+        self.assertIsInstance(targets[0][1], PruneAllUntagged)
+        self.assertEqual(targets[1][1].count, 5)
+        self.assertEqual(targets[2][1].days, 7)
+        self.assertEqual(targets[3][1].source, "latest 3 or tagged")
+        self.assertEqual((targets[4][1].count, targets[4][1].group_by), (2, "^(sha)-"))
+
+    def test_containers_file_errors(self):
+        """Test that malformed entries are rejected with a message."""
+        cases = {
+            '{"name": "a"}': "non-empty JSON list",
+            '[{"name": "a", "keep_latest": 1, "prune_all_untagged": true}]': "more than one strategy",
+            '[{"name": "a", "keep": 1}]': "Unknown option",
+            '["a"]': "no strategy",
+            '[': "Cannot read",
+            '[{"name": "a", "policy": "latest"}]': "Expected a number",
+            '[{"name": "a", "keep_latest": 1, "group_by": "semver"}]': "group_by only applies",
+            '[{"name": "a", "keep_latest_per_group": 1, "group_by": 5}]': "a: group_by must be a string, not 5",
+            '[{"name": "a", "prune_untagged_age": "7"}]': "a: prune_untagged_age must be a number, not '7'",
+            '[{"name": "a", "keep_latest": "5"}]': "a: keep_latest must be an integer, not '5'",
+            '[{"name": "a", "keep_latest": 2.5}]': "keep_latest must be",
+            '[{"name": "a", "keep_latest_per_group": true}]': "keep_latest_per_group must be",
+            '[{"name": "a", "prune_all_untagged": 1}]': "prune_all_untagged must be a boolean, not 1",
+            '[{"name": "a", "policy": ["latest 3"]}]': "policy must be a string",
+        }
+        for content, message in cases.items():
+            with self.subTest(content=content):
+                with self.assertRaisesRegex(ValueError, message):
+                    main.load_containers_file(self._write(content), None)
+
+    @patch('main.create_all_registries')
+    @patch('sys.argv', ['main.py', '--container', 'one', 'two', '--registry', 'all', '--prune-all-untagged'])
+    def test_main_prunes_every_container(self, mock_create_registries):
+        """Test that each container gets its own block and summary line."""
+        now = datetime.now().astimezone()
+        registry = MockRegistry("Alpha", [ImageVersion("v1", "untagged", now, [])])
+        registry.container_name = 'one'
+        mock_create_registries.return_value = [registry]
+
+        with patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+            main.main()
+
+        self.assertEqual(mock_create_registries.call_args.args[0], 'one')
+        output = mock_stdout.getvalue()
+        self.assertLess(output.index("=== Alpha (one) ==="), output.index("=== Alpha (two) ==="))
+        self.assertRegex(output, r"Alpha \(two\): 1 deleted, 0 failed")
+        self.assertIn("2 images were deleted", output)
+
+    def test_copies_share_session_and_login(self):
+        """Test that per-container copies reuse one session and one Docker Hub login."""
+        with FakeRegistry('testuser') as server:
+            for repo in ('repo-a', 'repo-b'):
+                server.seed_dockerhub(repo, [
+                    {'name': f'{repo}-v{i}', 'digest': f'sha256:{i:064x}', 'last_updated': '2024-01-01T00:00:00Z'}
+                    for i in range(3)
+                ])
+            base = DockerHubRegistry('testuser', 'testpass', 'repo-a', retry=RetryPolicy(budget=RetryBudget(5)))
+            base.DOCKER_HUB_API = f'{server.url}/v2'
+            clone = base.for_container('repo-b')
+
+            with base:
+                self.assertEqual([v.name for v in clone.list_versions()], [f'repo-b-v{i}' for i in range(3)])
+                self.assertEqual([v.name for v in base.list_versions()], [f'repo-a-v{i}' for i in range(3)])
+
+                self.assertIs(clone.http.session, base.http.session)
+                self.assertIsNot(clone.retry, base.retry)
+                self.assertIs(clone.retry.budget, base.retry.budget)
+                self.assertEqual(server.count('POST', '/v2/auth/token'), 1)
+
+                clone.close()
+                self.assertIsNotNone(base.http._session)
+
+
 class TestMainFunction(unittest.TestCase):
     """Test the main CLI function."""
 
@@ -351,8 +1979,28 @@ if __name__ == '__main__':
     test_classes = [
         TestImageVersion,
         TestPruningStrategies,
+        TestRetentionPolicy,
+        TestVersionTable,
+        TestReferenceGraph,
         TestRegistryFactory,
+        TestDockerHubTagIndex,
+        TestDockerHubBulkDelete,
+        TestDockerHubAuthToken,
+        TestGHCRPagination,
+        TestGHCROrganization,
+        TestGHCRFakeServer,
+        TestCassette,
+        TestMetrics,
+        TestJsonLinesOutput,
+        TestPlanApply,
+        TestRateLimitScheduler,
+        TestRetryPolicy,
+        TestRegistrySession,
+        TestHttpCache,
         TestPruneRegistry,
+        TestStreamingPrune,
+        TestPruneAll,
+        TestMultiContainer,
         TestMainFunction,
         TestCommandLineInterface,
     ]